@@ -29,8 +29,11 @@ fi
 if [[ $1 = 'cron_minutes' ]]; then
 
     # 今日分の JKCommentCrawler を実行
+    ## --incremental パラメータを付けると、前回保存したコメントより新しいコメントだけを既存のログに追記する
+    ## --metrics-jsonl パラメータを付けると、実行ごとの計測結果を JSON Lines 形式で追記する (minutes.log は毎回上書きされるため)
     echo 'JKCommentCrawler.sh (Cron minutes)'
-    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date +"%Y/%m/%d"` --save-dataset-structure-json \
+    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date +"%Y/%m/%d"` --save-dataset-structure-json --incremental \
+    --metrics-jsonl ${SCRIPT_DIR}/log/metrics.jsonl \
     1>  ${SCRIPT_DIR}/log/minutes.log \
     2>> ${SCRIPT_DIR}/log/minutes.error.log
 
@@ -38,11 +41,11 @@ if [[ $1 = 'cron_minutes' ]]; then
 elif [[ $1 = 'cron_daily' ]]; then
 
     # 前日分の JKCommentCrawler を実行（取りこぼし防止）
-    ## --force パラメータを付けると、以前取得したログよりサイズが小さくても強制的に保存する
-    ## ニコ生の実況番組の放送終了後にスパム判定されたコメント (特に AA) がごっそり削除されることがあり、
-    ## それによって新しいログが保存されなくなる事態を避ける
+    ## ニコ生の実況番組の放送終了後にスパム判定されたコメント (特に AA) がごっそり削除されることがあるが、
+    ## 以前取得したログにしかないコメントは今回取得したコメントと合わせて保存されるため、--force は付けない
     echo 'JKCommentCrawler.sh (Cron daily)'
-    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date -d '-1 day' +"%Y/%m/%d"` --save-dataset-structure-json --force \
+    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date -d '-1 day' +"%Y/%m/%d"` --save-dataset-structure-json \
+    --metrics-jsonl ${SCRIPT_DIR}/log/metrics.jsonl \
     1>  ${SCRIPT_DIR}/log/daily.log \
     2>> ${SCRIPT_DIR}/log/daily.error.log
 
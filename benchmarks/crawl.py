@@ -0,0 +1,246 @@
+"""
+JKCommentCrawler のクロール処理のベンチマーク
+NX-Jikkyo API へのリクエストを httpx.MockTransport で記録済み (または合成) のレスポンスに差し替え、
+実際のサーバーにアクセスせずに main() の各段階 (スレッド一覧取得・ダウンロード・解析・マージ/絞り込み・XML 化・書き込み) を個別に計測する
+最後にクローラー全体 (CommentCrawler.crawlChannelOnce()) を通しで計測する
+
+ニコニコ生放送 (NDGRClient) のメッセージサーバーは Protocol Buffers のストリームで模擬が難しいため、
+ベンチマーク対象のチャンネルは本家ニコニコ実況に存在しない jk141 を既定にしている
+
+Usage:
+    poetry run python -m benchmarks.crawl --comments 500000
+    poetry run python -m benchmarks.crawl --fixtures-dir ./recorded/ --date 2024/08/05
+
+記録済みのレスポンスを使う場合は、--fixtures-dir に以下のファイルを配置する
+    channels_{channel_id}_threads.json : /api/v1/channels/{channel_id}/threads のレスポンスボディ
+    threads_{thread_id}.json           : /api/v1/threads/{thread_id} のレスポンスボディ
+"""
+
+import argparse
+import asyncio
+import gc
+import httpx
+import re
+import resource
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from rich import print
+from typing import Any
+
+from benchmarks.fixtures import JST, generateThreadList, generateThreadResponse, getThreadSchedule
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.crawler import CommentCrawler
+from jkcommentcrawler.merge import getDateRange, getDateWithUsec, mergeComments
+from jkcommentcrawler.nicojk import NicojkWriter, formatChat
+from jkcommentcrawler.nx_client import THREAD_RESPONSE_ADAPTER, NXClient
+from jkcommentcrawler.thread_index import ThreadIndex
+
+
+class RecordedResponses:
+    """
+    NX-Jikkyo API のレスポンスを返す httpx.MockTransport のハンドラー
+    """
+
+    def __init__(self, responses: dict[str, bytes], latency: float) -> None:
+        """
+        Args:
+            responses (dict[str, bytes]): URL のパスをキーとしたレスポンスボディ
+            latency (float): 1リクエストあたりに模擬する遅延 (秒)
+        """
+
+        self.responses = responses
+        self.latency = latency
+        self.request_count = 0
+        self.bytes_sent = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.request_count += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        body = self.responses.get(request.url.path)
+        if body is None:
+            return httpx.Response(404, json={'detail': 'Not Found'})
+        self.bytes_sent += len(body)
+        return httpx.Response(200, content=body, headers={'Content-Type': 'application/json'})
+
+
+def loadResponses(fixtures_dir: Path) -> dict[str, bytes]:
+    """
+    記録済みのレスポンスをフォルダから読み込む
+    """
+
+    responses: dict[str, bytes] = {}
+    for path in fixtures_dir.glob('*.json'):
+        if match := re.fullmatch(r'channels_(jk\d+)_threads\.json', path.name):
+            responses[f'/api/v1/channels/{match.group(1)}/threads'] = path.read_bytes()
+        elif match := re.fullmatch(r'threads_(\d+)\.json', path.name):
+            responses[f'/api/v1/threads/{match.group(1)}'] = path.read_bytes()
+    return responses
+
+
+def generateResponses(channel_id: str, target_date: date, comment_count: int, days: int) -> dict[str, bytes]:
+    """
+    指定した日付を含む合成のレスポンスを生成する
+    指定した日付に掛かる2つのスレッド (前日 04:00 ~ 当日 04:00 と当日 04:00 ~ 翌日 04:00) にコメントを振り分ける
+    スレッドの ID は generateThreadList() と同じ getThreadSchedule() から求めるため、スレッド一覧と必ず一致する
+    """
+
+    # 当日 04:00 に始まるスレッドがスレッド一覧の最後から2番目になるようにする
+    first_date = datetime(target_date.year, target_date.month, target_date.day, 4, 0, tzinfo=JST) - timedelta(days=days - 2)
+    day_start = datetime(target_date.year, target_date.month, target_date.day, tzinfo=JST)
+    day_end = day_start + timedelta(days=1)
+    responses = {f'/api/v1/channels/{channel_id}/threads': generateThreadList(channel_id, 1, first_date, days)}
+    for thread_id, start_at in getThreadSchedule(1, first_date, days):
+        # コメントはスレッドの放送時間全体に均等に散らばるため、指定した日付に重なる時間の割合でコメント数を振り分ける
+        overlap = min(day_end, start_at + timedelta(days=1)) - max(day_start, start_at)
+        if overlap <= timedelta(0):
+            continue
+        share = overlap / timedelta(days=1)
+        responses[f'/api/v1/threads/{thread_id}'] = generateThreadResponse(thread_id, channel_id, start_at, int(comment_count * share), seed=thread_id)
+    return responses
+
+
+def getPeakRSS() -> float:
+    """
+    プロセス開始からのピーク RSS (MiB) を返す
+    """
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimer:
+    """
+    各段階の実行時間・処理件数・処理バイト数・終了時点のピーク RSS を記録する
+    """
+
+    def __init__(self) -> None:
+        self.results: list[tuple[str, float, int, int, float]] = []
+
+    def record(self, name: str, start: float, items: int = 0, size: int = 0) -> None:
+        self.results.append((name, time.perf_counter() - start, items, size, getPeakRSS()))
+
+    def report(self) -> None:
+        print(f'{"stage":>10} {"seconds":>9} {"items/s":>14} {"MiB/s":>9} {"peak RSS":>11}')
+        for name, seconds, items, size, peak_rss in self.results:
+            items_per_second = f'{items / seconds:,.0f}' if items > 0 and seconds > 0 else '-'
+            mib_per_second = f'{size / seconds / 1024 / 1024:.1f}' if size > 0 and seconds > 0 else '-'
+            print(f'{name:>10} {seconds:9.3f} {items_per_second:>14} {mib_per_second:>9} {peak_rss:8.1f} MiB')
+
+
+async def benchmarkStages(channel_id: str, target_date: date, work_dir: Path, timer: StageTimer) -> None:
+    """
+    main() の処理を段階ごとに分けて計測する
+    """
+
+    # スレッド一覧取得 (インデックスが空の状態から)
+    start = time.perf_counter()
+    thread_index = ThreadIndex(work_dir / 'stages.db')
+    thread_ids = await thread_index.getThreadIDsOnDate(channel_id, target_date)
+    thread_index.close()
+    timer.record('listing', start, len(thread_ids))
+
+    # ダウンロード (解析はせずにレスポンスボディを受信するだけ)
+    start = time.perf_counter()
+    bodies: list[bytes] = []
+    for thread_id in thread_ids:
+        response = await NXClient.getHTTPClient().get(f'https://nx-jikkyo.tsukumijima.net/api/v1/threads/{thread_id}')
+        response.raise_for_status()
+        bodies.append(response.content)
+    timer.record('download', start, len(bodies), sum(len(body) for body in bodies))
+
+    # 解析 (NXClient.downloadComments() と同じく、キャッシュ済みの TypeAdapter で検証して Comment に変換)
+    start = time.perf_counter()
+    nx_client = NXClient(0)
+    sources: list[list[Comment]] = []
+    for body in bodies:
+        comments: list[Comment] = []
+        for comment in THREAD_RESPONSE_ADAPTER.validate_json(body).comments:
+            nx_client.convertComment(comment, comments, ignore_nicolive_comments=True)
+        comments.sort(key=getDateWithUsec)
+        sources.append(comments)
+    del bodies
+    timer.record('decode', start, sum(len(source) for source in sources))
+
+    # マージ・日付での絞り込み
+    start = time.perf_counter()
+    merged = list(mergeComments(sources, *getDateRange(target_date)))
+    timer.record('merge', start, len(merged))
+
+    # XML 化
+    start = time.perf_counter()
+    lines = [formatChat(comment).encode('utf-8') for comment in merged]
+    timer.record('serialize', start, len(lines), sum(len(line) for line in lines))
+
+    # 書き込み (ハッシュの算出・一時ファイルへの書き込みとアトミックな置き換え)
+    start = time.perf_counter()
+    with NicojkWriter(work_dir / 'stages.nicojk') as writer:
+        for line in lines:
+            writer.writeRaw(line)
+        writer.commit()
+    timer.record('write', start, len(lines), writer.size)
+
+
+async def benchmarkCrawler(channel_id: str, target_date: date, work_dir: Path, timer: StageTimer) -> None:
+    """
+    クローラー全体を通しで計測する
+    """
+
+    crawler = CommentCrawler(
+        kakolog_dir = work_dir / 'kakolog',
+        niconico_mail = '',
+        niconico_password = '',
+        database_path = work_dir / 'crawler.db',
+    )
+    try:
+        start = time.perf_counter()
+        count = await crawler.crawlChannelOnce(channel_id, target_date)
+        output_file = crawler.getOutputFile(channel_id, target_date)
+        timer.record('crawl', start, count, output_file.stat().st_size if output_file.exists() else 0)
+    finally:
+        await crawler.nicolive_session.close()
+        crawler.manifest.close()
+        crawler.thread_index.close()
+
+
+async def run(args: Any) -> None:
+    target_date = datetime.strptime(args.date, '%Y/%m/%d').date()
+    if args.fixtures_dir is not None:
+        responses = loadResponses(args.fixtures_dir)
+    else:
+        responses = generateResponses(args.channel_id, target_date, args.comments, args.days)
+    handler = RecordedResponses(responses, args.latency / 1000)
+    print(f'Fixtures: {len(responses)} responses, {sum(len(body) for body in responses.values()) / 1024 / 1024:.1f} MiB')
+    print(f'Peak RSS after loading fixtures: {getPeakRSS():.1f} MiB')
+
+    # NXClient が共有する HTTP クライアントを、記録済みのレスポンスを返すクライアントに差し替える
+    NXClient.setHTTPClient(httpx.AsyncClient(
+        transport = httpx.MockTransport(handler),
+        headers = {'User-Agent': NXClient.USER_AGENT},
+    ))
+
+    timer = StageTimer()
+    with tempfile.TemporaryDirectory() as work_dir:
+        await benchmarkStages(args.channel_id, target_date, Path(work_dir), timer)
+        gc.collect()
+        await benchmarkCrawler(args.channel_id, target_date, Path(work_dir), timer)
+    await NXClient.closeHTTPClient()
+
+    timer.report()
+    print(f'HTTP requests: {handler.request_count}, {handler.bytes_sent / 1024 / 1024:.1f} MiB sent by the mock transport')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark for JKCommentCrawler using recorded NX-Jikkyo responses.')
+    parser.add_argument('--channel-id', default='jk141', help='Channel ID to crawl (should not exist on Nicolive).')
+    parser.add_argument('--date', default='2024/08/05', help='Date to crawl (YYYY/MM/DD).')
+    parser.add_argument('--comments', type=int, default=500000, help='Number of synthetic comments across the threads on the date.')
+    parser.add_argument('--days', type=int, default=365, help='Number of synthetic threads in the channel thread list.')
+    parser.add_argument('--latency', type=float, default=0, help='Simulated latency per request in milliseconds.')
+    parser.add_argument('--fixtures-dir', type=Path, default=None, help='Directory containing recorded responses.')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
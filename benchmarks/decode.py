@@ -0,0 +1,127 @@
+"""
+NX-Jikkyo のスレッド取得 API のレスポンスの解析処理のベンチマーク
+以前の実装 (呼び出しごとにモデルと TypeAdapter を作り直して一括で validate_json する) と、
+現在の実装 (モジュールレベルでキャッシュした TypeAdapter で validate_json して直接 Comment に変換する) を比較する
+
+Usage:
+    poetry run python -m benchmarks.decode --comments 100000
+    poetry run python -m benchmarks.decode --input ./recorded_thread_response.json
+"""
+
+import argparse
+import gc
+import time
+from datetime import datetime
+from ndgr_client import XMLCompatibleComment
+from pathlib import Path
+from pydantic import BaseModel, TypeAdapter
+from rich import print
+from typing import Any, Callable, Literal
+
+from benchmarks.fixtures import JST, generateThreadResponse
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.nx_client import THREAD_RESPONSE_ADAPTER, NXClient
+
+
+def decodeLegacy(body: bytes) -> list[XMLCompatibleComment]:
+    """
+    以前の NXClient.downloadBackwardComments() と同じ方法でレスポンスを解析する
+    """
+
+    class CommentResponse(BaseModel):
+        id: int
+        thread_id: int
+        no: int
+        vpos: int
+        date: datetime
+        mail: str
+        user_id: str
+        premium: bool
+        anonymity: bool
+        content: str
+
+    class ThreadResponse(BaseModel):
+        id: int
+        channel_id: str
+        start_at: datetime
+        end_at: datetime
+        duration: int
+        title: str
+        description: str
+        status: Literal['ACTIVE', 'UPCOMING', 'PAST']
+        comments: list[CommentResponse]
+
+    thread: ThreadResponse = TypeAdapter(ThreadResponse).validate_json(body)
+    thread.comments.sort(key=lambda x: x.date)
+    xml_compatible_comments: list[XMLCompatibleComment] = []
+    for comment in thread.comments:
+        if comment.user_id.startswith('nicolive:') is True:
+            continue
+        xml_compatible_comments.append(XMLCompatibleComment(
+            thread = str(comment.thread_id),
+            no = comment.no,
+            vpos = comment.vpos,
+            date = int(comment.date.timestamp()),
+            date_usec = int((comment.date.timestamp() % 1) * 1000000),
+            mail = comment.mail,
+            user_id = comment.user_id,
+            premium = 1 if comment.premium is True else None,
+            anonymity = 1 if comment.anonymity is True else None,
+            content = comment.content,
+        ))
+    return xml_compatible_comments
+
+
+def decodeCachedAdapter(body: bytes) -> list[Comment]:
+    """
+    現在の NXClient.downloadComments() と同じ方法で、モジュールレベルでキャッシュした TypeAdapter でレスポンスを解析する
+    """
+
+    nx_client = NXClient(0)
+    comments: list[Comment] = []
+    for comment in THREAD_RESPONSE_ADAPTER.validate_json(body).comments:
+        nx_client.convertComment(comment, comments, ignore_nicolive_comments=True)
+    comments.sort(key=lambda x: x.date_with_usec)
+    return comments
+
+
+def measure(function: Callable[[bytes], list[Any]], body: bytes, repeat: int) -> tuple[float, int]:
+    """
+    関数を repeat 回実行し、最速の実行時間と返されたコメント数を返す
+    """
+
+    best = float('inf')
+    count = 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        count = len(function(body))
+        best = min(best, time.perf_counter() - start)
+    return best, count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark for decoding NX-Jikkyo thread responses.')
+    parser.add_argument('--input', type=Path, default=None, help='Recorded /api/v1/threads/{id} response body to decode.')
+    parser.add_argument('--comments', type=int, default=100000, help='Number of synthetic comments when --input is not specified.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per decoder (the fastest run is reported).')
+    args = parser.parse_args()
+
+    if args.input is not None:
+        body = args.input.read_bytes()
+    else:
+        body = generateThreadResponse(1, 'jk1', datetime(2024, 8, 5, 4, 0, tzinfo=JST), args.comments)
+    print(f'Response size: {len(body) / 1024 / 1024:.1f} MiB')
+
+    results: dict[str, tuple[float, int]] = {
+        'legacy (validate_json)': measure(decodeLegacy, body, args.repeat),
+        'cached adapter (validate_json)': measure(decodeCachedAdapter, body, args.repeat),
+    }
+    legacy_seconds = results['legacy (validate_json)'][0]
+    for name, (seconds, count) in results.items():
+        print(f'{name:>34}: {seconds:8.3f} s  {count / seconds:>12,.0f} comments/s  '
+              f'{len(body) / seconds / 1024 / 1024:8.1f} MiB/s  (x{legacy_seconds / seconds:.2f})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import json
+import random
+from datetime import datetime, timedelta, timezone
+
+
+# NX-Jikkyo API が返す日時のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+# 合成コメントの本文の候補
+CONTENTS = [
+    'きたあああああああああ',
+    'ｷﾀ━━━━(ﾟ∀ﾟ)━━━━!!',
+    'ｗｗｗｗｗｗｗ',
+    '888888888',
+    'かわいい',
+    '<script>&"エスケープ"</script>',
+    '🐡 🐡 🐡 🐡 🐡 三三三三三三',
+]
+
+
+def generateThreadResponse(thread_id: int, channel_id: str, start_at: datetime, comment_count: int, seed: int = 0) -> bytes:
+    """
+    NX-Jikkyo のスレッド取得 API (/api/v1/threads/{thread_id}) のレスポンスを模した合成データを生成する
+    コメントは 04:00 ~ 翌日 04:00 のスレッドの放送時間全体に均等に散らばる
+
+    Args:
+        thread_id (int): スレッド ID
+        channel_id (str): 実況チャンネル ID
+        start_at (datetime): スレッドの放送開始日時 (タイムゾーン付き)
+        comment_count (int): 生成するコメントの数
+        seed (int, default=0): 乱数のシード
+
+    Returns:
+        bytes: JSON 形式のレスポンスボディ
+    """
+
+    rng = random.Random(seed)
+    end_at = start_at + timedelta(days=1)
+    duration = int((end_at - start_at).total_seconds())
+    comments = []
+    for no in range(1, comment_count + 1):
+        offset = duration * no / (comment_count + 1)
+        comments.append({
+            'id': thread_id * 10000000 + no,
+            'thread_id': thread_id,
+            'no': no,
+            'vpos': int(offset * 100),
+            'date': (start_at + timedelta(seconds=offset)).isoformat(),
+            'mail': '184',
+            # 1割程度はニコニコ実況からリアルタイムマージされたコメントにする
+            'user_id': f'nicolive:a:{rng.randrange(100000)}' if rng.random() < 0.1 else f'user-{rng.randrange(100000)}',
+            'premium': rng.random() < 0.3,
+            'anonymity': True,
+            'content': rng.choice(CONTENTS),
+        })
+    return json.dumps({
+        'id': thread_id,
+        'channel_id': channel_id,
+        'start_at': start_at.isoformat(),
+        'end_at': end_at.isoformat(),
+        'duration': duration,
+        'title': f'{channel_id} 合成スレッド {thread_id}',
+        'description': '',
+        'status': 'PAST',
+        'comments': comments,
+    }, ensure_ascii=False).encode('utf-8')
+
+
+def getThreadSchedule(first_thread_id: int, first_date: datetime, days: int) -> list[tuple[int, datetime]]:
+    """
+    合成のスレッド一覧に含まれるスレッドの ID と放送開始日時を返す
+    スレッドは first_date の 04:00 から1日ずつ途切れなく作成される
+    generateThreadList() とスレッドのレスポンスの生成の両方でこの関数を使い、スレッド ID が必ず一致するようにする
+
+    Args:
+        first_thread_id (int): 最初のスレッドのスレッド ID (以降1ずつ増える)
+        first_date (datetime): 最初のスレッドの放送開始日時 (タイムゾーン付き)
+        days (int): スレッドの数 (日数)
+
+    Returns:
+        list[tuple[int, datetime]]: スレッド ID と放送開始日時のタプルのリスト (放送開始日時昇順)
+    """
+
+    return [(first_thread_id + index, first_date + timedelta(days=index)) for index in range(days)]
+
+
+def generateThreadList(channel_id: str, first_thread_id: int, first_date: datetime, days: int) -> bytes:
+    """
+    NX-Jikkyo のスレッド情報取得 API (/api/v1/channels/{channel_id}/threads) のレスポンスを模した合成データを生成する
+    スレッドは first_date の 04:00 から1日ずつ途切れなく作成され、最後のスレッドだけが放送中 (ACTIVE) になる
+
+    Args:
+        channel_id (str): 実況チャンネル ID
+        first_thread_id (int): 最初のスレッドのスレッド ID (以降1ずつ増える)
+        first_date (datetime): 最初のスレッドの放送開始日時 (タイムゾーン付き)
+        days (int): 生成するスレッドの数 (日数)
+
+    Returns:
+        bytes: JSON 形式のレスポンスボディ
+    """
+
+    threads = []
+    for index, (thread_id, start_at) in enumerate(getThreadSchedule(first_thread_id, first_date, days)):
+        threads.append({
+            'id': thread_id,
+            'start_at': start_at.isoformat(),
+            'end_at': (start_at + timedelta(days=1)).isoformat(),
+            'title': f'{channel_id} 合成スレッド {thread_id}',
+            'description': '',
+            'status': 'ACTIVE' if index == days - 1 else 'PAST',
+        })
+    return json.dumps(threads, ensure_ascii=False).encode('utf-8')
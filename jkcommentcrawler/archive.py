@@ -0,0 +1,611 @@
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+import typer
+import zlib
+from dataclasses import dataclass, field
+from ndgr_client.utils import AsyncTyper
+from pathlib import Path
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+from types import TracebackType
+from typing import Iterable, Iterator, Self
+
+from jkcommentcrawler import __version__
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.nicojk import formatChat, hashFile, iterComments, parseChunks
+
+
+# 圧縮アーカイブの拡張子と、ブロックの索引 (サイドカーファイル) の拡張子
+ARCHIVE_SUFFIX = '.nicojkz'
+INDEX_SUFFIX = '.nicojkz.idx'
+
+# 索引ファイルのヘッダー (マジックナンバー・バージョン・ブロック数・作成元の .nicojk ファイルの SHA-256 ハッシュとサイズ)
+## 作成元の .nicojk ファイルの内容を記録しておき、--archive なしで .nicojk ファイルが書き換えられた後の古いアーカイブを読み込まないようにする
+INDEX_HEADER = struct.Struct('<4sHI32sQ')
+INDEX_MAGIC = b'NJKI'
+INDEX_VERSION = 2
+
+# 索引ファイルのブロックごとのエントリ
+## オフセット・圧縮後のサイズ・圧縮前のサイズ・コメント数・最初と最後のコメントの投稿日時・vpos の最小値と最大値
+INDEX_ENTRY = struct.Struct('<QIII2d2q')
+
+
+@dataclass(slots=True)
+class ArchiveBlock:
+    """
+    圧縮アーカイブ内の1ブロックの情報
+    """
+
+    # アーカイブ内のブロックの開始位置 (バイト)
+    offset: int
+    # 圧縮後のサイズ (バイト)
+    compressed_size: int
+    # 圧縮前のサイズ (バイト)
+    raw_size: int
+    # ブロック内のコメント数
+    count: int
+    # ブロック内の最初のコメントの投稿日時 (UNIX タイムスタンプ、マイクロ秒単位まで)
+    first_date_with_usec: float
+    # ブロック内の最後のコメントの投稿日時 (UNIX タイムスタンプ、マイクロ秒単位まで)
+    last_date_with_usec: float
+    # ブロック内のコメントの vpos の最小値
+    min_vpos: int
+    # ブロック内のコメントの vpos の最大値
+    max_vpos: int
+
+
+@dataclass(slots=True)
+class ArchiveIndex:
+    """
+    圧縮アーカイブの索引ファイルの内容
+    """
+
+    # 圧縮アーカイブの作成元の .nicojk ファイルの内容の SHA-256 ハッシュ (16進数表記)
+    source_sha256: str
+    # 圧縮アーカイブの作成元の .nicojk ファイルのサイズ (バイト)
+    source_size: int
+    # ブロックの情報のリスト (アーカイブ内の順序)
+    blocks: list[ArchiveBlock] = field(default_factory=list)
+
+
+    def matches(self, nicojk_path: Path, sha256: str | None = None) -> bool:
+        """
+        圧縮アーカイブが .nicojk ファイルの現在の内容から作成されたものかどうかを判定する
+        サイズが異なる場合は、.nicojk ファイルを読み込まずに一致しないと判定する
+
+        Args:
+            nicojk_path (Path): .nicojk ファイルのパス
+            sha256 (str | None, default=None): .nicojk ファイルの内容の SHA-256 ハッシュ (None の場合は .nicojk ファイルを読み込んで算出する)
+
+        Returns:
+            bool: 一致する場合は True
+        """
+
+        if nicojk_path.exists() is False or nicojk_path.stat().st_size != self.source_size:
+            return False
+        return (sha256 if sha256 is not None else hashFile(nicojk_path)) == self.source_sha256
+
+
+def getArchivePath(nicojk_path: Path) -> Path:
+    """
+    .nicojk ファイルに対応する圧縮アーカイブのパスを取得する
+
+    Args:
+        nicojk_path (Path): .nicojk ファイルのパス
+
+    Returns:
+        Path: 圧縮アーカイブ (.nicojkz) のパス
+    """
+
+    return nicojk_path.with_suffix(ARCHIVE_SUFFIX)
+
+
+def getIndexPath(archive_path: Path) -> Path:
+    """
+    圧縮アーカイブに対応する索引ファイルのパスを取得する
+
+    Args:
+        archive_path (Path): 圧縮アーカイブ (.nicojkz) のパス
+
+    Returns:
+        Path: 索引ファイル (.nicojkz.idx) のパス
+    """
+
+    return archive_path.with_suffix(INDEX_SUFFIX)
+
+
+def readIndex(index_path: Path) -> ArchiveIndex:
+    """
+    索引ファイルを読み込む
+
+    Args:
+        index_path (Path): 索引ファイルのパス
+
+    Returns:
+        ArchiveIndex: 索引ファイルの内容
+
+    Raises:
+        ValueError: 索引ファイルの形式が不正な場合 (以前のバージョンの索引ファイルを含む)
+    """
+
+    data = index_path.read_bytes()
+    if len(data) < INDEX_HEADER.size:
+        raise ValueError(f'Invalid archive index: {index_path}')
+    magic, version, block_count, source_sha256, source_size = INDEX_HEADER.unpack_from(data)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION or len(data) != INDEX_HEADER.size + INDEX_ENTRY.size * block_count:
+        raise ValueError(f'Invalid archive index: {index_path}')
+    blocks = [ArchiveBlock(*entry) for entry in INDEX_ENTRY.iter_unpack(data[INDEX_HEADER.size:])]
+    return ArchiveIndex(source_sha256.hex(), source_size, blocks)
+
+
+def writeIndex(index_path: Path, index: ArchiveIndex) -> None:
+    """
+    索引ファイルにアトミックに書き込む
+
+    Args:
+        index_path (Path): 索引ファイルのパス
+        index (ArchiveIndex): 索引ファイルの内容
+    """
+
+    data = bytearray(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(index.blocks), bytes.fromhex(index.source_sha256), index.source_size))
+    for block in index.blocks:
+        data += INDEX_ENTRY.pack(
+            block.offset, block.compressed_size, block.raw_size, block.count,
+            block.first_date_with_usec, block.last_date_with_usec, block.min_vpos, block.max_vpos,
+        )
+    fd, temp_path = tempfile.mkstemp(dir=index_path.parent, prefix=f'.{index_path.name}.', suffix='.tmp')
+    try:
+        with open(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, index_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def isArchiveUpToDate(nicojk_path: Path, sha256: str | None = None) -> bool:
+    """
+    .nicojk ファイルに対応する圧縮アーカイブと索引ファイルが揃っていて、.nicojk ファイルの現在の内容から作成されたものかどうかを判定する
+    索引ファイルが以前のバージョンの形式の場合も、作成元を確認できないため一致しないと判定する
+
+    Args:
+        nicojk_path (Path): .nicojk ファイルのパス
+        sha256 (str | None, default=None): .nicojk ファイルの内容の SHA-256 ハッシュ (None の場合は .nicojk ファイルを読み込んで算出する)
+
+    Returns:
+        bool: 圧縮アーカイブが最新の場合は True
+    """
+
+    archive_path = getArchivePath(nicojk_path)
+    index_path = getIndexPath(archive_path)
+    if archive_path.exists() is False or index_path.exists() is False:
+        return False
+    try:
+        index = readIndex(index_path)
+    except ValueError:
+        return False
+    return index.matches(nicojk_path, sha256)
+
+
+class BlockEncoder:
+    """
+    コメントを .nicojk 形式に変換しながらブロックにまとめ、ブロックごとに zlib で圧縮する
+    各ブロックは独立した zlib ストリームのため、アーカイブの途中のブロックだけを展開できる
+    """
+
+    # 1ブロックあたりの圧縮前のサイズの目安 (バイト)
+    ## 小さいほど範囲指定での読み込みで展開する量が減るが、圧縮率は下がる
+    BLOCK_SIZE = 128 * 1024
+
+    # zlib の圧縮レベル
+    COMPRESSION_LEVEL = 6
+
+
+    def __init__(self, offset: int = 0) -> None:
+        """
+        BlockEncoder のコンストラクタ
+
+        Args:
+            offset (int, default=0): 最初のブロックを書き込むアーカイブ内の位置 (バイト)
+        """
+
+        self.offset = offset
+        self.lines: list[bytes] = []
+        self.raw_size = 0
+        self.first_date_with_usec = 0.0
+        self.last_date_with_usec = 0.0
+        self.min_vpos = 0
+        self.max_vpos = 0
+
+
+    def add(self, comment: Comment, line: bytes | None = None) -> tuple[ArchiveBlock, bytes] | None:
+        """
+        コメントを1件追加し、ブロックが BLOCK_SIZE に達した場合は圧縮したブロックを返す
+
+        Args:
+            comment (Comment): 追加するコメント
+            line (bytes | None, default=None): formatChat() で変換済みの <chat> 要素 (None の場合はここで変換する)
+
+        Returns:
+            tuple[ArchiveBlock, bytes] | None: ブロックの情報と圧縮したデータ (ブロックがまだ満たされていない場合は None)
+        """
+
+        if line is None:
+            line = formatChat(comment).encode('utf-8')
+        if len(self.lines) == 0:
+            self.first_date_with_usec = comment.date_with_usec
+            self.min_vpos = self.max_vpos = comment.vpos
+        else:
+            self.min_vpos = min(self.min_vpos, comment.vpos)
+            self.max_vpos = max(self.max_vpos, comment.vpos)
+        self.last_date_with_usec = comment.date_with_usec
+        self.lines.append(line)
+        self.raw_size += len(line)
+        if self.raw_size >= self.BLOCK_SIZE:
+            return self.flush()
+        return None
+
+
+    def flush(self) -> tuple[ArchiveBlock, bytes] | None:
+        """
+        追加済みのコメントを1ブロックに圧縮して返す
+
+        Returns:
+            tuple[ArchiveBlock, bytes] | None: ブロックの情報と圧縮したデータ (追加済みのコメントがない場合は None)
+        """
+
+        if len(self.lines) == 0:
+            return None
+        data = zlib.compress(b''.join(self.lines), self.COMPRESSION_LEVEL)
+        block = ArchiveBlock(
+            offset = self.offset,
+            compressed_size = len(data),
+            raw_size = self.raw_size,
+            count = len(self.lines),
+            first_date_with_usec = self.first_date_with_usec,
+            last_date_with_usec = self.last_date_with_usec,
+            min_vpos = self.min_vpos,
+            max_vpos = self.max_vpos,
+        )
+        self.offset += len(data)
+        self.lines = []
+        self.raw_size = 0
+        return block, data
+
+
+class NicojkArchiveWriter:
+    """
+    コメントを圧縮アーカイブ (.nicojkz) と索引ファイル (.nicojkz.idx) にストリーミングで書き込むライター
+    NicojkWriter と同様に一時ファイルに書き込み、commit() を呼び出した時点でアトミックに置き換える
+    コメントは投稿日時昇順で書き込む必要がある
+
+    Usage:
+        with NicojkArchiveWriter(path) as writer:
+            writer.writeAll(comments)
+            writer.commit(nicojk_sha256, nicojk_size)
+    """
+
+    def __init__(self, archive_path: Path) -> None:
+        """
+        NicojkArchiveWriter のコンストラクタ
+
+        Args:
+            archive_path (Path): 最終的に書き込む圧縮アーカイブのパス
+        """
+
+        self.path = archive_path
+        self.blocks: list[ArchiveBlock] = []
+        self.encoder = BlockEncoder()
+        self.committed = False
+
+        archive_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=archive_path.parent, prefix=f'.{archive_path.name}.', suffix='.tmp')
+        self.temp_path = Path(temp_path)
+        self.file = open(fd, 'wb')
+
+
+    def __enter__(self) -> Self:
+        return self
+
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        # commit() されなかった場合は一時ファイルを破棄する
+        if self.committed is False:
+            self.discard()
+
+
+    def write(self, comment: Comment, line: bytes | None = None) -> None:
+        """
+        コメントを1件書き込む
+
+        Args:
+            comment (Comment): 書き込むコメント
+            line (bytes | None, default=None): formatChat() で変換済みの <chat> 要素 (NicojkWriter と変換結果を共有する場合に指定する)
+        """
+
+        self.writeBlock(self.encoder.add(comment, line))
+
+
+    def writeAll(self, comments: Iterable[Comment]) -> None:
+        """
+        コメントのイテレーターからすべてのコメントを順に書き込む
+
+        Args:
+            comments (Iterable[Comment]): 書き込むコメントのイテレーター (投稿日時昇順)
+        """
+
+        for comment in comments:
+            self.write(comment)
+
+
+    def copyBlocks(self, archive_path: Path, blocks: list[ArchiveBlock]) -> None:
+        """
+        既存の圧縮アーカイブの先頭から、指定したブロックまでを圧縮したまま書き込む
+        既存のアーカイブに追記する場合に、書き直さないブロックを展開せずに引き継ぐために使う
+        コメントを書き込む前に呼び出す必要がある
+
+        Args:
+            archive_path (Path): 既存の圧縮アーカイブのパス
+            blocks (list[ArchiveBlock]): 引き継ぐブロックの情報のリスト (アーカイブの先頭から途切れずに並んでいる必要がある)
+        """
+
+        offset = blocks[-1].offset + blocks[-1].compressed_size if len(blocks) > 0 else 0
+        remaining = offset
+        with open(archive_path, 'rb') as f:
+            while remaining > 0:
+                data = f.read(min(remaining, 1024 * 1024))
+                if len(data) == 0:
+                    raise ValueError(f'Archive is shorter than its index: {archive_path}')
+                self.file.write(data)
+                remaining -= len(data)
+        self.blocks = list(blocks)
+        self.encoder = BlockEncoder(offset)
+
+
+    def writeBlock(self, encoded: tuple[ArchiveBlock, bytes] | None) -> None:
+        """
+        BlockEncoder が圧縮したブロックを書き込む
+
+        Args:
+            encoded (tuple[ArchiveBlock, bytes] | None): ブロックの情報と圧縮したデータ (None の場合は何もしない)
+        """
+
+        if encoded is not None:
+            block, data = encoded
+            self.file.write(data)
+            self.blocks.append(block)
+
+
+    def commit(self, source_sha256: str, source_size: int) -> None:
+        """
+        残りのコメントをブロックとして書き出し、圧縮アーカイブと索引ファイルを置き換える
+        古い索引ファイルが新しいアーカイブを指した状態で残らないよう、アーカイブを置き換える前に古い索引ファイルを削除し、置き換えた後に新しい索引ファイルを書き込む
+        途中で中断された場合は索引ファイルがない状態になり、圧縮アーカイブは最新でないとみなされて次回作り直される
+
+        Args:
+            source_sha256 (str): 作成元の .nicojk ファイルの内容の SHA-256 ハッシュ (16進数表記)
+            source_size (int): 作成元の .nicojk ファイルのサイズ (バイト)
+        """
+
+        self.writeBlock(self.encoder.flush())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.chmod(self.temp_path, 0o644)
+        getIndexPath(self.path).unlink(missing_ok=True)
+        os.replace(self.temp_path, self.path)
+        writeIndex(getIndexPath(self.path), ArchiveIndex(source_sha256, source_size, self.blocks))
+        self.committed = True
+
+
+    def discard(self) -> None:
+        """
+        書き込んだ内容を破棄し、一時ファイルを削除する
+        """
+
+        self.file.close()
+        self.temp_path.unlink(missing_ok=True)
+
+
+def appendArchive(archive_path: Path, comments: list[Comment], source_sha256: str, source_size: int) -> None:
+    """
+    既存の圧縮アーカイブの末尾にコメントを追記する
+    追記を繰り返しても小さなブロックばかりにならないよう、最後のブロックが BLOCK_SIZE に満たない場合はそのブロックを展開して追記するコメントとまとめ直す
+    既存のアーカイブはその場で書き換えず、NicojkArchiveWriter で一時ファイルに書き直してからアトミックに置き換える
+    事前に isArchiveUpToDate() で、圧縮アーカイブが追記前の .nicojk ファイルから作成されたものであることを確認しておく必要がある (そうでない場合は buildArchive() で作り直す)
+
+    Args:
+        archive_path (Path): 圧縮アーカイブのパス
+        comments (list[Comment]): 追記するコメントのリスト (投稿日時昇順で、既存のコメントより新しい必要がある)
+        source_sha256 (str): 追記後の .nicojk ファイルの内容の SHA-256 ハッシュ (16進数表記)
+        source_size (int): 追記後の .nicojk ファイルのサイズ (バイト)
+    """
+
+    index_path = getIndexPath(archive_path)
+    blocks = readIndex(index_path).blocks
+
+    # 最後のブロックが小さい場合は、そのブロックの位置から書き直す
+    if len(blocks) > 0 and blocks[-1].raw_size < BlockEncoder.BLOCK_SIZE:
+        last_block = blocks.pop()
+        with open(archive_path, 'rb') as f:
+            f.seek(last_block.offset)
+            data = zlib.decompress(f.read(last_block.compressed_size))
+        comments = list(parseChunks([data])) + comments
+
+    # 書き直さないブロックは圧縮したまま引き継ぎ、その後ろに追記するコメントを書き込む
+    ## 中断された場合は一時ファイルが破棄され、既存のアーカイブと索引ファイルはそのまま残る
+    with NicojkArchiveWriter(archive_path) as writer:
+        writer.copyBlocks(archive_path, blocks)
+        writer.writeAll(comments)
+        writer.commit(source_sha256, source_size)
+
+
+def buildArchive(nicojk_path: Path) -> Path:
+    """
+    既存の .nicojk ファイルから圧縮アーカイブと索引ファイルを作成する
+
+    Args:
+        nicojk_path (Path): .nicojk ファイルのパス
+
+    Returns:
+        Path: 作成した圧縮アーカイブのパス
+    """
+
+    archive_path = getArchivePath(nicojk_path)
+    with NicojkArchiveWriter(archive_path) as writer:
+        writer.writeAll(iterComments(nicojk_path))
+        writer.commit(hashFile(nicojk_path), nicojk_path.stat().st_size)
+    return archive_path
+
+
+class NicojkArchiveReader:
+    """
+    圧縮アーカイブ (.nicojkz) を mmap で開き、指定した範囲のコメントを含むブロックだけを展開して読み込むリーダー
+    索引ファイル (.nicojkz.idx) にブロックごとの投稿日時と vpos の範囲が記録されているため、範囲外のブロックは読み込まずに済む
+    作成元の .nicojk ファイルを指定した場合は、圧縮アーカイブがその現在の内容から作成されたものでなければ開かない
+
+    Usage:
+        with NicojkArchiveReader(path, nicojk_path) as reader:
+            for comment in reader.readDateRange(start, end):
+                ...
+    """
+
+    def __init__(self, archive_path: Path, nicojk_path: Path | None = None) -> None:
+        """
+        NicojkArchiveReader のコンストラクタ
+
+        Args:
+            archive_path (Path): 圧縮アーカイブのパス
+            nicojk_path (Path | None, default=None): 作成元の .nicojk ファイルのパス (指定した場合は圧縮アーカイブが最新かどうかを確認する)
+
+        Raises:
+            ValueError: 索引ファイルの形式が不正な場合や、圧縮アーカイブが作成元の .nicojk ファイルの現在の内容から作成されたものでない場合
+        """
+
+        self.path = archive_path
+        index = readIndex(getIndexPath(archive_path))
+        if nicojk_path is not None and index.matches(nicojk_path) is False:
+            raise ValueError(f'Archive is out of date: {archive_path}')
+        self.blocks = index.blocks
+
+        # 二分探索用に、各ブロックの最後のコメントの投稿日時を並べておく
+        self.last_dates = [block.last_date_with_usec for block in self.blocks]
+
+        self.file = open(archive_path, 'rb')
+        self.mmap: mmap.mmap | None = None
+        if archive_path.stat().st_size > 0:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+    def __enter__(self) -> Self:
+        return self
+
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        self.close()
+
+
+    def close(self) -> None:
+        """
+        mmap とファイルを閉じる
+        """
+
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        self.file.close()
+
+
+    def readBlock(self, block: ArchiveBlock) -> Iterator[Comment]:
+        """
+        1ブロックを展開し、ブロック内のコメントを順に返す
+
+        Args:
+            block (ArchiveBlock): 展開するブロック
+
+        Yields:
+            Comment: ブロック内のコメント
+        """
+
+        assert self.mmap is not None
+        yield from parseChunks([zlib.decompress(self.mmap[block.offset:block.offset + block.compressed_size])])
+
+
+    def readDateRange(self, start: float, end: float) -> Iterator[Comment]:
+        """
+        指定した投稿日時の範囲のコメントを、範囲を含むブロックだけを展開して順に返す
+
+        Args:
+            start (float): 範囲の開始 (この値を含む) の UNIX タイムスタンプ
+            end (float): 範囲の終了 (この値を含まない) の UNIX タイムスタンプ
+
+        Yields:
+            Comment: 指定した範囲に投稿されたコメント (投稿日時昇順)
+        """
+
+        # 最後のコメントが範囲の開始以降のブロックから読み始め、最初のコメントが範囲の終了以降のブロックで読み終える
+        for index in range(bisect.bisect_left(self.last_dates, start), len(self.blocks)):
+            block = self.blocks[index]
+            if block.first_date_with_usec >= end:
+                break
+            for comment in self.readBlock(block):
+                if start <= comment.date_with_usec < end:
+                    yield comment
+
+
+    def readVposRange(self, start_vpos: int, end_vpos: int) -> Iterator[Comment]:
+        """
+        指定した vpos の範囲のコメントを、範囲と重なるブロックだけを展開して順に返す
+        vpos はスレッドごとの経過時間のため、ブロックは投稿日時順でも vpos 順に並んでいるとは限らない
+
+        Args:
+            start_vpos (int): 範囲の開始 (この値を含む) の vpos
+            end_vpos (int): 範囲の終了 (この値を含まない) の vpos
+
+        Yields:
+            Comment: 指定した範囲の vpos のコメント (投稿日時昇順)
+        """
+
+        for block in self.blocks:
+            if block.max_vpos < start_vpos or block.min_vpos >= end_vpos:
+                continue
+            for comment in self.readBlock(block):
+                if start_vpos <= comment.vpos < end_vpos:
+                    yield comment
+
+
+app = AsyncTyper()
+
+def version(value: bool):
+    if value is True:
+        typer.echo(f'JKCommentCrawler version {__version__}')
+        raise typer.Exit()
+
+@app.command(help='JKCommentCrawler: Build compressed archives (.nicojkz) from .nicojk files')
+async def build(
+    paths: list[Path] = typer.Argument(help='圧縮アーカイブを作成する .nicojk ファイル、または .nicojk ファイルを含むフォルダ。'),
+    version: bool = typer.Option(None, '--version', callback=version, is_eager=True, help='バージョン情報を表示する。'),
+):
+    print(Rule(characters='=', style=Style(color='#E33157')))
+    raw_size = 0
+    archive_size = 0
+    for path in paths:
+        for nicojk_path in sorted(path.rglob('*.nicojk')) if path.is_dir() else [path]:
+            archive_path = buildArchive(nicojk_path)
+            raw_size += nicojk_path.stat().st_size
+            archive_size += archive_path.stat().st_size + getIndexPath(archive_path).stat().st_size
+            print(f'Archive saved to {archive_path}.')
+    if raw_size > 0:
+        print(f'Total: {raw_size} bytes -> {archive_size} bytes ({archive_size / raw_size * 100:.1f}%)')
+    print(Rule(characters='=', style=Style(color='#E33157')))
+
+
+if __name__ == '__main__':
+    app()
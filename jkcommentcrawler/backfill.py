@@ -0,0 +1,160 @@
+import typer
+from datetime import date, datetime, timedelta
+from ndgr_client.utils import AsyncTyper
+from pathlib import Path
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+
+from jkcommentcrawler import NXClient, __version__
+from jkcommentcrawler.config import loadConfig
+from jkcommentcrawler.dataset_structure import DatasetStructure
+from jkcommentcrawler.job_store import BackfillJobStore
+from jkcommentcrawler.metrics import CrawlMetrics
+from jkcommentcrawler.sharding import backfillShard, createWorkerOptions, getShardIndex, getShardKey, parseShard, runShards
+
+
+app = AsyncTyper()
+
+def version(value: bool):
+    if value is True:
+        typer.echo(f'JKCommentCrawler version {__version__}')
+        raise typer.Exit()
+
+@app.command(help='JKCommentCrawler: Nico Nico Jikkyo Comment Crawler (Backfill Mode)')
+async def backfill(
+    channel_id: str = typer.Argument(help='コメントを収集する実況チャンネル。(ex: jk211) all を指定すると全チャンネルのコメントを収集する。'),
+    start: str = typer.Argument(help='コメントを収集する期間の開始日。(ex: 2024/08/05)'),
+    end: str = typer.Argument(help='コメントを収集する期間の終了日 (この日を含む)。(ex: 2024/08/31)'),
+    save_dataset_structure_json: bool = typer.Option(False, '--save-dataset-structure-json', help='過去ログデータのフォルダ/ファイル構造を示す JSON ファイルを出力する。'),
+    force: bool = typer.Option(False, '-f', '--force', help='以前取得したログにしかないコメントも残さず、今回取得したコメントだけで上書きする。'),
+    redo: bool = typer.Option(False, '--redo', help='以前のバックフィルで収集済みの日付も含めて、期間内のすべての日付を収集し直す。'),
+    archive: bool = typer.Option(False, '--archive', help='時刻で範囲を指定して読み込める圧縮アーカイブ (.nicojkz) もログと同じフォルダに保存する。'),
+    channel_concurrency: int = typer.Option(8, '--channel-concurrency', min=1, help='同時に収集する実況チャンネルの最大数。'),
+    nicolive_concurrency: int = typer.Option(2, '--nicolive-concurrency', min=1, help='ニコニコ生放送番組のコメントを同時にダウンロードする最大数。'),
+    nx_concurrency: int = typer.Option(4, '--nx-concurrency', min=1, help='NX-Jikkyo スレッドのコメントを同時にダウンロードする最大数。'),
+    nicolive_rate_limit: float = typer.Option(2.0, '--nicolive-rate-limit', min=0.01, help='ニコニコ生放送への1秒あたりの最大リクエスト数。スロットリングを受けた場合は自動的に下げる。'),
+    nx_rate_limit: float = typer.Option(5.0, '--nx-rate-limit', min=0.01, help='NX-Jikkyo への1秒あたりの最大リクエスト数。スロットリングを受けた場合は自動的に下げる。'),
+    workers: int = typer.Option(1, '--workers', min=1, help='ジョブを分担して実行するワーカープロセスの数。同時実行数と送信レートの制限はワーカー全体での上限として等分され (同時実行数は最低 1)、ニコニコへのログインは起動前に1回だけ行う。'),
+    shard: str | None = typer.Option(None, '--shard', help='複数のホストでジョブを分担して実行する場合の、このホストが担当するシャード。(ex: 0/3)'),
+    shard_by: str = typer.Option('channel', '--shard-by', help='ジョブをシャード・ワーカーに振り分ける単位。channel (実況チャンネル単位) または day (実況チャンネル×日付単位)。'),
+    metrics_jsonl: Path | None = typer.Option(None, '--metrics-jsonl', help='実況チャンネル・処理段階ごとの所要時間などの計測結果を JSON Lines 形式で追記するファイル。'),
+    metrics_prometheus: Path | None = typer.Option(None, '--metrics-prometheus', help='計測結果を Prometheus の textfile collector 向けの形式で書き出すファイル。'),
+    verbose: bool = typer.Option(False, '-v', '--verbose', help='詳細なログを表示する。'),
+    version: bool = typer.Option(None, '--version', callback=version, is_eager=True, help='バージョン情報を表示する。'),
+):
+    """
+    指定した期間の過去ログを一括で収集する
+    実況チャンネル・日付の組み合わせをすべてジョブとして JKCommentCrawler.db に登録し、完了したジョブを記録しながら収集する
+    中断した場合も、同じ引数で再実行すれば完了していないジョブから再開する
+    """
+
+    print(Rule(characters='=', style=Style(color='#E33157')))
+    start_date = datetime.strptime(start, '%Y/%m/%d').date()
+    end_date = datetime.strptime(end, '%Y/%m/%d').date()
+    if start_date > end_date:
+        raise Exception('Start date is after end date.')
+    if end_date > datetime.now().date():
+        raise Exception('End date is in the future.')
+    if shard_by not in ('channel', 'day'):
+        raise Exception('--shard-by must be channel or day.')
+    # --shard が指定されていない場合は、すべてのジョブを1つのシャードとして扱う
+    shard_index, shard_count = 0, 1
+    if shard is not None:
+        shard_index, shard_count = parseShard(shard)
+    dates = [start_date + timedelta(days=days) for days in range((end_date - start_date).days + 1)]
+
+    # 設定読み込み
+    config = loadConfig()
+
+    # jikkyo_id に 'all' が指定された場合は全てのチャンネルを収集
+    if channel_id == 'all':
+        jikkyo_channel_ids = NXClient.JIKKYO_CHANNEL_ID_LIST.copy()
+    else:
+        jikkyo_channel_ids = [channel_id]
+
+    # 実況チャンネル・日付のすべての組み合わせをジョブとして登録
+    job_store = BackfillJobStore()
+    job_store.plan(jikkyo_channel_ids, dates, redo=redo)
+
+    metrics = CrawlMetrics(
+        jsonl_path = metrics_jsonl if metrics_jsonl is not None else config.metrics_jsonl_path,
+        prometheus_path = metrics_prometheus if metrics_prometheus is not None else config.metrics_prometheus_path,
+    )
+    crawler_options = dict(
+        kakolog_dir = config.kakolog_dir,
+        niconico_mail = config.niconico_mail,
+        niconico_password = config.niconico_password,
+        force = force,
+        archive = archive,
+        verbose = verbose,
+        channel_concurrency = channel_concurrency,
+        nicolive_concurrency = nicolive_concurrency,
+        nx_concurrency = nx_concurrency,
+        nicolive_rate_limit = nicolive_rate_limit,
+        nx_rate_limit = nx_rate_limit,
+    )
+
+    # 実況チャンネルごとに、このホストが担当するジョブの日付と、そのうち完了していないジョブの日付を取得
+    ## --shard が指定されたときは、シャードのキーから決まるシャードがこのホストの担当になっているジョブだけを実行する
+    ## どのホストでも同じジョブが同じシャードに振り分けられるため、再実行しても担当するジョブは変わらない
+    shard_jobs: dict[str, list[date]] = {}
+    remaining_jobs: dict[str, list[date]] = {}
+    for jikkyo_channel_id in jikkyo_channel_ids:
+        shard_dates = dates
+        if shard is not None:
+            shard_dates = [
+                target_date for target_date in dates
+                if getShardIndex(getShardKey(jikkyo_channel_id, target_date if shard_by == 'day' else None), shard_count) == shard_index
+            ]
+        if len(shard_dates) == 0:
+            continue
+        shard_jobs[jikkyo_channel_id] = shard_dates
+        shard_date_set = set(shard_dates)
+        remaining_dates = [target_date for target_date in job_store.getRemainingDates(jikkyo_channel_id, start_date, end_date) if target_date in shard_date_set]
+        if len(remaining_dates) < len(shard_dates):
+            print(f'\\[{jikkyo_channel_id}] Resuming backfill. {len(shard_dates) - len(remaining_dates)} of {len(shard_dates)} days are already done.')
+        if len(remaining_dates) > 0:
+            remaining_jobs[jikkyo_channel_id] = remaining_dates
+
+    # ジョブを順にワーカーに振り分ける
+    ## 実況チャンネル単位では同じ実況チャンネルのジョブが同じワーカーに振り分けられるため、日付をまたぐ取得元を1回のダウンロードで使い回せる
+    ## 実況チャンネル×日付単位では、実況チャンネルの数よりワーカーの数が多くてもすべてのワーカーに均等に振り分けられる
+    worker_jobs: list[dict[str, list[date]]] = [{} for _ in range(workers)]
+    job_index = 0
+    for channel_index, (jikkyo_channel_id, remaining_dates) in enumerate(remaining_jobs.items()):
+        for target_date in remaining_dates:
+            worker_index = (channel_index if shard_by == 'channel' else job_index) % workers
+            worker_jobs[worker_index].setdefault(jikkyo_channel_id, []).append(target_date)
+            job_index += 1
+    worker_jobs = [worker_job for worker_job in worker_jobs if len(worker_job) > 0]
+
+    # 同時実行数と送信レートの制限はワーカープロセスの数で等分し、ニコニコ生放送へのログインはこのプロセスで1回だけ行う
+    worker_options = await createWorkerOptions(crawler_options, len(worker_jobs), list(remaining_jobs))
+
+    try:
+        results = await runShards(backfillShard, [(worker_options, worker_job) for worker_job in worker_jobs], metrics)
+    finally:
+        metrics.flush()
+    created_files = [created_file for result in results for created_file in result.created_files]
+
+    # 実況チャンネルごとに、このホストが担当するジョブの状態を表示
+    print(f'Backfill completed for {start_date.strftime("%Y/%m/%d")} ~ {end_date.strftime("%Y/%m/%d")}.' +
+          (f' (shard: {shard})' if shard is not None else ''))
+    for jikkyo_channel_id, shard_dates in shard_jobs.items():
+        summary = job_store.getSummary(jikkyo_channel_id, start_date, end_date, shard_dates)
+        print(f'{jikkyo_channel_id:>5}: {summary[BackfillJobStore.DONE]:>4} days done, '
+              f'{summary[BackfillJobStore.FAILED]:>4} days failed, {summary["comments"]:>9} comments')
+    print(Rule(characters='=', style=Style(color='#E33157')))
+    job_store.close()
+
+    # --save-dataset-structure-json が指定されているときは、今回作成したファイルをデータセットの構造に追加
+    if save_dataset_structure_json is True:
+        dataset_structure = DatasetStructure(config.kakolog_dir)
+        dataset_structure.update(created_files)
+        print(f'Dataset structure saved to {dataset_structure.path}.')
+        print(Rule(characters='=', style=Style(color='#E33157')))
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,392 @@
+import typer
+from collections import deque
+from dataclasses import dataclass, field, replace
+from datetime import datetime, time, timedelta
+from ndgr_client.utils import AsyncTyper
+from pathlib import Path
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+from typing import Iterable, Iterator
+
+from jkcommentcrawler import __version__
+from jkcommentcrawler.archive import NicojkArchiveReader, getArchivePath, isArchiveUpToDate
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.config import loadConfig
+from jkcommentcrawler.nicojk import NicojkWriter, iterComments
+
+
+# 切り出したコメントを保存する XML ファイルのヘッダーとフッター
+XML_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<packet>\n'
+XML_FOOTER = b'</packet>'
+
+# 日時の指定として受け付ける形式
+DATETIME_FORMATS = ('%Y/%m/%d %H:%M:%S', '%Y/%m/%d %H:%M')
+
+
+@dataclass(slots=True)
+class Episode:
+    """
+    コメントを切り出す1つのエピソード (番組の1回分)
+    """
+
+    # 実況チャンネル ID
+    jikkyo_channel_id: str
+    # 放送開始日時 (この日時のコメントを vpos 0 とする)
+    start: datetime
+    # 放送終了日時 (この日時のコメントは含まない)
+    end: datetime
+    # 作品タイトル
+    title: str = ''
+    # 話数
+    number: str = ''
+    # 放送開始日時・放送終了日時の UNIX タイムスタンプ
+    ## コメントごとに何度も参照されるため、生成時に一度だけ計算しておく
+    start_timestamp: float = field(init=False)
+    end_timestamp: float = field(init=False)
+    # スレッド ID ごとの、放送開始日時時点のスレッドの vpos (rebase() で元の vpos から差し引く値)
+    ## anime/readmeComment.md の「vopの時間差分」に当たる値を、スレッドごとに最初に切り出したコメントから求める
+    vpos_offsets: dict[str, int] = field(init=False, default_factory=dict)
+
+
+    def __post_init__(self) -> None:
+        self.start_timestamp = self.start.timestamp()
+        self.end_timestamp = self.end.timestamp()
+
+
+    def getFileName(self) -> str:
+        """
+        切り出したコメントを保存する XML ファイルのファイル名を取得する
+        {作品タイトル} {話数} {実況チャンネル ID}_{開始日時}_{終了日時}.xml (作品タイトル・話数は指定された場合のみ)
+
+        Returns:
+            str: XML ファイルのファイル名
+        """
+
+        name = f'{self.jikkyo_channel_id}_{self.start.strftime("%Y%m%d-%H%M%S")}_{self.end.strftime("%Y%m%d-%H%M%S")}.xml'
+        prefix = ' '.join(part.replace('/', '／') for part in (self.title, self.number) if part != '')
+        return f'{prefix} {name}' if prefix != '' else name
+
+
+    def rebase(self, comment: Comment) -> Comment:
+        """
+        コメントの vpos から、放送開始日時時点のスレッドの vpos を差し引き、放送開始日時を 0 とした vpos に置き換えたコメントを返す
+        vpos はスレッドごとの経過時間のため、差し引く値はスレッドごとに異なる
+        スレッドの最初のコメントの vpos と投稿日時から放送開始日時時点の vpos を求め、以降のコメントには同じ値を使うため、
+        同じスレッドのコメントどうしの vpos の前後関係と間隔は元のまま保たれる
+
+        Args:
+            comment (Comment): 元のコメント
+
+        Returns:
+            Comment: vpos を置き換えたコメント
+        """
+
+        vpos_offset = self.vpos_offsets.get(comment.thread)
+        if vpos_offset is None:
+            vpos_offset = comment.vpos - round((comment.date_with_usec - self.start_timestamp) * 100)
+            self.vpos_offsets[comment.thread] = vpos_offset
+        return replace(comment, vpos=comment.vpos - vpos_offset)
+
+
+def parseDateTime(value: str) -> datetime:
+    """
+    日時の文字列を datetime に変換する
+
+    Args:
+        value (str): 日時の文字列 (ex: 2024/10/05 23:45 / 2024/10/05 23:45:00)
+
+    Returns:
+        datetime: 変換した日時
+
+    Raises:
+        ValueError: 対応していない形式の場合
+    """
+
+    for datetime_format in DATETIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), datetime_format)
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid datetime "{value}". (ex: 2024/10/05 23:45)')
+
+
+def loadEpisodes(batch_path: Path) -> list[Episode]:
+    """
+    エピソードの一覧をタブ区切りのファイルから読み込む
+    1行に1エピソードずつ、作品タイトル・話数・実況チャンネル ID・放送開始日時・放送終了日時をタブ区切りで記述する
+    空行と # から始まる行は無視する
+
+    Args:
+        batch_path (Path): エピソードの一覧のファイルのパス
+
+    Returns:
+        list[Episode]: エピソードのリスト
+
+    Raises:
+        ValueError: 列の数や日時の形式が不正な行がある場合
+    """
+
+    episodes: list[Episode] = []
+    with open(batch_path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.rstrip('\r\n')
+            if line.strip() == '' or line.startswith('#'):
+                continue
+            columns = line.split('\t')
+            if len(columns) != 5:
+                raise ValueError(f'{batch_path}:{line_number}: Expected 5 tab-separated columns, but got {len(columns)}.')
+            title, number, jikkyo_channel_id, start, end = columns
+            episodes.append(Episode(jikkyo_channel_id.strip(), parseDateTime(start), parseDateTime(end), title.strip(), number.strip()))
+    return episodes
+
+
+def getReadRanges(episodes: Iterable[Episode]) -> list[tuple[float, float]]:
+    """
+    エピソードの放送時間を重なりのない範囲にまとめる
+    複数のエピソードが同じ時間帯に重なっていても、その時間帯のコメントは1回だけ読み込めば済む
+
+    Args:
+        episodes (Iterable[Episode]): エピソードのイテレーター
+
+    Returns:
+        list[tuple[float, float]]: 範囲の開始 (この値を含む) と終了 (この値を含まない) の UNIX タイムスタンプのリスト (昇順)
+    """
+
+    ranges: list[tuple[float, float]] = []
+    for start, end in sorted((episode.start_timestamp, episode.end_timestamp) for episode in episodes):
+        if len(ranges) > 0 and start <= ranges[-1][1]:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], end))
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def filterRanges(comments: Iterable[Comment], ranges: list[tuple[float, float]]) -> Iterator[Comment]:
+    """
+    投稿日時昇順に並んだコメントのうち、いずれかの範囲に投稿されたコメントだけを順に返す
+    最後の範囲の終了を過ぎたら、それ以降のコメントは読み込まない
+
+    Args:
+        comments (Iterable[Comment]): コメントのイテレーター (投稿日時昇順)
+        ranges (list[tuple[float, float]]): 重なりのない範囲のリスト (昇順)
+
+    Yields:
+        Comment: いずれかの範囲に投稿されたコメント
+    """
+
+    index = 0
+    for comment in comments:
+        while index < len(ranges) and ranges[index][1] <= comment.date_with_usec:
+            index += 1
+        if index == len(ranges):
+            break
+        if ranges[index][0] <= comment.date_with_usec:
+            yield comment
+
+
+class EpisodeClipper:
+    """
+    保存済みの過去ログから、エピソードごとのコメントを vpos を 0 始まりに置き換えた XML ファイルとして切り出す
+    実況チャンネルごとに、すべてのエピソードの放送時間に掛かる .nicojk ファイルを日付順に1回だけ逐次読み込み、
+    読み込んだコメントを放送時間に含まれるすべてのエピソードに同時に振り分ける
+    そのため、1クール分のエピソードをまとめて指定しても、過去ログの読み込みは1回で済む
+    """
+
+
+    def __init__(self, kakolog_dir: Path, output_dir: Path) -> None:
+        """
+        EpisodeClipper のコンストラクタ
+
+        Args:
+            kakolog_dir (Path): 過去ログが保存されているフォルダのパス
+            output_dir (Path): 切り出したコメントの XML ファイルを保存するフォルダのパス
+        """
+
+        self.kakolog_dir = kakolog_dir
+        self.output_dir = output_dir
+
+
+    def clip(self, episodes: list[Episode]) -> dict[Path, int]:
+        """
+        エピソードごとのコメントを切り出して XML ファイルに保存する
+
+        Args:
+            episodes (list[Episode]): エピソードのリスト
+
+        Returns:
+            dict[Path, int]: 保存した XML ファイルのパスと、切り出したコメント数
+        """
+
+        results: dict[Path, int] = {}
+        jikkyo_channel_ids = sorted({episode.jikkyo_channel_id for episode in episodes})
+        for jikkyo_channel_id in jikkyo_channel_ids:
+            results.update(self.clipChannel(jikkyo_channel_id, [episode for episode in episodes if episode.jikkyo_channel_id == jikkyo_channel_id]))
+        return results
+
+
+    def clipChannel(self, jikkyo_channel_id: str, episodes: list[Episode]) -> dict[Path, int]:
+        """
+        1つの実況チャンネルのエピソードのコメントを、過去ログを1回だけ読み込んで切り出す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            episodes (list[Episode]): その実況チャンネルのエピソードのリスト
+
+        Returns:
+            dict[Path, int]: 保存した XML ファイルのパスと、切り出したコメント数
+        """
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        # 放送開始日時順に並べたエピソードを、コメントの投稿日時が放送開始日時に達したものから順に書き込み中にする
+        ## 書き込み中のエピソードは、コメントの投稿日時が放送終了日時に達した時点で XML ファイルを確定させる
+        pending = deque(sorted(episodes, key=lambda episode: episode.start_timestamp))
+        active: list[tuple[Episode, NicojkWriter]] = []
+        results: dict[Path, int] = {}
+
+        # 書き込み中のエピソードのうち、最も早い放送終了日時
+        ## コメントごとに書き込み中のエピソードをすべて確認しなくて済むようにする
+        next_end = float('inf')
+
+        try:
+            for comment in self.iterChannelComments(jikkyo_channel_id, episodes):
+                timestamp = comment.date_with_usec
+                while len(pending) > 0 and pending[0].start_timestamp <= timestamp:
+                    episode = pending.popleft()
+                    writer = NicojkWriter(self.output_dir / episode.getFileName())
+                    writer.writeRaw(XML_HEADER)
+                    active.append((episode, writer))
+                    next_end = min(next_end, episode.end_timestamp)
+                if timestamp >= next_end:
+                    for episode, writer in active:
+                        if episode.end_timestamp <= timestamp:
+                            results[writer.path] = self.commitXML(writer)
+                    active = [(episode, writer) for episode, writer in active if writer.committed is False]
+                    next_end = min((episode.end_timestamp for episode, _ in active), default=float('inf'))
+                for episode, writer in active:
+                    writer.write(episode.rebase(comment))
+
+            # 過去ログの最後まで読み込んだら、残りのエピソードをすべて確定させる (コメントがないエピソードも空の XML ファイルとして保存する)
+            while len(pending) > 0:
+                episode = pending.popleft()
+                writer = NicojkWriter(self.output_dir / episode.getFileName())
+                writer.writeRaw(XML_HEADER)
+                active.append((episode, writer))
+            for _, writer in active:
+                results[writer.path] = self.commitXML(writer)
+        finally:
+            for _, writer in active:
+                if writer.committed is False:
+                    writer.discard()
+
+        return results
+
+
+    def commitXML(self, writer: NicojkWriter) -> int:
+        """
+        XML ファイルのフッターを書き込み、XML ファイルを確定させる
+
+        Args:
+            writer (NicojkWriter): XML ファイルのライター
+
+        Returns:
+            int: XML ファイルに書き込んだコメント数
+        """
+
+        writer.writeRaw(XML_FOOTER)
+        writer.commit()
+        return writer.count
+
+
+    def iterChannelComments(self, jikkyo_channel_id: str, episodes: list[Episode]) -> Iterator[Comment]:
+        """
+        エピソードの放送時間に投稿されたコメントを、日付ごとの過去ログから投稿日時昇順に逐次読み込む
+        圧縮アーカイブ (.nicojkz) が .nicojk ファイルの現在の内容から作成されたものである日付は、放送時間に掛かるブロックだけを展開して読み込む
+        --archive なしで .nicojk ファイルだけが更新され、圧縮アーカイブが古くなっている日付は .nicojk ファイルから読み込む
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            episodes (list[Episode]): エピソードのリスト
+
+        Yields:
+            Comment: いずれかのエピソードの放送時間に投稿されたコメント (投稿日時昇順)
+        """
+
+        ranges = getReadRanges(episodes)
+        if len(ranges) == 0:
+            return
+
+        # 放送時間に掛かるすべての日付の過去ログを日付順に読み込む
+        ## 範囲の終了はその値を含まないため、終了日時がちょうど 00:00:00 の場合は前日までを対象にする
+        target_date = datetime.fromtimestamp(ranges[0][0]).date()
+        last_date = datetime.fromtimestamp(ranges[-1][1] - 0.000001).date()
+        while target_date <= last_date:
+            day_start = datetime.combine(target_date, time()).timestamp()
+            day_end = datetime.combine(target_date + timedelta(days=1), time()).timestamp()
+            day_ranges = [(max(start, day_start), min(end, day_end)) for start, end in ranges if start < day_end and end > day_start]
+            nicojk_path = self.kakolog_dir / jikkyo_channel_id / str(target_date.year) / f'{target_date.strftime("%Y%m%d")}.nicojk'
+            archive_path = getArchivePath(nicojk_path)
+            if len(day_ranges) == 0:
+                pass
+            elif isArchiveUpToDate(nicojk_path) is True:
+                with NicojkArchiveReader(archive_path) as reader:
+                    for start, end in day_ranges:
+                        yield from reader.readDateRange(start, end)
+            elif nicojk_path.exists():
+                if archive_path.exists():
+                    print(f'\\[{jikkyo_channel_id}] Archive for {target_date.strftime("%Y/%m/%d")} is out of date. Reading {nicojk_path} instead ...')
+                yield from filterRanges(iterComments(nicojk_path), day_ranges)
+            else:
+                print(f'\\[{jikkyo_channel_id}] Log for {target_date.strftime("%Y/%m/%d")} not found. Skipping ...')
+            target_date += timedelta(days=1)
+
+
+app = AsyncTyper()
+
+def version(value: bool):
+    if value is True:
+        typer.echo(f'JKCommentCrawler version {__version__}')
+        raise typer.Exit()
+
+@app.command(help='JKCommentCrawler: Clip comments of episodes from saved logs into XML files with vpos starting from 0')
+async def clip(
+    channel_id: str | None = typer.Argument(None, help='コメントを切り出す実況チャンネル。(ex: jk1) --batch を指定した場合は不要。'),
+    start: str | None = typer.Argument(None, help='放送開始日時。この日時のコメントを vpos 0 とする。(ex: "2024/10/05 23:45")'),
+    end: str | None = typer.Argument(None, help='放送終了日時 (この日時を含まない)。(ex: "2024/10/06 00:20")'),
+    title: str = typer.Option('', '--title', help='作品タイトル。XML ファイルのファイル名の先頭に付ける。'),
+    number: str = typer.Option('', '--number', help='話数。XML ファイルのファイル名の作品タイトルの後に付ける。'),
+    batch: Path | None = typer.Option(None, '--batch', help='作品タイトル・話数・実況チャンネル・放送開始日時・放送終了日時をタブ区切りで1行ずつ記述したエピソードの一覧のファイル。'),
+    output_dir: Path = typer.Option(Path('.'), '-o', '--output-dir', help='切り出したコメントの XML ファイルを保存するフォルダ。'),
+    version: bool = typer.Option(None, '--version', callback=version, is_eager=True, help='バージョン情報を表示する。'),
+):
+    """
+    保存済みの過去ログから、エピソードごとのコメントを vpos を 0 始まりに置き換えた XML ファイルとして切り出す
+    --batch でエピソードの一覧を指定すると、すべてのエピソードを過去ログの1回の読み込みでまとめて切り出す
+    """
+
+    print(Rule(characters='=', style=Style(color='#E33157')))
+
+    # 切り出すエピソードを取得
+    if batch is not None:
+        episodes = loadEpisodes(batch)
+    elif channel_id is not None and start is not None and end is not None:
+        episodes = [Episode(channel_id, parseDateTime(start), parseDateTime(end), title, number)]
+    else:
+        raise Exception('Specify a channel, start and end datetime, or --batch.')
+    for episode in episodes:
+        if episode.start >= episode.end:
+            raise Exception(f'Start datetime is not before end datetime. ({episode.getFileName()})')
+
+    # 設定読み込み
+    config = loadConfig()
+
+    clipper = EpisodeClipper(config.kakolog_dir, output_dir)
+    results = clipper.clip(episodes)
+    for path, count in results.items():
+        print(f'Saved {count} comments to {path}.')
+    print(Rule(characters='=', style=Style(color='#E33157')))
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,114 @@
+import sys
+from dataclasses import dataclass
+from ndgr_client import XMLCompatibleComment
+
+
+@dataclass(slots=True)
+class Comment:
+    """
+    クローラー内部で扱うコメントの軽量な表現
+    XMLCompatibleComment (pydantic モデル) と同じ情報を持つが、__slots__ を使うことでメモリ使用量と生成コストを抑えている
+    ダウンロードから .nicojk ファイルへの書き込みまではこのクラスで扱い、XMLCompatibleComment への変換は外部に返すときだけ行う
+    フィールドの定義順は .nicojk ファイルの <chat> 要素の属性の出力順を兼ねている
+    """
+
+    # スレッド ID (ニコニコ生放送の番組に紐づくスレッド ID / NX-Jikkyo のスレッド ID を文字列化したもの)
+    thread: str
+    # コメント番号
+    no: int
+    # スレッドの開始時刻からの経過時間 (1/100 秒単位)
+    vpos: int
+    # 投稿日時 (UNIX タイムスタンプ、秒単位)
+    date: int
+    # 投稿日時の秒未満の部分 (マイクロ秒単位)
+    date_usec: int
+    # ユーザー ID
+    user_id: str
+    # コメントコマンド
+    mail: str
+    # プレミアム会員なら 1
+    premium: int | None
+    # 184 コメントなら 1
+    anonymity: int | None
+    # コメント本文
+    content: str
+    # 投稿日時 (UNIX タイムスタンプ、マイクロ秒単位まで)
+    ## 並び替えや日付での絞り込みで何度も参照されるため、生成時に一度だけ計算しておく
+    date_with_usec: float
+
+
+    @classmethod
+    def create(
+        cls,
+        thread: str,
+        no: int,
+        vpos: int,
+        date: int,
+        date_usec: int,
+        user_id: str,
+        mail: str,
+        premium: int | None,
+        anonymity: int | None,
+        content: str,
+    ) -> 'Comment':
+        """
+        Comment を作成する
+        同じ値が大量に出現する user_id と mail は sys.intern() で同じ文字列オブジェクトを共有させる
+
+        Returns:
+            Comment: 作成した Comment
+        """
+
+        return cls(
+            thread, no, vpos, date, date_usec,
+            sys.intern(user_id), sys.intern(mail), premium, anonymity, content,
+            date + date_usec / 1000000,
+        )
+
+
+    @classmethod
+    def fromXMLCompatibleComment(cls, comment: XMLCompatibleComment) -> 'Comment':
+        """
+        XMLCompatibleComment から Comment を作成する
+
+        Args:
+            comment (XMLCompatibleComment): 変換元のコメント
+
+        Returns:
+            Comment: 作成した Comment
+        """
+
+        return cls.create(
+            thread = comment.thread,
+            no = comment.no,
+            vpos = comment.vpos,
+            date = comment.date,
+            date_usec = comment.date_usec,
+            user_id = comment.user_id,
+            mail = comment.mail,
+            premium = comment.premium,
+            anonymity = comment.anonymity,
+            content = comment.content,
+        )
+
+
+    def toXMLCompatibleComment(self) -> XMLCompatibleComment:
+        """
+        Comment を XMLCompatibleComment に変換する
+
+        Returns:
+            XMLCompatibleComment: 変換したコメント
+        """
+
+        return XMLCompatibleComment(
+            thread = self.thread,
+            no = self.no,
+            vpos = self.vpos,
+            date = self.date,
+            date_usec = self.date_usec,
+            mail = self.mail,
+            user_id = self.user_id,
+            premium = self.premium,
+            anonymity = self.anonymity,
+            content = self.content,
+        )
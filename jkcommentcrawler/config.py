@@ -0,0 +1,57 @@
+import configparser
+from dataclasses import dataclass
+from pathlib import Path
+
+
+# 設定ファイル (JKCommentCrawler.ini) のパス
+CONFIG_PATH = Path(__file__).parent.parent / 'JKCommentCrawler.ini'
+
+
+@dataclass(slots=True)
+class Config:
+    """
+    JKCommentCrawler.ini から読み込んだ設定
+    """
+
+    # 過去ログを保存するフォルダ
+    kakolog_dir: Path
+    # ニコニコにログインするメールアドレス
+    niconico_mail: str
+    # ニコニコにログインするパスワード
+    niconico_password: str
+    # 計測結果を JSON Lines 形式で追記するファイル (None の場合は出力しない)
+    metrics_jsonl_path: Path | None
+    # 計測結果を Prometheus の textfile collector 向けの形式で書き出すファイル (None の場合は出力しない)
+    metrics_prometheus_path: Path | None
+
+
+def loadConfig(config_path: Path = CONFIG_PATH) -> Config:
+    """
+    JKCommentCrawler.ini から設定を読み込む
+
+    Args:
+        config_path (Path, default=CONFIG_PATH): 設定ファイルのパス
+
+    Returns:
+        Config: 読み込んだ設定
+
+    Raises:
+        Exception: 設定ファイルが存在しない場合
+    """
+
+    if not config_path.exists():
+        raise Exception('JKCommentCrawler.ini not found. Copy from JKCommentCrawler.example.ini and edit it as needed.')
+    config = configparser.ConfigParser()
+    config.read(config_path, encoding='utf-8')
+
+    # 計測結果の出力先は省略可能 (空欄または未設定なら出力しない)
+    metrics_jsonl_path = config.get('Default', 'metrics_jsonl_path', fallback='')
+    metrics_prometheus_path = config.get('Default', 'metrics_prometheus_path', fallback='')
+
+    return Config(
+        kakolog_dir = Path(config.get('Default', 'jkcomment_folder').rstrip('/')).resolve(),
+        niconico_mail = config.get('Default', 'nicologin_mail'),
+        niconico_password = config.get('Default', 'nicologin_password'),
+        metrics_jsonl_path = Path(metrics_jsonl_path).resolve() if metrics_jsonl_path != '' else None,
+        metrics_prometheus_path = Path(metrics_prometheus_path).resolve() if metrics_prometheus_path != '' else None,
+    )
@@ -0,0 +1,680 @@
+import asyncio
+import traceback
+from contextlib import nullcontext
+from datetime import date, datetime
+from ndgr_client import NDGRClient
+from functools import partial
+from pathlib import Path
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+from typing import Any, Awaitable, Callable
+
+from jkcommentcrawler.archive import NicojkArchiveWriter, appendArchive, buildArchive, getArchivePath, isArchiveUpToDate
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.database import DATABASE_PATH
+from jkcommentcrawler.file_lock import FileLock, getLockPath
+from jkcommentcrawler.manifest import FileState, Manifest, ThreadState
+from jkcommentcrawler.metrics import CrawlMetrics
+from jkcommentcrawler.merge import getDateRange, getDateWithUsec, mergeComments, sliceComments, uniqueComments
+from jkcommentcrawler.nicojk import NicojkWriter, appendComments, hashFile, isAppendable, iterComments
+from jkcommentcrawler.nx_client import NXClient
+from jkcommentcrawler.rate_limit import RateLimiter, getStatusCode
+from jkcommentcrawler.session import COOKIES_JSON_PATH, LoginError, NicoliveSession
+from jkcommentcrawler.thread_index import ThreadIndex
+
+
+class CommentCrawler:
+    """
+    ニコニコ実況・NX-Jikkyo の過去ログを実況チャンネルごとに収集し、日付ごとの .nicojk ファイルに保存するクローラー
+    実況チャンネル・ニコニコ生放送番組・NX-Jikkyo スレッドのダウンロードを asyncio で並列に実行する
+    同時実行数はチャンネル単位・取得元 (ニコニコ生放送 / NX-Jikkyo) 単位でそれぞれ制限できる
+    """
+
+    # 1チャンネルあたりの最大試行回数
+    ## 個々のリクエストは RateLimiter でリトライされるため、ここでのリトライはそれ以外の予期しないエラーに備えたもの
+    MAX_RETRY_COUNT = 3
+
+    # リトライ前の待機時間 (秒)
+    RETRY_INTERVAL = 3
+
+    # ニコニコ生放送のホスト名 (RateLimiter で送信レートを制限する単位)
+    NICOLIVE_HOST = 'live.nicovideo.jp'
+
+
+    def __init__(
+        self,
+        kakolog_dir: Path,
+        niconico_mail: str,
+        niconico_password: str,
+        force: bool = False,
+        incremental: bool = False,
+        archive: bool = False,
+        verbose: bool = False,
+        channel_concurrency: int = 8,
+        nicolive_concurrency: int = 2,
+        nx_concurrency: int = 4,
+        nicolive_rate_limit: float = 2.0,
+        nx_rate_limit: float = 5.0,
+        database_path: Path = DATABASE_PATH,
+        cookies_json: Path | None = COOKIES_JSON_PATH,
+        nicolive_cookies: dict[str, Any] | None = None,
+        metrics: CrawlMetrics | None = None,
+    ) -> None:
+        """
+        CommentCrawler のコンストラクタ
+
+        Args:
+            kakolog_dir (Path): 過去ログを保存するフォルダのパス
+            niconico_mail (str): ニコニコにログインするメールアドレス
+            niconico_password (str): ニコニコにログインするパスワード
+            force (bool, default=False): 以前取得したログにしかないコメントも残さず、今回取得したコメントだけで上書きするかどうか
+            incremental (bool, default=False): 前回保存したコメントより新しいコメントだけを既存の .nicojk ファイルに追記するかどうか
+            archive (bool, default=False): .nicojk ファイルと同じフォルダに、時刻で範囲を指定して読み込める圧縮アーカイブ (.nicojkz) も保存するかどうか
+            verbose (bool, default=False): 詳細な動作ログを出力するかどうか
+            channel_concurrency (int, default=8): 同時に収集する実況チャンネルの最大数
+            nicolive_concurrency (int, default=2): ニコニコ生放送番組のコメントを同時にダウンロードする最大数
+            nx_concurrency (int, default=4): NX-Jikkyo スレッドのコメントを同時にダウンロードする最大数
+            nicolive_rate_limit (float, default=2.0): ニコニコ生放送への1秒あたりの最大リクエスト数 (番組一覧の取得・番組ごとのダウンロードをそれぞれ1リクエストと数える)
+            nx_rate_limit (float, default=5.0): NX-Jikkyo への1秒あたりの最大リクエスト数
+            database_path (Path, default=DATABASE_PATH): マニフェストやスレッドのインデックスを保存する SQLite データベースのパス
+            cookies_json (Path | None, default=COOKIES_JSON_PATH): ニコニコのログイン済みの Cookie を保存するファイルのパス (None の場合は nicolive_cookies だけでログインする)
+            nicolive_cookies (dict[str, Any] | None, default=None): 親プロセスでログインして得た Cookie (ワーカープロセスで cookies_json を None にして使う)
+            metrics (CrawlMetrics | None, default=None): 実況チャンネル・処理段階ごとの所要時間などを記録する計測器 (None の場合は記録を書き出さない)
+        """
+
+        if channel_concurrency < 1 or nicolive_concurrency < 1 or nx_concurrency < 1:
+            raise ValueError('Concurrency limits must be 1 or greater.')
+        if nicolive_rate_limit <= 0 or nx_rate_limit <= 0:
+            raise ValueError('Rate limits must be greater than 0.')
+
+        self.kakolog_dir = kakolog_dir
+        self.force = force
+        self.incremental = incremental
+        self.archive = archive
+        self.verbose = verbose
+
+        # 同時実行数を制限するためのセマフォ
+        self.channel_semaphore = asyncio.Semaphore(channel_concurrency)
+        self.nicolive_semaphore = asyncio.Semaphore(nicolive_concurrency)
+        self.nx_semaphore = asyncio.Semaphore(nx_concurrency)
+
+        # ホストごとに送信レートを制限し、失敗したリクエストだけをリトライするリクエスト層
+        ## スロットリングを受けたホストへの送信レートは自動的に下がるため、同時実行数を上げてもサーバーに負荷を掛けすぎない
+        self.rate_limiter = RateLimiter({self.NICOLIVE_HOST: nicolive_rate_limit, NXClient.API_HOST: nx_rate_limit})
+
+        # すべてのニコニコ生放送番組のダウンロードで共有するログインセッション
+        ## すでにログイン済みの Cookie が cookies.json にあれば Cookie を再利用し、ない場合は新規ログインを行う
+        self.nicolive_session = NicoliveSession(niconico_mail, niconico_password, cookies_json, nicolive_cookies)
+
+        # .nicojk ファイルにどこまでコメントを保存したかを記録するマニフェスト
+        self.manifest = Manifest(database_path)
+
+        # NX-Jikkyo スレッドの情報を実況チャンネルごとに保存しておくインデックス
+        self.thread_index = ThreadIndex(database_path, self.rate_limiter)
+
+        # 実況チャンネル・処理段階ごとの所要時間などを記録する計測器
+        self.metrics = metrics if metrics is not None else CrawlMetrics()
+
+        # 新たに作成した .nicojk ファイルのパスのリスト (dataset_structure.json の更新に使う)
+        self.created_files: list[Path] = []
+
+
+    async def close(self) -> None:
+        """
+        共有している HTTP クライアントを閉じる
+        クローラーの利用を終えたら必ず呼び出す
+        """
+
+        await self.nicolive_session.close()
+        await NXClient.closeHTTPClient()
+        self.manifest.close()
+        self.thread_index.close()
+
+
+    async def loginNicolive(self, jikkyo_channel_ids: list[str]) -> dict[str, Any] | None:
+        """
+        ニコニコ生放送にログインし、ログイン済みの Cookie を返す
+        ワーカープロセスを起動する前に親プロセスで呼び出し、得た Cookie を各ワーカープロセスの CommentCrawler に渡す
+
+        Args:
+            jikkyo_channel_ids (list[str]): 収集する実況チャンネル ID のリスト
+
+        Returns:
+            dict[str, Any] | None: ログイン済みの Cookie (ニコニコ生放送に存在する実況チャンネルがない場合やログインに失敗した場合は None)
+        """
+
+        nicolive_channel_ids = [jikkyo_channel_id for jikkyo_channel_id in jikkyo_channel_ids if jikkyo_channel_id in NDGRClient.JIKKYO_CHANNEL_ID_MAP]
+        if len(nicolive_channel_ids) == 0:
+            return None
+
+        # ログインには番組 ID が不要なため、実況チャンネル ID を指定して NDGRClient を初期化する
+        ndgr_client = NDGRClient(nicolive_channel_ids[0], verbose=self.verbose, console_output=True)
+        try:
+            await self.nicolive_session.prepare(ndgr_client)
+        except LoginError:
+            # ログインに失敗した場合は Cookie を渡さず、各ワーカープロセスではニコニコ生放送の番組のダウンロードだけを失敗させる
+            ## ワーカープロセスごとにログインし直すと、パスワードの誤りなどで短時間に何度もログインを試みることになる
+            print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Failed to login to niconico. Nicolive comments will be skipped.')
+            print(traceback.format_exc())
+            return None
+        return self.nicolive_session.cookies
+
+
+    async def crawlChannels(
+        self,
+        jikkyo_channel_ids: list[str],
+        target_date: date,
+        source_caches: dict[str, dict[str, list[Comment]]] | None = None,
+    ) -> dict[str, int]:
+        """
+        複数の実況チャンネルの過去ログを並列に収集する
+
+        Args:
+            jikkyo_channel_ids (list[str]): 過去ログを収集する実況チャンネル ID のリスト
+            target_date (date): 過去ログを収集する日付
+            source_caches (dict[str, dict[str, list[Comment]]] | None, default=None): 実況チャンネル ID ごとのダウンロード済みのコメントのキャッシュ (crawlChannelOnce() を参照)
+
+        Returns:
+            dict[str, int]: 実況チャンネル ID ごとの保存対象コメント数 (jikkyo_channel_ids の順序を維持し、収集に失敗したチャンネルは含まない)
+        """
+
+        results = await asyncio.gather(*[
+            self.crawlChannel(jikkyo_channel_id, target_date, source_caches.setdefault(jikkyo_channel_id, {}) if source_caches is not None else None)
+            for jikkyo_channel_id in jikkyo_channel_ids
+        ])
+
+        # asyncio.gather() は引数の順序通りに結果を返すため、ここで実況チャンネルの順序が元に戻る
+        return {
+            jikkyo_channel_id: count
+            for jikkyo_channel_id, count in zip(jikkyo_channel_ids, results)
+            if count is not None
+        }
+
+
+    async def crawlChannel(self, jikkyo_channel_id: str, target_date: date, source_cache: dict[str, list[Comment]] | None = None) -> int | None:
+        """
+        指定した実況チャンネルの過去ログを収集し、保存する
+        エラー発生時は MAX_RETRY_COUNT 回まで試行する
+
+        Args:
+            jikkyo_channel_id (str): 過去ログを収集する実況チャンネル ID
+            target_date (date): 過去ログを収集する日付
+            source_cache (dict[str, list[Comment]] | None, default=None): ダウンロード済みのコメントのキャッシュ (crawlChannelOnce() を参照)
+
+        Returns:
+            int | None: 保存対象のコメント数 (リトライに失敗した場合は None)
+        """
+
+        # リトライする場合も完了済みのダウンロードを使い回せるよう、キャッシュが指定されていなくてもこの収集の間だけキャッシュする
+        if source_cache is None:
+            source_cache = {}
+
+        async with self.channel_semaphore:
+            with self.metrics.measure('channel', jikkyo_channel_id=jikkyo_channel_id, date=target_date.isoformat()) as fields:
+                for retry_count in range(self.MAX_RETRY_COUNT):
+                    fields['retries'] = retry_count
+                    try:
+                        fields['comments'] = await self.crawlChannelOnce(jikkyo_channel_id, target_date, source_cache)
+                        return fields['comments']
+                    except LoginError:
+                        # ログインの失敗はリトライしても成功しないため、リトライせずにこのチャンネルはスキップする
+                        ## リトライのたびにログインを試みると、アカウントがロックされかねない
+                        self.print(jikkyo_channel_id, 'Failed to login to niconico. Skipping without retrying ...')
+                        print(traceback.format_exc())
+                        fields['status'] = 'error'
+                        print(Rule(characters='=', style=Style(color='#E33157')))
+                        break
+                    except Exception:
+                        if retry_count < self.MAX_RETRY_COUNT - 1:
+                            # エラー発生時は MAX_RETRY_COUNT 回までリトライ
+                            self.print(jikkyo_channel_id, f'Unexpected error occurred. Retrying ({retry_count + 1}/{self.MAX_RETRY_COUNT}) '
+                                                          f'after {self.RETRY_INTERVAL} seconds ...')
+                            print(traceback.format_exc())
+                            await asyncio.sleep(self.RETRY_INTERVAL)
+                        else:
+                            # リトライ失敗、このチャンネルはスキップして次の実況チャンネルへ
+                            self.print(jikkyo_channel_id, 'Unexpected error occurred. Retrying failed. Skipping ...')
+                            print(traceback.format_exc())
+                            fields['status'] = 'error'
+                        print(Rule(characters='=', style=Style(color='#E33157')))
+        return None
+
+
+    async def crawlChannelOnce(self, jikkyo_channel_id: str, target_date: date, source_cache: dict[str, list[Comment]] | None = None) -> int:
+        """
+        指定した実況チャンネルの過去ログを1回だけ収集し、保存する
+
+        source_cache を指定すると、ダウンロードしたニコニコ生放送番組・NX-Jikkyo スレッドのコメントを取得元ごとに保持し、
+        同じ取得元が次に収集する日付にも掛かっている場合はダウンロードし直さずに使い回す
+        同じ実況チャンネルの日付を昇順に収集する場合に、日付をまたぐ取得元を1回のダウンロードで両方の日付に振り分けるために使う
+        指定した日付に掛かっていない取得元はキャッシュから取り除かれるため、保持されるのは常に1日分の取得元だけになる
+
+        Args:
+            jikkyo_channel_id (str): 過去ログを収集する実況チャンネル ID
+            target_date (date): 過去ログを収集する日付
+            source_cache (dict[str, list[Comment]] | None, default=None): 取得元 (nicolive:{番組 ID} / nx:{スレッド ID}) をキーとしたダウンロード済みのコメントのキャッシュ
+
+        Returns:
+            int: 保存対象のコメント数
+        """
+
+        self.print(jikkyo_channel_id, f'Retrieve comments broadcast during {target_date.strftime("%Y/%m/%d")}.')
+
+        # 指定された日付に一部でも放送されたニコニコ生放送番組・NX-Jikkyo スレッドを並列に取得
+        with self.metrics.measure('stage', jikkyo_channel_id=jikkyo_channel_id, stage='listing'):
+            nicolive_program_ids, nx_thread_ids = await asyncio.gather(
+                self.getNicoliveProgramIDs(jikkyo_channel_id, target_date),
+                self.thread_index.getThreadIDsOnDate(jikkyo_channel_id, target_date),
+            )
+        self.print(jikkyo_channel_id, f'Retrieving Nicolive comments from {len(nicolive_program_ids)} programs.' +
+                   (f' ({", ".join(nicolive_program_ids)})' if len(nicolive_program_ids) > 0 else ''))
+        self.print(jikkyo_channel_id, f'Retrieving NX-Jikkyo comments from {len(nx_thread_ids)} threads.' +
+                   (f' ({", ".join(map(str, nx_thread_ids))})' if len(nx_thread_ids) > 0 else ''))
+
+        # 指定された日付に掛かっていない取得元のコメントをキャッシュから取り除く
+        source_keys = [f'nicolive:{program_id}' for program_id in nicolive_program_ids] + [f'nx:{thread_id}' for thread_id in nx_thread_ids]
+        if source_cache is not None:
+            for source_key in list(source_cache.keys()):
+                if source_key not in source_keys:
+                    del source_cache[source_key]
+
+        # ニコニコ生放送番組・NX-Jikkyo スレッドのコメントを並列にダウンロード
+        ## 同時実行数は取得元ごとのセマフォで制限される
+        ## キャッシュにある取得元はダウンロードせずにそのまま使う
+        with self.metrics.measure('stage', jikkyo_channel_id=jikkyo_channel_id, stage='download'):
+            sources: list[list[Comment]] = await asyncio.gather(
+                *[self.downloadSource(source_key, source_cache, partial(self.downloadNicoliveComments, jikkyo_channel_id, nicolive_program_id))
+                  for source_key, nicolive_program_id in zip(source_keys, nicolive_program_ids)],
+                *[self.downloadSource(source_key, source_cache, partial(self.downloadNXComments, jikkyo_channel_id, nx_thread_id))
+                  for source_key, nx_thread_id in zip(source_keys[len(nicolive_program_ids):], nx_thread_ids)],
+            )
+        self.print(jikkyo_channel_id, f'Total comments: {sum(len(source) for source in sources)}')
+
+        # 取得元ごとにコメントを投稿日時昇順で並び替え
+        ## この後ニコニコ実況と NX-Jikkyo のコメントを時系列で K-way マージするためにこの処理が必要
+        ## NX-Jikkyo のコメントは並び替え済みのため、ほぼ O(n) で済む
+        with self.metrics.measure('stage', jikkyo_channel_id=jikkyo_channel_id, stage='sort'):
+            for source in sources:
+                source.sort(key=getDateWithUsec)
+
+        # 指定された日付に投稿されたコメントだけを時系列でマージしながら
+        # {kakolog_dir}/{jikkyo_channel_id}/{date.year}/{date.strftime('%Y%m%d')}.nicojk に保存
+        ## 差分収集モードでは、前回保存したコメントより新しいコメントだけを既存の .nicojk ファイルに追記する
+        ## ほかのプロセス・ホストが同じ .nicojk ファイルを同時に書き換えないよう、保存中はファイルごとのロックを取得する
+        ## ロックの取得を待つ間も、ほかの実況チャンネルの収集やダウンロードが止まらないよう async with で取得する
+        self.print(jikkyo_channel_id, f'Excluding comments posted on dates other than {target_date.strftime("%Y/%m/%d")} ...')
+        with self.metrics.measure('stage', jikkyo_channel_id=jikkyo_channel_id, stage='save'):
+            async with FileLock(getLockPath(self.kakolog_dir, self.getOutputFile(jikkyo_channel_id, target_date))):
+                if self.incremental is True:
+                    count = self.appendNewComments(jikkyo_channel_id, target_date, sources)
+                else:
+                    count = self.saveComments(jikkyo_channel_id, target_date, sources)
+        print(Rule(characters='=', style=Style(color='#E33157')))
+
+        return count
+
+
+    async def downloadSource(self, source_key: str, source_cache: dict[str, list[Comment]] | None, download: Callable[[], Awaitable[list[Comment]]]) -> list[Comment]:
+        """
+        キャッシュにある取得元のコメントはそのまま返し、ない場合はダウンロードしてキャッシュに保存する
+        ダウンロードが完了した取得元から順にキャッシュに保存するため、他の取得元のダウンロードに失敗してリトライする場合も完了済みのものは使い回される
+
+        Args:
+            source_key (str): 取得元のキー (nicolive:{番組 ID} / nx:{スレッド ID})
+            source_cache (dict[str, list[Comment]] | None): ダウンロード済みのコメントのキャッシュ (None の場合はキャッシュしない)
+            download (Callable[[], Awaitable[list[Comment]]]): 取得元のコメントをダウンロードする関数
+
+        Returns:
+            list[Comment]: 取得元のコメントのリスト
+        """
+
+        if source_cache is not None and source_key in source_cache:
+            return source_cache[source_key]
+        comments = await download()
+        if source_cache is not None:
+            source_cache[source_key] = comments
+        return comments
+
+
+    def getFinishedSourceKeys(self, jikkyo_channel_id: str, target_date: date) -> set[str]:
+        """
+        指定した日付に掛かる取得元のうち、放送が終了していてコメントがこれ以上増えないもののキーを取得する
+        インデックスで放送終了済み (PAST) になっている NX-Jikkyo スレッドだけが対象で、
+        ニコニコ生放送番組は放送が終了したかどうかを番組 ID だけでは判別できないため含めない
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+
+        Returns:
+            set[str]: 放送が終了した取得元のキー (nx:{スレッド ID}) の集合
+        """
+
+        return {f'nx:{thread_id}' for thread_id, status in self.thread_index.query(jikkyo_channel_id, target_date) if status == 'PAST'}
+
+
+    async def getNicoliveProgramIDs(self, jikkyo_channel_id: str, target_date: date) -> list[str]:
+        """
+        指定された日付に一部でも放送されたニコニコ生放送番組の ID を取得する
+        NX-Jikkyo にはあるが本家ニコニコ実況に存在しない実況チャンネル (ex: jk141) では空のリストを返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 番組を取得する日付
+
+        Returns:
+            list[str]: ニコニコ生放送番組 ID のリスト
+        """
+
+        if jikkyo_channel_id not in NDGRClient.JIKKYO_CHANNEL_ID_MAP:
+            self.print(jikkyo_channel_id, f'Skipping retrieval of Nicolive comments as the channel {jikkyo_channel_id} does not exist on Nicolive.')
+            return []
+        async with self.nicolive_semaphore:
+            return await self.rate_limiter.request(
+                self.NICOLIVE_HOST,
+                partial(NDGRClient.getProgramIDsOnDate, jikkyo_channel_id, target_date),
+                partial(self.onRetry, jikkyo_channel_id, 'Nicolive program list', None),
+            )
+
+
+    async def downloadNicoliveComments(self, jikkyo_channel_id: str, nicolive_program_id: str) -> list[Comment]:
+        """
+        ニコニコ生放送番組のコメントをダウンロードし、Comment に変換して返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID (計測の記録に使う)
+            nicolive_program_id (str): ニコニコ生放送番組 ID
+
+        Returns:
+            list[Comment]: ダウンロードしたコメントのリスト
+        """
+
+        async with self.nicolive_semaphore:
+            with self.metrics.measure('download', jikkyo_channel_id=jikkyo_channel_id, source='nicolive', source_id=nicolive_program_id) as fields:
+
+                async def download() -> list[Any]:
+
+                    # NDGRClient を初期化し、共有のログインセッションを使うように準備
+                    ## ログインはプロセス内で1回だけ行われ、セッションが切れたときのみ再ログインする
+                    ndgr_client = NDGRClient(nicolive_program_id, verbose=self.verbose, console_output=True)
+                    await self.nicolive_session.prepare(ndgr_client)
+
+                    try:
+                        return await ndgr_client.downloadBackwardComments()
+                    except Exception:
+                        # ログインセッションが切れている可能性もあるので、次回の準備時にログインし直す
+                        self.nicolive_session.invalidate()
+                        raise
+
+                # コメントをダウンロードしてリストで返す
+                ## 失敗した場合は、この番組のダウンロードだけをリトライする
+                nicolive_comments = await self.rate_limiter.request(
+                    self.NICOLIVE_HOST, download, partial(self.onRetry, jikkyo_channel_id, f'Nicolive program {nicolive_program_id}', fields),
+                )
+                comments = [
+                    Comment.fromXMLCompatibleComment(NDGRClient.convertToXMLCompatibleComment(comment))
+                    for comment in nicolive_comments
+                ]
+                fields['comments'] = len(comments)
+                return comments
+
+
+    async def downloadNXComments(self, jikkyo_channel_id: str, nx_thread_id: int) -> list[Comment]:
+        """
+        NX-Jikkyo スレッドのコメントをダウンロードして返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID (計測の記録に使う)
+            nx_thread_id (int): NX-Jikkyo スレッド ID
+
+        Returns:
+            list[Comment]: ダウンロードしたコメントのリスト
+        """
+
+        async with self.nx_semaphore:
+
+            with self.metrics.measure('download', jikkyo_channel_id=jikkyo_channel_id, source='nx', source_id=nx_thread_id) as fields:
+
+                async def download() -> list[Comment]:
+
+                    # NXClient を初期化
+                    nx_client = NXClient(nx_thread_id, verbose=self.verbose, console_output=True)
+
+                    try:
+                        return await nx_client.downloadComments()
+                    finally:
+                        fields['bytes'] = nx_client.downloaded_bytes
+                        if nx_client.status_code is not None:
+                            fields['http_status'] = nx_client.status_code
+
+                # コメントをダウンロードしてリストで返す
+                ## 失敗した場合は、このスレッドのダウンロードだけをリトライする
+                comments = await self.rate_limiter.request(
+                    NXClient.API_HOST, download, partial(self.onRetry, jikkyo_channel_id, f'NX-Jikkyo thread {nx_thread_id}', fields),
+                )
+                fields['comments'] = len(comments)
+                return comments
+
+
+    def onRetry(self, jikkyo_channel_id: str, description: str, fields: dict[str, Any] | None, host: str, attempt: int, error: Exception, delay: float) -> None:
+        """
+        RateLimiter がリクエストをリトライする前に呼び出され、リトライしたことをログと計測結果に記録する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            description (str): リクエストの説明 (ログに出力する)
+            fields (dict[str, Any] | None): リトライ回数を記録する計測中のイベントのフィールド
+            host (str): リクエスト先のホスト名
+            attempt (int): 失敗した試行の回数
+            error (Exception): 発生した例外
+            delay (float): リトライまでの待機時間 (秒)
+        """
+
+        status_code = getStatusCode(error)
+        self.print(jikkyo_channel_id, f'Request for {description} failed ({status_code if status_code is not None else type(error).__name__}). '
+                                      f'Retrying ({attempt}/{self.rate_limiter.MAX_ATTEMPTS - 1}) after {delay:.1f} seconds ...')
+        if fields is not None:
+            fields['retries'] = attempt
+        self.metrics.record('retry', jikkyo_channel_id=jikkyo_channel_id, host=host, attempt=attempt, delay=round(delay, 3),
+                            error=type(error).__name__, **({'http_status': status_code} if status_code is not None else {}))
+
+
+    def getOutputFile(self, jikkyo_channel_id: str, target_date: date) -> Path:
+        """
+        コメントを保存する .nicojk ファイルのパスを取得する
+        {kakolog_dir}/{jikkyo_channel_id}/{date.year}/{date.strftime('%Y%m%d')}.nicojk
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): コメントが投稿された日付
+
+        Returns:
+            Path: .nicojk ファイルのパス
+        """
+
+        return self.kakolog_dir / jikkyo_channel_id / str(target_date.year) / f'{target_date.strftime("%Y%m%d")}.nicojk'
+
+
+    def saveComments(self, jikkyo_channel_id: str, target_date: date, sources: list[list[Comment]]) -> int:
+        """
+        指定された日付に投稿されたコメントを {kakolog_dir}/{jikkyo_channel_id}/{date.year}/{date.strftime('%Y%m%d')}.nicojk に保存する
+        既存のファイルに保存済みのコメントのうち今回ダウンロードしたコメントに含まれないもの (スパム判定で削除されたコメントなど) がある場合は、
+        既存のファイルのコメントとの和集合を保存する (--force が指定された場合は今回ダウンロードしたコメントだけで上書きする)
+        書き込む内容が既存のファイルと同じ場合はファイルを書き換えない
+        保存したコメントのスレッドごとの最新のコメント番号・コメント数と、ファイルの内容のハッシュはマニフェストに記録する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): コメントが投稿された日付
+            sources (list[list[Comment]]): 取得元ごとのコメントのリスト (それぞれ投稿日時昇順)
+
+        Returns:
+            int: 保存したコメントの数
+        """
+
+        output_file = self.getOutputFile(jikkyo_channel_id, target_date)
+        start, end = getDateRange(target_date)
+
+        # 既存のファイルに、今回ダウンロードしたコメントに含まれないコメントがある場合は既存のファイルのコメントも取得元に加える
+        ## 既存のファイルのコメントは投稿日時昇順で保存されているが、念のため並び替えておく (並び替え済みならほぼ O(n) で済む)
+        ## 同じスレッド ID・コメント番号のコメントは、今回ダウンロードしたコメントを優先して1件だけ残す
+        if output_file.exists() and self.force is False and \
+           self.hasMissingComments(self.manifest.getThreadStates(jikkyo_channel_id, target_date), sources, start, end) is True:
+            self.print(jikkyo_channel_id, 'Some previously saved comments are not included in the retrieved comments. '
+                                          'Merging with the existing log ...')
+            existing_comments = list(iterComments(output_file))
+            existing_comments.sort(key=getDateWithUsec)
+            sources = sources + [existing_comments]
+
+        # 取得元ごとのコメントを時系列でマージしながら、1件ずつ一時ファイルに書き込む
+        ## 既存のファイルは commit() を呼び出すまで変更されない
+        ## 圧縮アーカイブも保存する場合は、.nicojk ファイルに書き込んだ <chat> 要素をそのまま圧縮アーカイブにも書き込む
+        thread_states: dict[str, ThreadState] = {}
+        archive_path = getArchivePath(output_file)
+        with NicojkWriter(output_file) as writer, \
+             (NicojkArchiveWriter(archive_path) if self.archive is True else nullcontext()) as archive_writer:
+            for comment in Manifest.trackThreadStates(uniqueComments(mergeComments(sources, start, end)), thread_states):
+                line = writer.write(comment)
+                if archive_writer is not None:
+                    archive_writer.write(comment, line)
+            self.print(jikkyo_channel_id, f'Final comments: {writer.count}')
+
+            # コメントが1件も取得できていない場合は過去ログを保存しない
+            if writer.count == 0:
+                self.print(jikkyo_channel_id, f'No comments found on {target_date.strftime("%Y/%m/%d")}. Skipping ...')
+                return 0
+
+            # 書き込んだ内容が前回保存した内容と同じ場合は、既存のファイルを書き換えない
+            ## ファイルの更新日時が変わらないため、後段の git add などでも変更なしとして扱われる
+            file_state = self.manifest.getFileState(jikkyo_channel_id, target_date)
+            ## 圧縮アーカイブも保存する場合は、圧縮アーカイブが既存のファイルの内容から作成されたものであることも条件にする
+            ## (--archive なしで .nicojk ファイルだけが書き換えられ、圧縮アーカイブが古いまま残っている場合がある)
+            if file_state is not None and file_state.sha256 == writer.sha256 and \
+               output_file.exists() and output_file.stat().st_size == file_state.size and \
+               (self.archive is False or isArchiveUpToDate(output_file, writer.sha256) is True):
+                self.print(jikkyo_channel_id, 'The log is unchanged since the last save. Skipping ...')
+                return writer.count
+
+            # 一時ファイルで既存のファイルをアトミックに置き換える
+            ## dataset_structure.json には .nicojk ファイルだけを載せるため、圧縮アーカイブと索引ファイルは created_files に含めない
+            if output_file.exists() is False:
+                self.created_files.append(output_file)
+            writer.commit()
+            if archive_writer is not None:
+                archive_writer.commit(writer.sha256, writer.size)
+
+        self.manifest.saveThreadStates(jikkyo_channel_id, target_date, thread_states)
+        self.manifest.saveFileState(jikkyo_channel_id, target_date, FileState(writer.sha256, writer.size, writer.count))
+        self.print(jikkyo_channel_id, f'Log saved to {output_file}.')
+        return writer.count
+
+
+    def hasMissingComments(self, thread_states: dict[str, ThreadState], sources: list[list[Comment]], start: float, end: float) -> bool:
+        """
+        既存の .nicojk ファイルに保存済みのコメントのうち、今回ダウンロードしたコメントに含まれないものがあるかどうかを判定する
+        スレッドごとに、記録済みの最新のコメント番号以下のコメントの数を記録済みのコメント数と比較するため、既存のファイルは読み込まない
+
+        Args:
+            thread_states (dict[str, ThreadState]): マニフェストに記録された、保存済みのコメントのスレッドごとの情報
+            sources (list[list[Comment]]): 取得元ごとのコメントのリスト (それぞれ投稿日時昇順)
+            start (float): 範囲の開始 (この値を含む) の UNIX タイムスタンプ
+            end (float): 範囲の終了 (この値を含まない) の UNIX タイムスタンプ
+
+        Returns:
+            bool: 含まれないコメントがある (または記録がなく判定できない) 場合は True
+        """
+
+        # マニフェストに記録がない (以前のバージョンで保存された) 場合は判定できない
+        if len(thread_states) == 0 or any(state.comment_count is None for state in thread_states.values()):
+            return True
+
+        counts: dict[str, int] = dict.fromkeys(thread_states, 0)
+        for source in sources:
+            for comment in sliceComments(source, start, end):
+                state = thread_states.get(comment.thread)
+                if state is not None and comment.no <= state.last_no:
+                    counts[comment.thread] += 1
+        return any(counts[thread] < (state.comment_count or 0) for thread, state in thread_states.items())
+
+
+    def appendNewComments(self, jikkyo_channel_id: str, target_date: date, sources: list[list[Comment]]) -> int:
+        """
+        指定された日付に投稿されたコメントのうち、前回保存したコメントより新しいコメントだけを既存の .nicojk ファイルに追記する
+        マニフェストに記録がない場合や、追記すると時系列順が崩れる場合は saveComments() で全体を保存する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): コメントが投稿された日付
+            sources (list[list[Comment]]): 取得元ごとのコメントのリスト (それぞれ投稿日時昇順)
+
+        Returns:
+            int: 指定された日付に投稿されたコメントの数
+        """
+
+        output_file = self.getOutputFile(jikkyo_channel_id, target_date)
+
+        # マニフェストに記録がないか、既存ファイルに追記できない場合は全体を保存する
+        thread_states = self.manifest.getThreadStates(jikkyo_channel_id, target_date)
+        if len(thread_states) == 0 or isAppendable(output_file) is False:
+            return self.saveComments(jikkyo_channel_id, target_date, sources)
+
+        # スレッドごとに、前回保存したコメントよりコメント番号が大きいコメントだけを抽出
+        count = 0
+        new_comments: list[Comment] = []
+        for comment in mergeComments(sources, *getDateRange(target_date)):
+            count += 1
+            if comment.thread not in thread_states or comment.no > thread_states[comment.thread].last_no:
+                new_comments.append(comment)
+        self.print(jikkyo_channel_id, f'Final comments: {count}')
+        if len(new_comments) == 0:
+            self.print(jikkyo_channel_id, 'No new comments since the last save. Skipping ...')
+            return count
+
+        # 既存ファイルの最新のコメントより前に投稿されたコメントがある場合は、追記すると時系列順が崩れるため全体を保存する
+        ## 片方の取得元のコメントだけが遅れて反映された場合などに起こりうる
+        last_date_with_usec = max(state.last_date_with_usec for state in thread_states.values())
+        if new_comments[0].date_with_usec < last_date_with_usec:
+            self.print(jikkyo_channel_id, 'New comments are older than the last saved comment. Saving the whole log ...')
+            return self.saveComments(jikkyo_channel_id, target_date, sources)
+
+        # 新しいコメントだけを追記
+        ## 圧縮アーカイブも保存する場合は圧縮アーカイブにも追記する
+        ## 圧縮アーカイブがまだないか、追記前の .nicojk ファイルの内容から作成されたものでない場合は、追記後の .nicojk ファイルから作り直す
+        archive_path = getArchivePath(output_file)
+        is_archive_up_to_date = self.archive is True and isArchiveUpToDate(output_file)
+        appendComments(output_file, new_comments)
+
+        # 追記後のファイルの内容のハッシュは、追記したファイルを読み込んで算出し直す
+        sha256 = hashFile(output_file)
+        size = output_file.stat().st_size
+        if self.archive is True:
+            if is_archive_up_to_date is True:
+                appendArchive(archive_path, new_comments, sha256, size)
+            else:
+                buildArchive(output_file)
+        self.manifest.saveThreadStates(jikkyo_channel_id, target_date, Manifest.computeThreadStates(new_comments, thread_states))
+
+        # 内容の記録がない場合は、次に全体を保存するときに記録される
+        file_state = self.manifest.getFileState(jikkyo_channel_id, target_date)
+        if file_state is not None:
+            self.manifest.saveFileState(jikkyo_channel_id, target_date, FileState(
+                sha256 = sha256,
+                size = size,
+                comment_count = file_state.comment_count + len(new_comments),
+            ))
+        self.print(jikkyo_channel_id, f'Appended {len(new_comments)} new comments to {output_file}.')
+        return count
+
+
+    def print(self, jikkyo_channel_id: str, message: str) -> None:
+        """
+        実況チャンネル ID と現在時刻を付与して動作ログをコンソールに出力する
+        複数の実況チャンネルを並列に収集するため、どのチャンネルのログかを判別できるようにしている
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            message (str): 出力するメッセージ
+        """
+
+        print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] {message}')
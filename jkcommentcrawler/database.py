@@ -0,0 +1,25 @@
+import sqlite3
+from pathlib import Path
+
+
+# JKCommentCrawler が内部状態の保存に使う SQLite データベースのパス
+## cookies.json と同じく、JKCommentCrawler 本体のフォルダに配置する
+DATABASE_PATH = Path(__file__).parent.parent / 'JKCommentCrawler.db'
+
+
+def connectDatabase(database_path: Path = DATABASE_PATH) -> sqlite3.Connection:
+    """
+    JKCommentCrawler の内部状態を保存する SQLite データベースに接続する
+    複数のプロセスから同時に読み書きされても待ち合わせできるよう、WAL モードとタイムアウトを設定している
+
+    Args:
+        database_path (Path, default=DATABASE_PATH): SQLite データベースのパス
+
+    Returns:
+        sqlite3.Connection: SQLite データベースへの接続
+    """
+
+    connection = sqlite3.connect(database_path, timeout=60)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    return connection
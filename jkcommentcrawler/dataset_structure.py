@@ -0,0 +1,183 @@
+import json
+import os
+import tempfile
+import typer
+from ndgr_client.utils import AsyncTyper
+from pathlib import Path
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+from typing import Any
+
+from jkcommentcrawler import __version__
+from jkcommentcrawler.config import loadConfig
+from jkcommentcrawler.file_lock import FileLock, getLockPath
+
+
+# dataset_structure.json に載せるファイルの拡張子
+NICOJK_SUFFIX = '.nicojk'
+
+
+class DatasetStructure:
+    """
+    過去ログデータのフォルダ/ファイル構造を示す dataset_structure.json を管理する
+    dataset_structure.json は {実況チャンネル ID: {年: {ファイル名: null}}} の形式で、各階層のキーは名前順に並ぶ
+    ファイルは .nicojk ファイルだけを載せる (圧縮アーカイブ・索引ファイル・書き込み途中の一時ファイルは含めない)
+    過去ログフォルダ全体を走査し直すのは重いため、通常は既存の dataset_structure.json に今回作成したファイルだけを追加する
+    """
+
+    # dataset_structure.json のファイル名
+    FILE_NAME = 'dataset_structure.json'
+
+
+    def __init__(self, kakolog_dir: Path) -> None:
+        """
+        DatasetStructure のコンストラクタ
+
+        Args:
+            kakolog_dir (Path): 過去ログを保存するフォルダのパス
+        """
+
+        self.kakolog_dir = kakolog_dir
+        self.path = kakolog_dir / self.FILE_NAME
+
+
+    def scan(self, directory_path: Path | None = None, nest: bool = False) -> dict[str, Any]:
+        """
+        過去ログフォルダを再帰的に走査し、フォルダ/ファイル構造を取得する
+        トップレベルでは jk から始まるフォルダ (実況チャンネル) だけを、その下では .nicojk ファイルだけを対象にする
+
+        Args:
+            directory_path (Path | None, default=None): 走査するフォルダのパス (None の場合は過去ログフォルダ)
+            nest (bool, default=False): 実況チャンネルのフォルダ以下を走査しているかどうか
+
+        Returns:
+            dict[str, Any]: フォルダ/ファイル構造
+
+        Raises:
+            FileNotFoundError: フォルダが存在しない場合
+        """
+
+        if directory_path is None:
+            directory_path = self.kakolog_dir
+        if not directory_path.exists():
+            raise FileNotFoundError(f'Directory "{directory_path}" does not exist.')
+        data: dict[str, Any] = {}
+        for item in sorted(directory_path.iterdir()):
+            if item.is_dir() and (item.name.startswith('jk') or nest is True):
+                data[item.name] = self.scan(item, nest=True)
+            elif item.is_file() and nest is True and item.suffix == NICOJK_SUFFIX:
+                data[item.name] = None
+        return data
+
+
+    def rebuild(self) -> None:
+        """
+        過去ログフォルダ全体を走査し直して dataset_structure.json を作り直す
+        """
+
+        with FileLock(getLockPath(self.kakolog_dir, self.path)):
+            self.save(self.scan())
+
+
+    def update(self, created_files: list[Path]) -> bool:
+        """
+        既存の dataset_structure.json に、新たに作成したファイルだけを追加する
+        dataset_structure.json がまだない場合は、過去ログフォルダ全体を走査して作成する
+        複数のプロセス・ホストから更新されても追加したファイルが失われないよう、読み込みから書き込みまでロックを取得する
+
+        Args:
+            created_files (list[Path]): 新たに作成したファイルのパスのリスト (過去ログフォルダ以下にある必要がある)
+
+        Returns:
+            bool: dataset_structure.json を書き換えた場合は True
+        """
+
+        if self.path.exists() is False:
+            self.rebuild()
+            return True
+
+        with FileLock(getLockPath(self.kakolog_dir, self.path)):
+            return self.merge(created_files)
+
+
+    def merge(self, created_files: list[Path]) -> bool:
+        """
+        既存の dataset_structure.json を読み込み、新たに作成したファイルを追加して書き込む
+        update() からロックを取得した状態で呼び出される
+
+        Args:
+            created_files (list[Path]): 新たに作成したファイルのパスのリスト (過去ログフォルダ以下にある必要がある)
+
+        Returns:
+            bool: dataset_structure.json を書き換えた場合は True
+        """
+
+        with open(self.path, encoding='utf-8') as f:
+            structure: dict[str, Any] = json.load(f)
+
+        changed = False
+        for created_file in created_files:
+            parts = created_file.relative_to(self.kakolog_dir).parts
+            if len(parts) < 2 or parts[0].startswith('jk') is False or created_file.suffix != NICOJK_SUFFIX:
+                continue
+
+            # 各階層をたどりながら、存在しないキーを追加する
+            ## 追加した階層だけを名前順に並べ直し、scan() で作成した場合と同じ順序を保つ
+            node = structure
+            for index, name in enumerate(parts):
+                is_file = index == len(parts) - 1
+                if name not in node:
+                    node[name] = None if is_file else {}
+                    sorted_items = sorted(node.items())
+                    node.clear()
+                    node.update(sorted_items)
+                    changed = True
+                if is_file is False:
+                    node = node[name]
+
+        if changed is True:
+            self.save(structure)
+        return changed
+
+
+    def save(self, structure: dict[str, Any]) -> None:
+        """
+        dataset_structure.json をアトミックに書き込む
+
+        Args:
+            structure (dict[str, Any]): フォルダ/ファイル構造
+        """
+
+        fd, temp_path = tempfile.mkstemp(dir=self.kakolog_dir, prefix=f'.{self.FILE_NAME}.', suffix='.tmp')
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump(structure, f, ensure_ascii=False, indent=4)
+            os.chmod(temp_path, self.path.stat().st_mode & 0o777 if self.path.exists() else 0o644)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+
+app = AsyncTyper()
+
+def version(value: bool):
+    if value is True:
+        typer.echo(f'JKCommentCrawler version {__version__}')
+        raise typer.Exit()
+
+@app.command(help='JKCommentCrawler: Rebuild dataset_structure.json by rescanning the whole kakolog folder')
+async def rebuild(
+    version: bool = typer.Option(None, '--version', callback=version, is_eager=True, help='バージョン情報を表示する。'),
+):
+    print(Rule(characters='=', style=Style(color='#E33157')))
+    config = loadConfig()
+    dataset_structure = DatasetStructure(config.kakolog_dir)
+    dataset_structure.rebuild()
+    print(f'Dataset structure saved to {dataset_structure.path}.')
+    print(Rule(characters='=', style=Style(color='#E33157')))
+
+
+if __name__ == '__main__':
+    app()
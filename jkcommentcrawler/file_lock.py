@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Self
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+# ロックファイルを保存する、過去ログフォルダ直下のフォルダ名
+## jk から始まらないため、dataset_structure.json には含まれない
+LOCK_DIR_NAME = '.locks'
+
+
+def getLockPath(kakolog_dir: Path, path: Path) -> Path:
+    """
+    過去ログフォルダ以下のファイルに対応するロックファイルのパスを取得する
+    {kakolog_dir}/.locks/{過去ログフォルダからの相対パス}.lock
+
+    Args:
+        kakolog_dir (Path): 過去ログフォルダのパス
+        path (Path): ロックする対象のファイルのパス (過去ログフォルダ以下にある必要がある)
+
+    Returns:
+        Path: ロックファイルのパス
+    """
+
+    # 過去ログフォルダは Git リポジトリとして公開されるため、ロックファイルがコミットされないよう .gitignore を置いておく
+    lock_dir = kakolog_dir / LOCK_DIR_NAME
+    if (lock_dir / '.gitignore').exists() is False:
+        lock_dir.mkdir(parents=True, exist_ok=True)
+        (lock_dir / '.gitignore').write_text('*\n', encoding='utf-8')
+
+    relative_path = path.relative_to(kakolog_dir)
+    return lock_dir / relative_path.with_name(f'{relative_path.name}.lock')
+
+
+class FileLock:
+    """
+    複数のプロセスから同じファイルを同時に書き換えないようにするための排他ロック
+    対象のファイルは os.replace() でアトミックに置き換えられるため、対象のファイルではなく別のロックファイルをロックする
+    過去ログフォルダを NFS などで共有していれば、複数のホスト間でも排他できる
+    ロックを取得できるまで待つ間にイベントループを止めないよう、非同期処理の中では async with で使う
+
+    Usage:
+        with FileLock(getLockPath(kakolog_dir, output_file)):
+            ...
+        async with FileLock(getLockPath(kakolog_dir, output_file)):
+            ...
+    """
+
+    # ほかのプロセスがロックを取得している場合に、ロックの取得を再試行する間隔 (秒)
+    POLL_INTERVAL = 0.1
+
+
+    def __init__(self, lock_path: Path) -> None:
+        """
+        FileLock のコンストラクタ
+
+        Args:
+            lock_path (Path): ロックファイルのパス
+        """
+
+        self.lock_path = lock_path
+        self.file: IO[bytes] | None = None
+
+
+    def __enter__(self) -> Self:
+        self.acquire()
+        return self
+
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        self.release()
+
+
+    async def __aenter__(self) -> Self:
+        await self.acquireAsync()
+        return self
+
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        self.release()
+
+
+    def tryAcquire(self) -> bool:
+        """
+        ロックの取得を1回だけ試みる (ほかのプロセスがロックを取得している場合も待機しない)
+
+        Returns:
+            bool: ロックを取得できた場合は True
+        """
+
+        if self.file is None:
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.lock_path, 'a+b')
+        try:
+            if os.name == 'nt':
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+
+    def acquire(self) -> None:
+        """
+        ロックを取得する (ほかのプロセスがロックを取得している場合は解放されるまで待機する)
+        待機中に中断された場合は、ロックを取得せずにロックファイルを閉じる
+        """
+
+        try:
+            while self.tryAcquire() is False:
+                time.sleep(self.POLL_INTERVAL)
+        except BaseException:
+            self.release()
+            raise
+
+
+    async def acquireAsync(self) -> None:
+        """
+        ロックを取得する (ほかのプロセスがロックを取得している場合は、イベントループを止めずに解放されるまで待機する)
+        待機中にキャンセルされた場合は、ロックを取得せずにロックファイルを閉じる
+        """
+
+        try:
+            while self.tryAcquire() is False:
+                await asyncio.sleep(self.POLL_INTERVAL)
+        except BaseException:
+            self.release()
+            raise
+
+
+    def release(self) -> None:
+        """
+        ロックを解放する
+        """
+
+        if self.file is None:
+            return
+        try:
+            if os.name == 'nt':
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        except OSError:
+            # ロックを取得していない (取得を待っている途中で中断された) 場合
+            pass
+        self.file.close()
+        self.file = None
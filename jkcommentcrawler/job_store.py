@@ -0,0 +1,167 @@
+import time
+from datetime import date
+from pathlib import Path
+from typing import Iterable
+
+from jkcommentcrawler.database import DATABASE_PATH, connectDatabase
+
+
+class BackfillJobStore:
+    """
+    過去ログの一括収集 (バックフィル) のジョブを、実況チャンネル・日付ごとに記録するジョブストア
+    収集が完了したジョブを記録しておくことで、中断したバックフィルを再実行したときに続きから再開できる
+    """
+
+    # ジョブの状態
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+    def __init__(self, database_path: Path = DATABASE_PATH) -> None:
+        """
+        BackfillJobStore のコンストラクタ
+
+        Args:
+            database_path (Path, default=DATABASE_PATH): ジョブを保存する SQLite データベースのパス
+        """
+
+        self.connection = connectDatabase(database_path)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS backfill_jobs (
+                    channel_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    comment_count INTEGER,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (channel_id, date)
+                )
+            ''')
+
+
+    def plan(self, jikkyo_channel_ids: list[str], dates: list[date], redo: bool = False) -> None:
+        """
+        実況チャンネル・日付のすべての組み合わせをジョブとして登録する
+        すでに登録済みのジョブの状態は変更しない (redo が指定された場合は未実行に戻す)
+
+        Args:
+            jikkyo_channel_ids (list[str]): 実況チャンネル ID のリスト
+            dates (list[date]): 日付のリスト
+            redo (bool, default=False): 完了済みのジョブも未実行に戻して再度収集するかどうか
+        """
+
+        with self.connection:
+            self.connection.executemany(
+                f'''
+                INSERT INTO backfill_jobs (channel_id, date, status, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (channel_id, date) DO {'UPDATE SET status = excluded.status, updated_at = excluded.updated_at' if redo else 'NOTHING'}
+                ''',
+                [
+                    (jikkyo_channel_id, target_date.isoformat(), self.PENDING, time.time())
+                    for jikkyo_channel_id in jikkyo_channel_ids
+                    for target_date in dates
+                ],
+            )
+
+
+    def getRemainingDates(self, jikkyo_channel_id: str, start_date: date, end_date: date) -> list[date]:
+        """
+        指定した実況チャンネル・期間のジョブのうち、まだ完了していないジョブの日付を取得する
+        失敗したジョブも再度実行する対象に含む
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            start_date (date): 期間の開始日 (この日を含む)
+            end_date (date): 期間の終了日 (この日を含む)
+
+        Returns:
+            list[date]: 完了していないジョブの日付のリスト (日付昇順)
+        """
+
+        rows = self.connection.execute(
+            'SELECT date FROM backfill_jobs WHERE channel_id = ? AND date >= ? AND date <= ? AND status != ? ORDER BY date',
+            (jikkyo_channel_id, start_date.isoformat(), end_date.isoformat(), self.DONE),
+        ).fetchall()
+        return [date.fromisoformat(row[0]) for row in rows]
+
+
+    def getSummary(self, jikkyo_channel_id: str, start_date: date, end_date: date, dates: Iterable[date] | None = None) -> dict[str, int]:
+        """
+        指定した実況チャンネル・期間のジョブの状態ごとの件数と、収集したコメントの合計数を取得する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            start_date (date): 期間の開始日 (この日を含む)
+            end_date (date): 期間の終了日 (この日を含む)
+            dates (Iterable[date] | None, default=None): 集計するジョブの日付 (None の場合は期間内のすべてのジョブを集計する)
+
+        Returns:
+            dict[str, int]: 状態をキーとしたジョブの件数 (comments キーには完了したジョブのコメントの合計数が入る)
+        """
+
+        summary = {self.PENDING: 0, self.DONE: 0, self.FAILED: 0, 'comments': 0}
+        target_dates = {target_date.isoformat() for target_date in dates} if dates is not None else None
+        rows = self.connection.execute(
+            'SELECT date, status, comment_count FROM backfill_jobs WHERE channel_id = ? AND date >= ? AND date <= ?',
+            (jikkyo_channel_id, start_date.isoformat(), end_date.isoformat()),
+        ).fetchall()
+        for target_date, status, comment_count in rows:
+            if target_dates is not None and target_date not in target_dates:
+                continue
+            summary[status] += 1
+            if status == self.DONE:
+                summary['comments'] += comment_count or 0
+        return summary
+
+
+    def markDone(self, jikkyo_channel_id: str, target_date: date, comment_count: int) -> None:
+        """
+        ジョブを完了済みとして記録する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+            comment_count (int): 保存対象のコメント数
+        """
+
+        self.updateStatus(jikkyo_channel_id, target_date, self.DONE, comment_count)
+
+
+    def markFailed(self, jikkyo_channel_id: str, target_date: date) -> None:
+        """
+        ジョブを失敗として記録する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+        """
+
+        self.updateStatus(jikkyo_channel_id, target_date, self.FAILED, None)
+
+
+    def updateStatus(self, jikkyo_channel_id: str, target_date: date, status: str, comment_count: int | None) -> None:
+        """
+        ジョブの状態を更新し、試行回数を1つ増やす
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+            status (str): ジョブの状態
+            comment_count (int | None): 保存対象のコメント数
+        """
+
+        with self.connection:
+            self.connection.execute(
+                'UPDATE backfill_jobs SET status = ?, comment_count = ?, attempts = attempts + 1, updated_at = ? WHERE channel_id = ? AND date = ?',
+                (status, comment_count, time.time(), jikkyo_channel_id, target_date.isoformat()),
+            )
+
+
+    def close(self) -> None:
+        """
+        SQLite データベースへの接続を閉じる
+        """
+
+        self.connection.close()
@@ -0,0 +1,220 @@
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.database import DATABASE_PATH, connectDatabase
+
+
+@dataclass(slots=True)
+class ThreadState:
+    """
+    .nicojk ファイルに保存済みのコメントのうち、スレッド (ニコニコ生放送番組 / NX-Jikkyo スレッド) ごとの最新のコメントの情報
+    """
+
+    # 保存済みの最新のコメントのコメント番号
+    last_no: int
+    # 保存済みの最新のコメントの投稿日時 (UNIX タイムスタンプ、マイクロ秒単位まで)
+    last_date_with_usec: float
+    # 保存済みのコメントの数 (記録されていない場合は None)
+    comment_count: int | None = None
+
+
+@dataclass(slots=True)
+class FileState:
+    """
+    .nicojk ファイルの内容の記録
+    新たに書き込む内容と既存のファイルの内容が同じかどうかを、既存のファイルを読み込まずに判定するために使う
+    """
+
+    # ファイルの内容の SHA-256 ハッシュ (16進数表記)
+    sha256: str
+    # ファイルのサイズ (バイト)
+    size: int
+    # ファイルに保存されているコメントの数
+    comment_count: int
+
+
+class Manifest:
+    """
+    実況チャンネル・日付ごとに、.nicojk ファイルにどこまでコメントを保存したかを記録するマニフェスト
+    差分収集モードで、前回保存したコメントより新しいコメントだけを追記するために使う
+    また、ファイルの内容のハッシュを記録し、内容が変わっていないファイルを書き換えないようにするためにも使う
+    """
+
+    def __init__(self, database_path: Path = DATABASE_PATH) -> None:
+        """
+        Manifest のコンストラクタ
+
+        Args:
+            database_path (Path, default=DATABASE_PATH): マニフェストを保存する SQLite データベースのパス
+        """
+
+        self.connection = connectDatabase(database_path)
+        with self.connection:
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS thread_states (
+                    channel_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    thread TEXT NOT NULL,
+                    last_no INTEGER NOT NULL,
+                    last_date_with_usec REAL NOT NULL,
+                    comment_count INTEGER,
+                    PRIMARY KEY (channel_id, date, thread)
+                )
+            ''')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS file_states (
+                    channel_id TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    comment_count INTEGER NOT NULL,
+                    PRIMARY KEY (channel_id, date)
+                )
+            ''')
+
+            # comment_count 列がない以前のバージョンのテーブルには列を追加する (既存の記録の値は NULL になる)
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(thread_states)')]
+            if 'comment_count' not in columns:
+                self.connection.execute('ALTER TABLE thread_states ADD COLUMN comment_count INTEGER')
+
+
+    def getThreadStates(self, jikkyo_channel_id: str, target_date: date) -> dict[str, ThreadState]:
+        """
+        指定した実況チャンネル・日付の .nicojk ファイルに保存済みのコメントの情報をスレッドごとに取得する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): .nicojk ファイルの日付
+
+        Returns:
+            dict[str, ThreadState]: スレッド ID をキーとした保存済みのコメントの情報 (記録がない場合は空の辞書)
+        """
+
+        rows = self.connection.execute(
+            'SELECT thread, last_no, last_date_with_usec, comment_count FROM thread_states WHERE channel_id = ? AND date = ?',
+            (jikkyo_channel_id, target_date.isoformat()),
+        ).fetchall()
+        return {
+            thread: ThreadState(last_no, last_date_with_usec, comment_count)
+            for thread, last_no, last_date_with_usec, comment_count in rows
+        }
+
+
+    def saveThreadStates(self, jikkyo_channel_id: str, target_date: date, thread_states: dict[str, ThreadState]) -> None:
+        """
+        指定した実況チャンネル・日付の .nicojk ファイルに保存済みのコメントの情報を記録する
+        既存の記録はすべて置き換えられる
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): .nicojk ファイルの日付
+            thread_states (dict[str, ThreadState]): スレッド ID をキーとした保存済みのコメントの情報
+        """
+
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM thread_states WHERE channel_id = ? AND date = ?',
+                (jikkyo_channel_id, target_date.isoformat()),
+            )
+            self.connection.executemany(
+                'INSERT INTO thread_states (channel_id, date, thread, last_no, last_date_with_usec, comment_count) VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (jikkyo_channel_id, target_date.isoformat(), thread, state.last_no, state.last_date_with_usec, state.comment_count)
+                    for thread, state in thread_states.items()
+                ],
+            )
+
+
+    def getFileState(self, jikkyo_channel_id: str, target_date: date) -> FileState | None:
+        """
+        指定した実況チャンネル・日付の .nicojk ファイルの内容の記録を取得する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): .nicojk ファイルの日付
+
+        Returns:
+            FileState | None: ファイルの内容の記録 (記録がない場合は None)
+        """
+
+        row = self.connection.execute(
+            'SELECT sha256, size, comment_count FROM file_states WHERE channel_id = ? AND date = ?',
+            (jikkyo_channel_id, target_date.isoformat()),
+        ).fetchone()
+        return FileState(*row) if row is not None else None
+
+
+    def saveFileState(self, jikkyo_channel_id: str, target_date: date, file_state: FileState) -> None:
+        """
+        指定した実況チャンネル・日付の .nicojk ファイルの内容を記録する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): .nicojk ファイルの日付
+            file_state (FileState): ファイルの内容の記録
+        """
+
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO file_states (channel_id, date, sha256, size, comment_count) VALUES (?, ?, ?, ?, ?)',
+                (jikkyo_channel_id, target_date.isoformat(), file_state.sha256, file_state.size, file_state.comment_count),
+            )
+
+
+    def close(self) -> None:
+        """
+        SQLite データベースへの接続を閉じる
+        """
+
+        self.connection.close()
+
+
+    @staticmethod
+    def trackThreadStates(comments: Iterable[Comment], thread_states: dict[str, ThreadState]) -> Iterator[Comment]:
+        """
+        コメントのイテレーターをそのまま順に返しながら、スレッドごとの最新のコメントの情報を thread_states に反映する
+        コメントをリストに溜めずに、書き込みと同時に最新のコメントの情報を算出するために使う
+
+        Args:
+            comments (Iterable[Comment]): コメントのイテレーター
+            thread_states (dict[str, ThreadState]): 更新するスレッド ID をキーとした最新のコメントの情報
+
+        Yields:
+            Comment: 引数で渡されたコメント
+        """
+
+        for comment in comments:
+            state = thread_states.get(comment.thread)
+            if state is None:
+                thread_states[comment.thread] = ThreadState(comment.no, comment.date_with_usec, 1)
+            else:
+                state.last_no = max(state.last_no, comment.no)
+                state.last_date_with_usec = max(state.last_date_with_usec, comment.date_with_usec)
+                if state.comment_count is not None:
+                    state.comment_count += 1
+            yield comment
+
+
+    @staticmethod
+    def computeThreadStates(comments: Iterable[Comment], thread_states: dict[str, ThreadState] | None = None) -> dict[str, ThreadState]:
+        """
+        コメントのリストから、スレッドごとの最新のコメントの情報を算出する
+
+        Args:
+            comments (Iterable[Comment]): コメントのイテレーター
+            thread_states (dict[str, ThreadState] | None, default=None): 既存の情報 (指定された場合はこれを更新したものを返す)
+
+        Returns:
+            dict[str, ThreadState]: スレッド ID をキーとした最新のコメントの情報
+        """
+
+        thread_states = {
+            thread: ThreadState(state.last_no, state.last_date_with_usec, state.comment_count)
+            for thread, state in (thread_states or {}).items()
+        }
+        for _ in Manifest.trackThreadStates(comments, thread_states):
+            pass
+        return thread_states
@@ -0,0 +1,86 @@
+import bisect
+import heapq
+from datetime import date, datetime, time, timedelta
+from operator import attrgetter
+from typing import Any, Iterable, Iterator, Sequence
+
+
+# コメントの投稿日時 (UNIX タイムスタンプ、マイクロ秒単位まで) を取得する関数
+getDateWithUsec = attrgetter('date_with_usec')
+
+
+def getDateRange(target_date: date) -> tuple[float, float]:
+    """
+    指定した日付の 00:00:00 から翌日 00:00:00 までの範囲を UNIX タイムスタンプで取得する
+    datetime.fromtimestamp(timestamp).date() == target_date と start <= timestamp < end は同値になる
+
+    Args:
+        target_date (date): 日付
+
+    Returns:
+        tuple[float, float]: 範囲の開始 (この値を含む) と終了 (この値を含まない) の UNIX タイムスタンプ
+    """
+
+    start = datetime.combine(target_date, time()).timestamp()
+    end = datetime.combine(target_date + timedelta(days=1), time()).timestamp()
+    return start, end
+
+
+def sliceComments(comments: Sequence[Any], start: float, end: float) -> Iterator[Any]:
+    """
+    投稿日時昇順に並んだコメントのうち、指定した範囲に投稿されたコメントだけを順に返す
+    範囲の開始位置は二分探索で求め、範囲の終了を過ぎたらそれ以降のコメントは見ない
+
+    Args:
+        comments (Sequence[Any]): 投稿日時昇順に並んだコメントのリスト
+        start (float): 範囲の開始 (この値を含む) の UNIX タイムスタンプ
+        end (float): 範囲の終了 (この値を含まない) の UNIX タイムスタンプ
+
+    Yields:
+        Any: 指定した範囲に投稿されたコメント
+    """
+
+    for index in range(bisect.bisect_left(comments, start, key=getDateWithUsec), len(comments)):
+        comment = comments[index]
+        if comment.date_with_usec >= end:
+            break
+        yield comment
+
+
+def mergeComments(sources: list[list[Any]], start: float, end: float) -> Iterator[Any]:
+    """
+    取得元 (ニコニコ生放送番組 / NX-Jikkyo スレッド) ごとのコメントのリストを、投稿日時昇順に K-way マージしながら順に返す
+    各リストはあらかじめ投稿日時昇順に並んでいる必要がある
+    すべてのコメントを1つのリストに連結してからソートするのに比べ、連結したリストのコピーが不要で計算量も O(n log k) で済む
+
+    Args:
+        sources (list[list[Any]]): 投稿日時昇順に並んだ、取得元ごとのコメントのリスト
+        start (float): 範囲の開始 (この値を含む) の UNIX タイムスタンプ
+        end (float): 範囲の終了 (この値を含まない) の UNIX タイムスタンプ
+
+    Yields:
+        Any: 指定した範囲に投稿されたコメント (投稿日時昇順)
+    """
+
+    return heapq.merge(*[sliceComments(source, start, end) for source in sources], key=getDateWithUsec)
+
+
+def uniqueComments(comments: Iterable[Any]) -> Iterator[Any]:
+    """
+    コメントのイテレーターから、スレッド ID とコメント番号が重複するコメントを除いて順に返す
+    重複している場合は最初に現れたコメントを残す
+    ダウンロードしたコメントと既存の .nicojk ファイルのコメントの和集合を取るために使う
+
+    Args:
+        comments (Iterable[Any]): コメントのイテレーター
+
+    Yields:
+        Any: 重複を除いたコメント
+    """
+
+    seen: set[tuple[str, int]] = set()
+    for comment in comments:
+        key = (comment.thread, comment.no)
+        if key not in seen:
+            seen.add(key)
+            yield comment
@@ -0,0 +1,206 @@
+import httpx
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+
+class CrawlMetrics:
+    """
+    クロールの実行ごとに、実況チャンネル・処理段階ごとの所要時間やダウンロード量などを記録する計測器
+    記録したイベントは JSON Lines 形式のログファイルに追記でき、Prometheus (node_exporter の textfile collector) 向けのテキストファイルにも書き出せる
+    コンソールへの動作ログとは別に、実行ごとの履歴を機械的に集計できるようにするために使う
+
+    Usage:
+        metrics = CrawlMetrics(jsonl_path=Path('log/metrics.jsonl'))
+        with metrics.measure('download', jikkyo_channel_id='jk1', source='nx', source_id=1) as fields:
+            comments = await nx_client.downloadComments()
+            fields['comments'] = len(comments)
+        metrics.flush()
+    """
+
+    # Prometheus のメトリクス名の接頭辞
+    METRIC_PREFIX = 'jkcommentcrawler'
+
+
+    def __init__(self, jsonl_path: Path | None = None, prometheus_path: Path | None = None) -> None:
+        """
+        CrawlMetrics のコンストラクタ
+
+        Args:
+            jsonl_path (Path | None, default=None): イベントを JSON Lines 形式で追記するファイルのパス (None の場合は書き出さない)
+            prometheus_path (Path | None, default=None): Prometheus の textfile collector 向けのファイルのパス (None の場合は書き出さない)
+        """
+
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+
+        # 実行ごとに一意な ID (同じ JSON Lines ファイルに追記された複数の実行を区別するために使う)
+        self.run_id = uuid.uuid4().hex
+        self.started_at = time.time()
+        self.started_perf_counter = time.perf_counter()
+
+        # 記録したイベントのリスト
+        self.events: list[dict[str, Any]] = []
+
+        # flush() 済みのイベントの数
+        self.flushed_count = 0
+
+
+    def record(self, event: str, **fields: Any) -> dict[str, Any]:
+        """
+        イベントを1件記録する
+
+        Args:
+            event (str): イベントの種類 (ex: channel, stage, download)
+            **fields (Any): イベントに付随する値 (JSON に変換できる値である必要がある)
+
+        Returns:
+            dict[str, Any]: 記録したイベント
+        """
+
+        record = {'run_id': self.run_id, 'timestamp': time.time(), 'event': event, **fields}
+        self.events.append(record)
+        return record
+
+
+    def merge(self, events: list[dict[str, Any]], **fields: Any) -> None:
+        """
+        ほかのプロセス (ワーカープロセス) で記録したイベントを、この実行のイベントとして取り込む
+
+        Args:
+            events (list[dict[str, Any]]): 取り込むイベントのリスト
+            **fields (Any): 取り込むイベントに追加する値 (ex: worker=0)
+        """
+
+        for record in events:
+            self.events.append({**record, 'run_id': self.run_id, **fields})
+
+
+    @contextmanager
+    def measure(self, event: str, **fields: Any) -> Iterator[dict[str, Any]]:
+        """
+        with ブロックの所要時間を計測し、ブロックを抜けたときにイベントとして記録する
+        ブロック内で yield された辞書に値を追加すると、イベントにその値も記録される
+        例外が発生した場合は status に error を、HTTP エラーであれば http_status にステータスコードを記録した上で例外を再送出する
+
+        Args:
+            event (str): イベントの種類
+            **fields (Any): イベントに付随する値
+
+        Yields:
+            dict[str, Any]: イベントに追加で記録する値を入れる辞書
+        """
+
+        extra_fields: dict[str, Any] = {}
+        start = time.perf_counter()
+        try:
+            yield extra_fields
+        except BaseException as ex:
+            extra_fields['status'] = 'error'
+            extra_fields['error'] = type(ex).__name__
+            if isinstance(ex, httpx.HTTPStatusError):
+                extra_fields['http_status'] = ex.response.status_code
+            raise
+        else:
+            extra_fields.setdefault('status', 'ok')
+        finally:
+            self.record(event, **fields, **extra_fields, duration=time.perf_counter() - start)
+
+
+    def flush(self) -> None:
+        """
+        記録したイベントを書き出す
+        JSON Lines ファイルには前回の flush() 以降に記録したイベントを追記し、Prometheus 向けのファイルはこれまでの集計値でアトミックに置き換える
+        """
+
+        if self.jsonl_path is not None and self.flushed_count < len(self.events):
+            self.jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.jsonl_path.open('a', encoding='utf-8') as f:
+                for record in self.events[self.flushed_count:]:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.flushed_count = len(self.events)
+
+        if self.prometheus_path is not None:
+            self.prometheus_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # textfile collector が書き込み途中のファイルを読まないよう、同じフォルダの一時ファイルに書き込んでから置き換える
+            fd, temp_path = tempfile.mkstemp(dir=self.prometheus_path.parent, prefix=f'.{self.prometheus_path.name}.', suffix='.tmp')
+            try:
+                with open(fd, 'w', encoding='utf-8', newline='\n') as f:
+                    f.write(self.formatPrometheus())
+                os.chmod(temp_path, 0o644)
+                os.replace(temp_path, self.prometheus_path)
+            except BaseException:
+                Path(temp_path).unlink(missing_ok=True)
+                raise
+
+
+    def formatPrometheus(self) -> str:
+        """
+        記録したイベントを集計し、Prometheus のテキスト形式に変換する
+        cron から毎回別プロセスで実行される前提で、すべて直近の実行の値を表す gauge として出力する
+
+        Returns:
+            str: Prometheus のテキスト形式の文字列
+        """
+
+        # (メトリクス名, ラベルのタプル) をキーとした値
+        values: dict[tuple[str, tuple[tuple[str, str], ...]], float] = defaultdict(float)
+        for record in self.events:
+            jikkyo_channel_id = str(record.get('jikkyo_channel_id', ''))
+            if record['event'] == 'channel':
+                labels = (('channel', jikkyo_channel_id),)
+                values[('channel_duration_seconds', labels)] = record['duration']
+                values[('channel_success', labels)] = 1 if record['status'] == 'ok' else 0
+                values[('channel_retries', labels)] = record.get('retries', 0)
+                values[('channel_comments', labels)] = record.get('comments', 0)
+            elif record['event'] == 'stage':
+                labels = (('channel', jikkyo_channel_id), ('stage', str(record['stage'])))
+                values[('stage_duration_seconds', labels)] += record['duration']
+            elif record['event'] == 'download':
+                labels = (('channel', jikkyo_channel_id), ('source', str(record['source'])))
+                values[('download_duration_seconds', labels)] += record['duration']
+                values[('downloaded_bytes', labels)] += record.get('bytes', 0)
+                values[('downloaded_comments', labels)] += record.get('comments', 0)
+                status_labels = labels + (('status', str(record.get('http_status', record['status']))),)
+                values[('download_requests', status_labels)] += 1
+                values[('download_retries', labels)] += record.get('retries', 0)
+            elif record['event'] == 'retry':
+                labels = (('channel', jikkyo_channel_id), ('host', str(record['host'])))
+                values[('request_retries', labels)] += 1
+                values[('request_retry_wait_seconds', labels)] += record['delay']
+
+        values[('run_duration_seconds', ())] = time.perf_counter() - self.started_perf_counter
+        values[('run_start_timestamp_seconds', ())] = self.started_at
+
+        # 同じメトリクス名の値は並べ替えで連続するため、メトリクス名が変わったところで TYPE 行を出力する
+        lines: list[str] = []
+        last_name = None
+        for (name, labels), value in sorted(values.items()):
+            label_text = ','.join(f'{key}="{self.escapeLabelValue(label)}"' for key, label in labels)
+            if name != last_name:
+                lines.append(f'# TYPE {self.METRIC_PREFIX}_{name} gauge')
+                last_name = name
+            lines.append(f'{self.METRIC_PREFIX}_{name}{{{label_text}}} {value}' if label_text else f'{self.METRIC_PREFIX}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+    @staticmethod
+    def escapeLabelValue(value: str) -> str:
+        """
+        Prometheus のラベルの値をエスケープする
+
+        Args:
+            value (str): エスケープする値
+
+        Returns:
+            str: エスケープした値
+        """
+
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
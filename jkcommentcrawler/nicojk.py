@@ -0,0 +1,342 @@
+import hashlib
+import itertools
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+from dataclasses import fields
+from pathlib import Path
+from types import TracebackType
+from typing import Iterable, Iterator, Self, cast
+
+from jkcommentcrawler.comment import Comment
+
+
+# <chat> 要素に属性として出力するフィールド名 (Comment のフィールド定義順)
+## content は属性ではなく要素のテキストとして出力する
+## date_with_usec は date と date_usec から算出される値のため出力しない
+CHAT_ATTRIBUTES: tuple[str, ...] = tuple(field.name for field in fields(Comment) if field.name not in ('content', 'date_with_usec'))
+
+
+def escapeAttribute(value: str) -> str:
+    """
+    XML の属性値として出力できるよう文字列をエスケープする
+    xml.etree.ElementTree と同じエスケープ規則に従う
+
+    Args:
+        value (str): エスケープする文字列
+
+    Returns:
+        str: エスケープされた文字列
+    """
+
+    if '&' in value:
+        value = value.replace('&', '&amp;')
+    if '<' in value:
+        value = value.replace('<', '&lt;')
+    if '>' in value:
+        value = value.replace('>', '&gt;')
+    if '"' in value:
+        value = value.replace('"', '&quot;')
+    if '\r' in value:
+        value = value.replace('\r', '&#13;')
+    if '\n' in value:
+        value = value.replace('\n', '&#10;')
+    if '\t' in value:
+        value = value.replace('\t', '&#09;')
+    return value
+
+
+def escapeText(value: str) -> str:
+    """
+    XML の要素のテキストとして出力できるよう文字列をエスケープする
+    xml.etree.ElementTree と同じエスケープ規則に従う
+
+    Args:
+        value (str): エスケープする文字列
+
+    Returns:
+        str: エスケープされた文字列
+    """
+
+    if '&' in value:
+        value = value.replace('&', '&amp;')
+    if '<' in value:
+        value = value.replace('<', '&lt;')
+    if '>' in value:
+        value = value.replace('>', '&gt;')
+    return value
+
+
+def formatChat(comment: Comment) -> str:
+    """
+    コメントを .nicojk ファイルの1行 (<chat> 要素) に変換する
+    .nicojk ファイルはヘッダーなしの XML ファイルで、1行に1つの <chat> 要素が並ぶ
+
+    Args:
+        comment (Comment): 変換するコメント
+
+    Returns:
+        str: 改行付きの <chat> 要素の文字列
+    """
+
+    attributes = ''
+    for name in CHAT_ATTRIBUTES:
+        value = getattr(comment, name)
+        if value is not None:
+            attributes += f' {name}="{escapeAttribute(str(value))}"'
+    if comment.content:
+        return f'<chat{attributes}>{escapeText(comment.content)}</chat>\n'
+    return f'<chat{attributes} />\n'
+
+
+def parseChat(element: ET.Element) -> Comment:
+    """
+    .nicojk ファイルの <chat> 要素を Comment に変換する
+    formatChat() の逆変換で、省略された属性は既定値 (数値は 0、文字列は空文字列、premium / anonymity は None) として扱う
+
+    Args:
+        element (ET.Element): <chat> 要素
+
+    Returns:
+        Comment: 変換したコメント
+    """
+
+    attributes = element.attrib
+    premium = attributes.get('premium')
+    anonymity = attributes.get('anonymity')
+    return Comment.create(
+        thread = attributes.get('thread', ''),
+        no = int(attributes.get('no', 0)),
+        vpos = int(attributes.get('vpos', 0)),
+        date = int(attributes.get('date', 0)),
+        date_usec = int(attributes.get('date_usec', 0)),
+        user_id = attributes.get('user_id', ''),
+        mail = attributes.get('mail', ''),
+        premium = int(premium) if premium is not None else None,
+        anonymity = int(anonymity) if anonymity is not None else None,
+        content = element.text or '',
+    )
+
+
+def iterComments(path: Path, chunk_size: int = 1024 * 1024) -> Iterator[Comment]:
+    """
+    .nicojk ファイルのコメントを先頭から1件ずつ読み込む
+    ファイル全体をメモリに読み込まずに、チャンクごとに XMLPullParser で逐次解析する
+    コメント本文に改行が含まれていて <chat> 要素が複数行にまたがっている場合も正しく解析できる
+
+    Args:
+        path (Path): 読み込む .nicojk ファイルのパス
+        chunk_size (int, default=1024 * 1024): 一度に読み込むサイズ (バイト)
+
+    Yields:
+        Comment: .nicojk ファイルに保存されているコメント (ファイル内の順序)
+
+    Raises:
+        xml.etree.ElementTree.ParseError: XML として不正なデータが含まれている場合
+    """
+
+    with open(path, 'rb') as f:
+        yield from parseChunks(iter(lambda: f.read(chunk_size), b''))
+
+
+def parseChunks(chunks: Iterable[bytes]) -> Iterator[Comment]:
+    """
+    .nicojk 形式 (ルート要素のない <chat> 要素の並び) のデータをチャンクごとに逐次解析し、コメントを1件ずつ返す
+
+    Args:
+        chunks (Iterable[bytes]): .nicojk 形式のデータのチャンクのイテレーター
+
+    Yields:
+        Comment: 解析したコメント (データ内の順序)
+
+    Raises:
+        xml.etree.ElementTree.ParseError: XML として不正なデータが含まれている場合
+    """
+
+    # .nicojk 形式のデータはルート要素を持たないため、仮のルート要素で囲んで解析する
+    ## 解析済みの <chat> 要素はチャンクごとにルート要素から取り除き、要素がメモリに溜まらないようにする
+    ## start / end イベントだけを受け取るため、read_events() が返すのは常に (イベント名, 要素) のタプルになる
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parser.feed(b'<packet>')
+    root = next(element for _, element in cast(Iterator[tuple[str, ET.Element]], parser.read_events()))
+    for chunk in itertools.chain(chunks, [b'</packet>']):
+        parser.feed(chunk)
+        for event, element in cast(Iterator[tuple[str, ET.Element]], parser.read_events()):
+            if event == 'end' and element.tag == 'chat':
+                yield parseChat(element)
+        root.clear()
+    parser.close()
+
+
+def hashFile(path: Path) -> str:
+    """
+    ファイルの内容の SHA-256 ハッシュを算出する
+    NicojkWriter.sha256 と同じ形式で返す
+
+    Args:
+        path (Path): ハッシュを算出するファイルのパス
+
+    Returns:
+        str: ファイルの内容の SHA-256 ハッシュ (16進数表記)
+    """
+
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def isAppendable(path: Path) -> bool:
+    """
+    既存の .nicojk ファイルの末尾に <chat> 要素を追記できるかどうかを判定する
+    ルート要素で囲まれている場合や、<chat> 要素で終わっていない (書き込み途中で中断された可能性がある) 場合は追記できない
+
+    Args:
+        path (Path): 判定する .nicojk ファイルのパス
+
+    Returns:
+        bool: 追記できる場合は True
+    """
+
+    if path.exists() is False or path.stat().st_size == 0:
+        return False
+    with open(path, 'rb') as f:
+        f.seek(max(0, path.stat().st_size - 16))
+        tail = f.read()
+    tail = tail.rstrip(b'\n')
+    return tail.endswith(b'</chat>') or tail.endswith(b' />')
+
+
+def appendComments(path: Path, comments: list[Comment]) -> None:
+    """
+    既存の .nicojk ファイルの末尾にコメントを追記する
+    事前に isAppendable() で追記できることを確認しておく必要がある
+
+    Args:
+        path (Path): 追記する .nicojk ファイルのパス
+        comments (list[Comment]): 追記するコメントのリスト (投稿日時昇順)
+    """
+
+    # 既存ファイルが改行で終わっていない場合は、先に改行を入れてから追記する
+    with open(path, 'rb') as f:
+        f.seek(-1, 2)
+        needs_newline = f.read(1) != b'\n'
+    with open(path, 'a', encoding='utf-8') as f:
+        if needs_newline is True:
+            f.write('\n')
+        f.writelines(formatChat(comment) for comment in comments)
+
+
+class NicojkWriter:
+    """
+    コメントを .nicojk ファイルにストリーミングで書き込むライター
+    コメントは1件ずつ同じフォルダ内の一時ファイルに書き込まれ、commit() を呼び出した時点でアトミックに置き換えられる
+    書き込み途中でプロセスが終了しても、既存の .nicojk ファイルが壊れることはない
+
+    書き込んだ内容の SHA-256 ハッシュを書き込みながら算出するため、既存のファイルと内容が同じかどうかをファイルを読み込まずに判定できる
+
+    Usage:
+        with NicojkWriter(path) as writer:
+            for comment in comments:
+                writer.write(comment)
+            writer.commit()
+    """
+
+    # 一時ファイルへの書き込みバッファのサイズ (バイト)
+    BUFFER_SIZE = 1024 * 1024
+
+
+    def __init__(self, path: Path) -> None:
+        """
+        NicojkWriter のコンストラクタ
+
+        Args:
+            path (Path): 最終的に書き込む .nicojk ファイルのパス
+        """
+
+        self.path = path
+        self.count = 0
+        self.size = 0
+        self.committed = False
+
+        # 書き込んだ内容の SHA-256 ハッシュ
+        self.hash = hashlib.sha256()
+
+        # 同じフォルダ内に一時ファイルを作成する (os.replace() でアトミックに置き換えるため、同じファイルシステム上である必要がある)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+        self.temp_path = Path(temp_path)
+        self.file = open(fd, 'wb', buffering=self.BUFFER_SIZE)
+
+
+    def __enter__(self) -> Self:
+        return self
+
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_value: BaseException | None, traceback: TracebackType | None) -> None:
+        # commit() されなかった場合は一時ファイルを破棄する
+        if self.committed is False:
+            self.discard()
+
+
+    @property
+    def sha256(self) -> str:
+        """
+        これまでに書き込んだ内容の SHA-256 ハッシュ (16進数表記)
+        """
+
+        return self.hash.hexdigest()
+
+
+    def write(self, comment: Comment) -> bytes:
+        """
+        コメントを1件書き込む
+
+        Args:
+            comment (Comment): 書き込むコメント
+
+        Returns:
+            bytes: 書き込んだ <chat> 要素 (圧縮アーカイブにも同じ内容を書き込む場合に使う)
+        """
+
+        line = formatChat(comment).encode('utf-8')
+        self.writeRaw(line)
+        self.count += 1
+        return line
+
+
+    def writeRaw(self, data: bytes) -> None:
+        """
+        formatChat() で変換済みの <chat> 要素をそのまま書き込む
+        書き込んだサイズとハッシュは更新されるが、コメント数 (count) は更新されない
+
+        Args:
+            data (bytes): UTF-8 でエンコードされた <chat> 要素
+        """
+
+        self.hash.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
+
+    def commit(self) -> None:
+        """
+        一時ファイルをディスクに書き出し、.nicojk ファイルをアトミックに置き換える
+        """
+
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        # mkstemp() で作成したファイルのパーミッションは 0600 になるため、既存のファイルに合わせる (ない場合は 0644)
+        mode = self.path.stat().st_mode & 0o777 if self.path.exists() else 0o644
+        os.chmod(self.temp_path, mode)
+        os.replace(self.temp_path, self.path)
+        self.committed = True
+
+
+    def discard(self) -> None:
+        """
+        書き込んだ内容を破棄し、一時ファイルを削除する
+        """
+
+        self.file.close()
+        self.temp_path.unlink(missing_ok=True)
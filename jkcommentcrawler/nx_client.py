@@ -7,9 +7,62 @@ from pydantic import BaseModel, TypeAdapter
 from rich import print
 from rich.rule import Rule
 from rich.style import Style
-from typing import Any, Literal
+from typing import Any, ClassVar, Literal
 
 from jkcommentcrawler import __version__
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.session import createHTTPClient
+
+
+class ThreadInfo(BaseModel):
+    """
+    NX-Jikkyo のスレッド情報取得 API (/api/v1/channels/{channel_id}/threads) が返すスレッドの情報
+    """
+
+    id: int
+    start_at: datetime
+    end_at: datetime
+    title: str
+    description: str
+    status: str
+
+
+class CommentResponse(BaseModel):
+    """
+    NX-Jikkyo のスレッド取得 API (/api/v1/threads/{thread_id}) が返すコメントの情報
+    """
+
+    id: int
+    thread_id: int
+    no: int
+    vpos: int
+    date: datetime
+    mail: str
+    user_id: str
+    premium: bool
+    anonymity: bool
+    content: str
+
+
+class ThreadResponse(BaseModel):
+    """
+    NX-Jikkyo のスレッド取得 API (/api/v1/threads/{thread_id}) が返すスレッドの情報
+    """
+
+    id: int
+    channel_id: str
+    start_at: datetime
+    end_at: datetime
+    duration: int
+    title: str
+    description: str
+    status: Literal['ACTIVE', 'UPCOMING', 'PAST']
+    comments: list[CommentResponse]
+
+
+# pydantic の TypeAdapter はスキーマの構築にコストがかかるため、モジュールの読み込み時に一度だけ作成しておく
+THREAD_INFO_LIST_ADAPTER = TypeAdapter(list[ThreadInfo])
+THREAD_RESPONSE_ADAPTER = TypeAdapter(ThreadResponse)
 
 
 class NXClient:
@@ -24,6 +77,9 @@ class NXClient:
     # NX-Jikkyo 通信時の User-Agent
     USER_AGENT = f'JKCommentCrawler/{__version__}'
 
+    # NX-Jikkyo API のホスト名
+    API_HOST = 'nx-jikkyo.tsukumijima.net'
+
     # NX-Jikkyo で運用されているニコニコ実況チャンネル ID のリスト (2024/08/15 時点)
     JIKKYO_CHANNEL_ID_LIST: list[str] = [
         'jk1',
@@ -59,6 +115,10 @@ class NXClient:
         'jk333',
     ]
 
+    # すべての NXClient で共有する httpx の非同期 HTTP クライアント
+    ## NX-Jikkyo への接続を Keep-Alive で使い回すため、getHTTPClient() で初回アクセス時に作成する
+    _shared_httpx_client: ClassVar[httpx.AsyncClient | None] = None
+
 
     def __init__(self, thread_id: int, verbose: bool = False, console_output: bool = False, log_path: Path | None = None) -> None:
         """
@@ -76,21 +136,66 @@ class NXClient:
         self.show_log = console_output
         self.log_path = log_path
 
-        # httpx の非同期 HTTP クライアントのインスタンスを作成
-        self.httpx_client = httpx.AsyncClient(headers={'User-Agent': self.USER_AGENT}, follow_redirects=True)
+        # すべての NXClient で共有している httpx の非同期 HTTP クライアントを取得
+        self.httpx_client = self.getHTTPClient()
+
+        # 直近の downloadComments() で受信したレスポンスボディのサイズ (バイト) と HTTP ステータスコード
+        ## 計測用に CommentCrawler から参照される
+        self.downloaded_bytes = 0
+        self.status_code: int | None = None
 
 
     @classmethod
-    async def getThreadIDsOnDate(cls, jikkyo_channel_id: str, date: date) -> list[int]:
+    def getHTTPClient(cls) -> httpx.AsyncClient:
+        """
+        すべての NXClient で共有している httpx の非同期 HTTP クライアントを取得する
+        まだ作成されていない (または閉じられている) 場合は新たに作成する
+
+        Returns:
+            httpx.AsyncClient: 共有の httpx.AsyncClient
         """
-        指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID を取得する
+
+        if cls._shared_httpx_client is None or cls._shared_httpx_client.is_closed:
+            cls._shared_httpx_client = createHTTPClient(headers={'User-Agent': cls.USER_AGENT})
+        return cls._shared_httpx_client
+
+
+    @classmethod
+    def setHTTPClient(cls, client: httpx.AsyncClient) -> None:
+        """
+        すべての NXClient で共有する httpx の非同期 HTTP クライアントを差し替える
+        記録済みのレスポンスを返すクライアントに差し替えてベンチマークを実行する場合などに使う
+        差し替える前のクライアントは閉じないため、必要なら先に closeHTTPClient() を呼び出しておく
+
+        Args:
+            client (httpx.AsyncClient): 共有する httpx.AsyncClient (closeHTTPClient() で閉じられる)
+        """
+
+        cls._shared_httpx_client = client
+
+
+    @classmethod
+    async def closeHTTPClient(cls) -> None:
+        """
+        すべての NXClient で共有している httpx の非同期 HTTP クライアントを閉じる
+        プロセス終了前に呼び出す
+        """
+
+        if cls._shared_httpx_client is not None:
+            await cls._shared_httpx_client.aclose()
+            cls._shared_httpx_client = None
+
+
+    @classmethod
+    async def getThreads(cls, jikkyo_channel_id: str) -> list[ThreadInfo]:
+        """
+        指定した実況チャンネルの NX-Jikkyo スレッドの情報を、過去のものも含めてすべて取得する
 
         Args:
             jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
-            date (date): NX-Jikkyo のスレッド (通常毎日 04:00 ~ 翌日 04:00) を取得する日付
 
         Returns:
-            list[int]: 指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID のリスト (放送開始日時昇順)
+            list[ThreadInfo]: NX-Jikkyo スレッドの情報のリスト
 
         Raises:
             ValueError: ニコニコ実況互換のチャンネル ID が指定されていない場合
@@ -100,23 +205,33 @@ class NXClient:
         if jikkyo_channel_id.startswith('jk') is False:
             raise ValueError(f'Invalid jikkyo_channel_id: {jikkyo_channel_id}')
 
-        class ThreadInfo(BaseModel):
-            id: int
-            start_at: datetime
-            end_at: datetime
-            title: str
-            description: str
-            status: str
+        # スレッド情報取得 API にリクエスト
+        ## 実況チャンネル ID に紐づく過去全スレッドの情報を取得できる
+        ## 割と重いのでタイムアウトを 30 秒まで余裕を持って設定している
+        response = await cls.getHTTPClient().get(f'https://{cls.API_HOST}/api/v1/channels/{jikkyo_channel_id}/threads', timeout=30)
+        response.raise_for_status()
+        return THREAD_INFO_LIST_ADAPTER.validate_json(response.content)
+
+
+    @classmethod
+    async def getThreadIDsOnDate(cls, jikkyo_channel_id: str, date: date) -> list[int]:
+        """
+        指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID を取得する
+        毎回過去全スレッドの情報を取得するため、繰り返し呼び出す場合は ThreadIndex の利用を推奨する
 
-        # クラスメソッドから self.httpx_client にはアクセスできないため、新しい httpx.AsyncClient を作成している
-        async with httpx.AsyncClient(headers={'User-Agent': cls.USER_AGENT}, follow_redirects=True) as client:
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            date (date): NX-Jikkyo のスレッド (通常毎日 04:00 ~ 翌日 04:00) を取得する日付
 
-            # スレッド情報取得 API にリクエスト
-            ## 実況チャンネル ID に紐づく過去全スレッドの情報を取得できる
-            ## 割と重いのでタイムアウトを 30 秒まで余裕を持って設定している
-            response = await client.get(f'https://nx-jikkyo.tsukumijima.net/api/v1/channels/{jikkyo_channel_id}/threads', timeout=30)
-            response.raise_for_status()
-            threads = TypeAdapter(list[ThreadInfo]).validate_json(response.content)
+        Returns:
+            list[int]: 指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID のリスト (放送開始日時昇順)
+
+        Raises:
+            ValueError: ニコニコ実況互換のチャンネル ID が指定されていない場合
+            httpx.HTTPStatusError: NX-Jikkyo API へのリクエストに失敗した場合
+        """
+
+        threads = await cls.getThreads(jikkyo_channel_id)
 
         # 指定された日付に放送されているスレッドをフィルタリングし、その ID をリストで返す
         threads = [
@@ -129,87 +244,105 @@ class NXClient:
         return [thread.id for thread in threads]
 
 
-    async def downloadBackwardComments(self, ignore_nicolive_comments: bool = True) -> list[XMLCompatibleComment]:
+    async def downloadComments(self, ignore_nicolive_comments: bool = True) -> list[Comment]:
         """
-        NX-Jikkyo メッセージサーバーから過去に投稿されたコメントを遡ってダウンロードする
+        NX-Jikkyo メッセージサーバーから過去に投稿されたコメントを遡ってダウンロードし、軽量な Comment のリストとして返す
+        クローラー内部ではこちらを使い、XMLCompatibleComment が必要な場合は downloadBackwardComments() を使う
 
         Args:
             ignore_nicolive_comments (bool, default=True): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
 
         Returns:
-            list[XMLCompatibleComment]: 過去に投稿されたコメントのリスト (投稿日時昇順)
+            list[Comment]: 過去に投稿されたコメントのリスト (投稿日時昇順)
 
         Raises:
             httpx.HTTPStatusError: HTTP リクエストが失敗した場合
-            AssertionError: 解析に失敗した場合
+            ValueError: 解析に失敗した場合
         """
 
-        class CommentResponse(BaseModel):
-            id: int
-            thread_id: int
-            no: int
-            vpos: int
-            date: datetime
-            mail: str
-            user_id: str
-            premium: bool
-            anonymity: bool
-            content: str
-
-        class ThreadResponse(BaseModel):
-            id: int
-            channel_id: str
-            start_at: datetime
-            end_at: datetime
-            duration: int
-            title: str
-            description: str
-            status: Literal['ACTIVE', 'UPCOMING', 'PAST']
-            comments: list[CommentResponse]
-
         # スレッド取得 API にリクエスト
         ## 割と重いのでタイムアウトを 30 秒まで余裕を持って設定している
-        response = await self.httpx_client.get(f'https://nx-jikkyo.tsukumijima.net/api/v1/threads/{self.thread_id}', timeout=30)
+        response = await self.httpx_client.get(f'https://{self.API_HOST}/api/v1/threads/{self.thread_id}', timeout=30)
+        self.status_code = response.status_code
+        self.downloaded_bytes = len(response.content)
         response.raise_for_status()
-        thread: ThreadResponse = TypeAdapter(ThreadResponse).validate_json(response.content)
+        thread = THREAD_RESPONSE_ADAPTER.validate_json(response.content)
         self.print(f'Title:  {thread.title} [{thread.status}] ({thread.id})')
         self.print(f'Period: {thread.start_at.strftime("%Y-%m-%d %H:%M:%S")} ~ {thread.end_at.strftime("%Y-%m-%d %H:%M:%S")} '
                    f'({thread.end_at - thread.start_at}h)')
         self.print(Rule(characters='-', style=Style(color='#E33157')), verbose_log=True)
 
+        # NX-Jikkyo から取得したコメントデータを Comment に変換する
+        comments: list[Comment] = []
+        for comment in thread.comments:
+            self.convertComment(comment, comments, ignore_nicolive_comments)
+
         # 基本投稿日時昇順でソートされているはずだが、念のためここでもソートする
-        ## この後の処理で date は秒単位とミリ秒単位に分割するため、ここでソートしておかないと色々面倒
-        thread.comments.sort(key=lambda x: x.date)
+        comments.sort(key=lambda x: x.date_with_usec)
 
-        # NX-Jikkyo から取得したコメントデータをニコニコ XML 互換コメント形式に変換する
-        xml_compatible_comments: list[XMLCompatibleComment] = []
-        for comment in thread.comments:
-            xml_comment = XMLCompatibleComment(
-                # スレッド ID は NX-Jikkyo のスレッド ID を文字列化したものをそのまま入れる
-                thread = str(comment.thread_id),
-                no = comment.no,
-                vpos = comment.vpos,
-                date = int(comment.date.timestamp()),
-                date_usec = int((comment.date.timestamp() % 1) * 1000000),
-                mail = comment.mail,
-                user_id = comment.user_id,
-                premium = 1 if comment.premium is True else None,
-                anonymity = 1 if comment.anonymity is True else None,
-                content = comment.content,
-            )
-            # ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外する
-            if ignore_nicolive_comments is True and comment.user_id.startswith('nicolive:') is True:
-                xml_comment.user_id = xml_comment.user_id.replace('nicolive:', '')
-                self.print(str(xml_comment), verbose_log=True)
-                self.print(f'[yellow]Skipped a comment from nicolive.[/yellow]', verbose_log=True)
-            else:
-                self.print(str(xml_comment), verbose_log=True)
-                xml_compatible_comments.append(xml_comment)
+        self.print(f'Retrieved a total of {len(comments)} comments.')
+        self.print(Rule(characters='-', style=Style(color='#E33157')))
+        return comments
+
+
+    def convertComment(self, comment_response: CommentResponse, comments: list[Comment], ignore_nicolive_comments: bool) -> None:
+        """
+        スレッド取得 API が返したコメントを Comment に変換し、リストに追加する
+
+        Args:
+            comment_response (CommentResponse): スレッド取得 API が返したコメント
+            comments (list[Comment]): 変換した Comment を追加するリスト
+            ignore_nicolive_comments (bool): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
+        """
+
+        # ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外する
+        user_id = comment_response.user_id
+        is_nicolive_comment = ignore_nicolive_comments is True and user_id.startswith('nicolive:') is True
+        if is_nicolive_comment is True and self.verbose is False:
+            return
+
+        timestamp = comment_response.date.timestamp()
+        comment = Comment.create(
+            # スレッド ID は NX-Jikkyo のスレッド ID を文字列化したものをそのまま入れる
+            thread = str(comment_response.thread_id),
+            no = comment_response.no,
+            vpos = comment_response.vpos,
+            date = int(timestamp),
+            date_usec = int((timestamp % 1) * 1000000),
+            user_id = user_id.replace('nicolive:', '') if is_nicolive_comment is True else user_id,
+            mail = comment_response.mail,
+            premium = 1 if comment_response.premium is True else None,
+            anonymity = 1 if comment_response.anonymity is True else None,
+            content = comment_response.content,
+        )
+
+        # 詳細な動作ログの出力が有効な場合のみ、コメントごとのログを出力する
+        ## 無効な場合に文字列化や Rule の生成を行うとコメント数に比例して無駄な処理が増えるため、ここで分岐している
+        if self.verbose is True:
+            self.print(str(comment), verbose_log=True)
+            if is_nicolive_comment is True:
+                self.print('[yellow]Skipped a comment from nicolive.[/yellow]', verbose_log=True)
             self.print(Rule(characters='-', style=Style(color='#E33157')), verbose_log=True)
+        if is_nicolive_comment is False:
+            comments.append(comment)
 
-        self.print(f'Retrieved a total of {len(xml_compatible_comments)} comments.')
-        self.print(Rule(characters='-', style=Style(color='#E33157')))
-        return xml_compatible_comments
+
+    async def downloadBackwardComments(self, ignore_nicolive_comments: bool = True) -> list[XMLCompatibleComment]:
+        """
+        NX-Jikkyo メッセージサーバーから過去に投稿されたコメントを遡ってダウンロードする
+
+        Args:
+            ignore_nicolive_comments (bool, default=True): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
+
+        Returns:
+            list[XMLCompatibleComment]: 過去に投稿されたコメントのリスト (投稿日時昇順)
+
+        Raises:
+            httpx.HTTPStatusError: HTTP リクエストが失敗した場合
+            AssertionError: 解析に失敗した場合
+        """
+
+        return [comment.toXMLCompatibleComment() for comment in await self.downloadComments(ignore_nicolive_comments)]
 
 
     def print(self, *args: Any, verbose_log: bool = False, **kwargs: Any) -> None:
@@ -0,0 +1,271 @@
+import asyncio
+import httpx
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, TypeVar
+
+
+T = TypeVar('T')
+
+# リトライすれば成功する可能性がある HTTP ステータスコード
+RETRYABLE_STATUS_CODES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+# サーバーが過負荷でリクエストを制限していることを示す HTTP ステータスコード
+## これらを受け取ったときは、そのホストへの送信レートを下げる
+THROTTLE_STATUS_CODES = frozenset({429, 503})
+
+
+def getStatusCode(error: BaseException) -> int | None:
+    """
+    例外から HTTP ステータスコードを取得する
+
+    Args:
+        error (BaseException): 例外
+
+    Returns:
+        int | None: HTTP ステータスコード (HTTP のエラーレスポンスによる例外でない場合は None)
+    """
+
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def getRetryAfter(error: BaseException) -> float | None:
+    """
+    例外の元になった HTTP レスポンスの Retry-After ヘッダーから、リトライまでに待機すべき時間を取得する
+    Retry-After ヘッダーは秒数と HTTP-date のどちらの形式でも解釈する
+
+    Args:
+        error (BaseException): 例外
+
+    Returns:
+        float | None: 待機すべき時間 (秒) (Retry-After ヘッダーがない場合や解釈できない場合は None)
+    """
+
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    retry_after = error.response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    retry_after = retry_after.strip()
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def isRetryable(error: BaseException) -> bool:
+    """
+    例外の原因となったリクエストをリトライすべきかどうかを判定する
+    リトライするのは、通信エラー (タイムアウト・接続断など) と一時的な HTTP のエラーレスポンス (429 / 5xx など) のみ
+    それ以外の例外 (404 などのエラーレスポンス・レスポンスの内容が不正な場合・ログインの失敗など) はリトライしない
+    ## ログインの失敗をリトライすると、パスワードの誤りなどで短時間に何度もログインを試みることになり、アカウントがロックされかねない
+
+    Args:
+        error (BaseException): 例外
+
+    Returns:
+        bool: リトライすべき場合は True
+    """
+
+    status_code = getStatusCode(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+    if isinstance(error, httpx.TransportError):
+        return True
+    return False
+
+
+class TokenBucket:
+    """
+    1つのホストへのリクエストの送信レートを制限するトークンバケット
+    スロットリング (429 / 503) を受けたときは送信レートを半分に下げ、リクエストが成功するたびに元の送信レートまで少しずつ戻す
+    """
+
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        """
+        TokenBucket のコンストラクタ
+
+        Args:
+            rate (float): 1秒あたりの最大リクエスト数
+            capacity (float | None, default=None): 連続して送信できる最大リクエスト数 (None の場合は rate と同じで、最低 1)
+        """
+
+        if rate <= 0:
+            raise ValueError('Rate must be greater than 0.')
+
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+        # Retry-After で指定された、次にリクエストを送信できる時刻 (time.monotonic() の値)
+        self.blocked_until = 0.0
+
+        # トークンを待っているリクエストを到着順に1つずつ送り出すためのロック
+        self.lock = asyncio.Lock()
+
+
+    async def acquire(self) -> None:
+        """
+        リクエストを1つ送信できるようになるまで待機し、トークンを1つ消費する
+        """
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                elif self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1
+                    return
+
+
+    def throttle(self, retry_after: float | None) -> None:
+        """
+        スロットリングを受けたときに呼び出し、送信レートを半分に下げる
+        Retry-After が指定されている場合は、その時間が経過するまでリクエストを送信しない
+
+        Args:
+            retry_after (float | None): Retry-After ヘッダーで指定された待機時間 (秒)
+        """
+
+        self.rate = max(self.max_rate / 16, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        if retry_after is not None:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+    def succeed(self) -> None:
+        """
+        リクエストが成功したときに呼び出し、送信レートを元の送信レートに向けて少しずつ戻す
+        """
+
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class RateLimiter:
+    """
+    ホストごとのトークンバケットで送信レートを制限しながらリクエストを送信し、失敗したリクエストだけをリトライするリクエスト層
+    リトライ前の待機時間は指数バックオフ (フルジッター) で決め、Retry-After ヘッダーがあればそれ以上待機する
+    実況チャンネル単位ではなくリクエスト単位でリトライするため、1つのスレッドのダウンロードに失敗しても、完了済みのダウンロードは無駄にならない
+    """
+
+    # 1リクエストあたりの最大試行回数
+    MAX_ATTEMPTS = 5
+
+    # 指数バックオフの基準の待機時間 (秒) と、待機時間の上限 (秒)
+    BASE_DELAY = 1.0
+    MAX_DELAY = 60.0
+
+    # Retry-After で指定された待機時間がこれより長い場合は、リトライせずに諦める (秒)
+    MAX_RETRY_AFTER = 600.0
+
+
+    def __init__(self, rates: dict[str, float], default_rate: float = 4.0) -> None:
+        """
+        RateLimiter のコンストラクタ
+
+        Args:
+            rates (dict[str, float]): ホスト名ごとの1秒あたりの最大リクエスト数
+            default_rate (float, default=4.0): rates にないホストの1秒あたりの最大リクエスト数
+        """
+
+        self.rates = rates
+        self.default_rate = default_rate
+        self.buckets: dict[str, TokenBucket] = {}
+
+
+    def getBucket(self, host: str) -> TokenBucket:
+        """
+        ホストのトークンバケットを取得する (まだない場合は作成する)
+
+        Args:
+            host (str): ホスト名
+
+        Returns:
+            TokenBucket: ホストのトークンバケット
+        """
+
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rates.get(host, self.default_rate))
+        return self.buckets[host]
+
+
+    def getBackoff(self, attempt: int, retry_after: float | None) -> float:
+        """
+        リトライ前の待機時間を算出する
+
+        Args:
+            attempt (int): 失敗した試行の回数 (1 から始まる)
+            retry_after (float | None): Retry-After ヘッダーで指定された待機時間 (秒)
+
+        Returns:
+            float: 待機時間 (秒)
+        """
+
+        delay = random.uniform(0, min(self.MAX_DELAY, self.BASE_DELAY * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+
+    async def request(
+        self,
+        host: str,
+        send: Callable[[], Awaitable[T]],
+        on_retry: Callable[[str, int, Exception, float], None] | None = None,
+    ) -> T:
+        """
+        ホストの送信レートの制限に従ってリクエストを送信し、失敗した場合は MAX_ATTEMPTS 回まで試行する
+
+        Args:
+            host (str): リクエスト先のホスト名
+            send (Callable[[], Awaitable[T]]): リクエストを送信する関数 (試行のたびに呼び出される)
+            on_retry (Callable[[str, int, Exception, float], None] | None, default=None): リトライ前に ホスト名・失敗した試行の回数・例外・待機時間 を受け取る関数
+
+        Returns:
+            T: send() の戻り値
+
+        Raises:
+            Exception: リトライすべきでない例外が発生した場合や、MAX_ATTEMPTS 回試行しても失敗した場合 (最後に発生した例外)
+        """
+
+        bucket = self.getBucket(host)
+        attempt = 0
+        while True:
+            attempt += 1
+            await bucket.acquire()
+            try:
+                result = await send()
+            except Exception as ex:
+                retry_after = getRetryAfter(ex)
+                if getStatusCode(ex) in THROTTLE_STATUS_CODES:
+                    # Retry-After が MAX_RETRY_AFTER より長い場合はこのリクエストを諦めるが、ホストへの送信は MAX_RETRY_AFTER 秒までしか止めない
+                    ## そのまま従うと、Retry-After: 3600 のようなレスポンス1つでそのホストへのすべてのリクエストが1時間止まってしまう
+                    bucket.throttle(min(retry_after, self.MAX_RETRY_AFTER) if retry_after is not None else None)
+                if attempt >= self.MAX_ATTEMPTS or isRetryable(ex) is False:
+                    raise
+                if retry_after is not None and retry_after > self.MAX_RETRY_AFTER:
+                    raise
+                delay = self.getBackoff(attempt, retry_after)
+                if on_retry is not None:
+                    on_retry(host, attempt, ex, delay)
+                await asyncio.sleep(delay)
+            else:
+                bucket.succeed()
+                return result
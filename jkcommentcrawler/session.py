@@ -0,0 +1,194 @@
+import asyncio
+import httpx
+import json
+import time
+from ndgr_client import NDGRClient
+from pathlib import Path
+from typing import Any
+
+
+# ログイン済みの Cookie を保存するファイルのパス
+## JKCommentCrawler.db と同じく、JKCommentCrawler 本体のフォルダに配置する
+COOKIES_JSON_PATH = Path(__file__).parent.parent / 'cookies.json'
+
+
+def createHTTPClient(headers: dict[str, str] | httpx.Headers | None = None) -> httpx.AsyncClient:
+    """
+    プロセス全体で共有するための httpx.AsyncClient を作成する
+    同じホストへの接続は Keep-Alive で使い回される
+
+    Args:
+        headers (dict[str, str] | httpx.Headers | None, default=None): すべてのリクエストに付与するヘッダー
+
+    Returns:
+        httpx.AsyncClient: 作成した httpx.AsyncClient
+    """
+
+    return httpx.AsyncClient(
+        headers = headers,
+        follow_redirects = True,
+        limits = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60),
+    )
+
+
+class LoginError(Exception):
+    """
+    ニコニコアカウントへのログインに失敗したことを示す例外
+    メールアドレス・パスワードの誤りなど、リトライしても成功しない失敗のため、RateLimiter や実況チャンネル単位ではリトライしない
+    """
+
+    pass
+
+
+class NicoliveSession:
+    """
+    ニコニコ生放送へのログインセッションを、プロセス内のすべての NDGRClient で共有するためのクラス
+    NDGRClient ごとに作成される httpx.AsyncClient を共有クライアントに差し替えることで、
+    ログインと TLS ハンドシェイクを (セッションが切れない限り) 1回だけで済ませる
+    """
+
+    # ログインセッションを検証せずに使い回す時間 (秒)
+    ## この時間を過ぎたら、次に NDGRClient を準備する際に cookies.json の Cookie が有効かを確認する
+    SESSION_LIFETIME = 60 * 60
+
+
+    def __init__(self, niconico_mail: str, niconico_password: str, cookies_json: Path | None = COOKIES_JSON_PATH, cookies: dict[str, Any] | None = None) -> None:
+        """
+        NicoliveSession のコンストラクタ
+
+        Args:
+            niconico_mail (str): ニコニコにログインするメールアドレス
+            niconico_password (str): ニコニコにログインするパスワード
+            cookies_json (Path | None, default=COOKIES_JSON_PATH): ログイン済みの Cookie を保存するファイルのパス (None の場合は cookies だけを使い、新規ログインも cookies.json の読み書きもしない)
+            cookies (dict[str, Any] | None, default=None): 親プロセスでログインして得た Cookie (ワーカープロセスで cookies_json を None にして使う)
+        """
+
+        self.niconico_mail = niconico_mail
+        self.niconico_password = niconico_password
+        self.cookies_json = cookies_json
+
+        # 最後のログインで得た Cookie (ワーカープロセスに渡すために使う)
+        self.cookies = cookies
+
+        # すべての NDGRClient で共有する httpx.AsyncClient (最初の NDGRClient の準備時に作成する)
+        self.httpx_client: httpx.AsyncClient | None = None
+
+        # 最後にログインセッションを確認した時刻 (time.monotonic() の値)
+        self.logged_in_at: float | None = None
+
+        # ログイン処理が並列に実行されないようにするためのロック
+        self.lock = asyncio.Lock()
+
+        # ログインに失敗したときの例外
+        ## 一度ログインに失敗したら、以降の NDGRClient の準備ではログインを試みずにこの例外を送出する
+        self.login_error: LoginError | None = None
+
+
+    async def prepare(self, ndgr_client: NDGRClient) -> None:
+        """
+        NDGRClient の httpx.AsyncClient を共有クライアントに差し替え、必要であればニコニコアカウントにログインする
+        (ログインはタイムシフト再生に必要)
+        httpx.AsyncClient を差し替えられない NDGRClient の場合は、差し替えずに毎回ログインする
+
+        Args:
+            ndgr_client (NDGRClient): 準備する NDGRClient
+
+        Raises:
+            LoginError: ログインに失敗した場合 (以前にログインに失敗している場合も含む)
+        """
+
+        async with self.lock:
+
+            # NDGRClient.httpx_client は公開 API ではなく、pyproject.toml で固定している NDGRClient のリビジョンの実装に依存している
+            ## 将来のバージョンでこの属性がなくなったり型が変わったりした場合は差し替えず、NDGRClient ごとにログインする (差し替える前の動作)
+            is_shareable = isinstance(getattr(ndgr_client, 'httpx_client', None), httpx.AsyncClient)
+            if is_shareable is True:
+
+                # 初回のみ共有クライアントを作成する
+                ## User-Agent などのヘッダーは NDGRClient が設定したものをそのまま引き継ぐ
+                if self.httpx_client is None:
+                    self.httpx_client = createHTTPClient(headers=ndgr_client.httpx_client.headers)
+
+                # NDGRClient が作成した httpx.AsyncClient は使わないので閉じてから差し替える
+                if ndgr_client.httpx_client is not self.httpx_client:
+                    await ndgr_client.httpx_client.aclose()
+                    ndgr_client.httpx_client = self.httpx_client
+
+                # ログインセッションが有効期間内ならそのまま使い回す
+                if self.logged_in_at is not None and time.monotonic() - self.logged_in_at < self.SESSION_LIFETIME:
+                    return
+
+            # 以前にログインに失敗している場合は、再度ログインを試みずに同じ例外を送出する
+            ## 並列にダウンロードしている番組ごとにログインを試みると、アカウントがロックされかねない
+            if self.login_error is not None:
+                raise self.login_error
+
+            try:
+                await self.login(ndgr_client)
+            except LoginError as ex:
+                self.login_error = ex
+                raise
+
+            # 共有クライアントに差し替えられなかった場合は、ログインで得た Cookie はこの NDGRClient にしか保持されない
+            if is_shareable is True:
+                self.logged_in_at = time.monotonic()
+
+
+    async def login(self, ndgr_client: NDGRClient) -> None:
+        """
+        ニコニコアカウントにログインする
+        すでにログイン済みの Cookie が cookies.json にあれば Cookie を再利用し、ない場合は新規ログインを行う
+        ログインで得た Cookie は共有クライアントに保持されるため、以降の NDGRClient でもそのまま使われる
+        cookies_json が None の場合 (ワーカープロセス) は、親プロセスから渡された Cookie だけでログインする
+        ## 各ワーカープロセスが新規ログインして cookies.json を書き換え合わないよう、cookies.json への書き込みは親プロセスだけが行う
+
+        Args:
+            ndgr_client (NDGRClient): 共有クライアントに差し替え済みの NDGRClient
+
+        Raises:
+            LoginError: ログインに失敗した場合
+        """
+
+        cookies_dict: dict[str, Any] | None = None
+        if self.cookies_json is None:
+            if self.cookies is not None:
+                cookies_dict = await ndgr_client.login(cookies=self.cookies)
+            if cookies_dict is None:
+                raise LoginError('Failed to login to niconico with the cookies passed from the parent process.')
+            self.cookies = cookies_dict
+            return
+
+        if self.cookies_json.exists():
+            with open(self.cookies_json, 'r', encoding='utf-8') as f:
+                cookies_dict = json.load(f)
+            cookies_dict = await ndgr_client.login(cookies=cookies_dict)
+
+        # cookies.json が存在しないか、ログインセッションが切れている場合は
+        # メールアドレスとパスワードを指定して新規ログインを実行
+        if cookies_dict is None:
+            cookies_dict = await ndgr_client.login(mail=self.niconico_mail, password=self.niconico_password)
+            if cookies_dict is None:
+                raise LoginError('Failed to login to niconico.')
+            with open(self.cookies_json, 'w', encoding='utf-8') as f:
+                json.dump(cookies_dict, f)
+        self.cookies = cookies_dict
+
+
+    def invalidate(self) -> None:
+        """
+        ログインセッションを無効とみなし、次に NDGRClient を準備する際にログインし直すようにする
+        コメントのダウンロードに失敗した場合に呼び出す
+        """
+
+        self.logged_in_at = None
+
+
+    async def close(self) -> None:
+        """
+        共有クライアントを閉じる
+        """
+
+        if self.httpx_client is not None:
+            await self.httpx_client.aclose()
+            self.httpx_client = None
+        self.logged_in_at = None
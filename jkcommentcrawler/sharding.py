@@ -0,0 +1,237 @@
+import asyncio
+import multiprocessing
+import zlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Any, Callable, Coroutine
+
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.crawler import CommentCrawler
+from jkcommentcrawler.job_store import BackfillJobStore
+from jkcommentcrawler.metrics import CrawlMetrics
+
+
+@dataclass(slots=True)
+class ShardResult:
+    """
+    1つのシャード (ワーカープロセス) の収集結果
+    """
+
+    # 実況チャンネル ID ごとの保存対象コメント数 (収集に失敗したチャンネルは含まない)
+    comment_counts: dict[str, int] = field(default_factory=dict)
+    # 新たに作成したファイルのパスのリスト
+    created_files: list[Path] = field(default_factory=list)
+    # 記録した計測結果のイベントのリスト
+    events: list[dict[str, Any]] = field(default_factory=list)
+
+
+def getShardKey(jikkyo_channel_id: str, target_date: date | None = None) -> str:
+    """
+    ジョブをシャードに振り分けるためのキーを取得する
+    実況チャンネル単位で振り分ける場合は実況チャンネル ID、実況チャンネル×日付単位で振り分ける場合は {実況チャンネル ID}/{YYYYMMDD}
+
+    Args:
+        jikkyo_channel_id (str): 実況チャンネル ID
+        target_date (date | None, default=None): 日付 (None の場合は実況チャンネル単位で振り分ける)
+
+    Returns:
+        str: シャードのキー
+    """
+
+    if target_date is None:
+        return jikkyo_channel_id
+    return f'{jikkyo_channel_id}/{target_date.strftime("%Y%m%d")}'
+
+
+def getShardIndex(shard_key: str, shard_count: int) -> int:
+    """
+    シャードのキーから、ジョブを担当するシャードの番号を取得する
+    Python の hash() はプロセスごとに値が変わるため、どのプロセス・ホストでも同じ結果になる CRC32 を使う
+
+    Args:
+        shard_key (str): シャードのキー
+        shard_count (int): シャードの数
+
+    Returns:
+        int: シャードの番号 (0 ~ shard_count - 1)
+    """
+
+    return zlib.crc32(shard_key.encode('utf-8')) % shard_count
+
+
+def parseShard(shard: str) -> tuple[int, int]:
+    """
+    --shard に指定された {シャードの番号}/{シャードの数} 形式の文字列を解析する
+
+    Args:
+        shard (str): シャードの指定 (ex: 0/3)
+
+    Returns:
+        tuple[int, int]: シャードの番号 (0 始まり) とシャードの数
+
+    Raises:
+        ValueError: 形式が不正な場合
+    """
+
+    try:
+        shard_index, shard_count = (int(value) for value in shard.split('/'))
+    except ValueError:
+        raise ValueError(f'Invalid shard "{shard}". (ex: 0/3)')
+    if shard_count < 1 or not (0 <= shard_index < shard_count):
+        raise ValueError(f'Invalid shard "{shard}". Shard index must be between 0 and {shard_count - 1}.')
+    return shard_index, shard_count
+
+
+async def createWorkerOptions(crawler_options: dict[str, Any], worker_count: int, jikkyo_channel_ids: list[str]) -> dict[str, Any]:
+    """
+    ワーカープロセスごとの CommentCrawler のコンストラクタに渡す引数を作成する
+    同時実行数と送信レートの制限はこのホスト全体での上限として扱い、ワーカープロセスの数で等分する (同時実行数は最低 1)
+    ニコニコ生放送へのログインはこのプロセスで1回だけ行い、ログイン済みの Cookie を各ワーカープロセスに渡す
+    ## 各ワーカープロセスがそれぞれログインすると、同時に cookies.json を書き換え合ってしまう
+
+    Args:
+        crawler_options (dict[str, Any]): CommentCrawler のコンストラクタに渡す引数 (metrics を除く)
+        worker_count (int): 起動するワーカープロセスの数
+        jikkyo_channel_ids (list[str]): ワーカープロセス全体で収集する実況チャンネル ID のリスト
+
+    Returns:
+        dict[str, Any]: ワーカープロセスごとの CommentCrawler のコンストラクタに渡す引数 (ワーカープロセスが1つ以下の場合は crawler_options のまま)
+    """
+
+    if worker_count <= 1:
+        return crawler_options
+
+    crawler = CommentCrawler(**crawler_options)
+    try:
+        nicolive_cookies = await crawler.loginNicolive(jikkyo_channel_ids)
+    finally:
+        await crawler.close()
+
+    worker_options = dict(crawler_options)
+    for name in ('channel_concurrency', 'nicolive_concurrency', 'nx_concurrency'):
+        worker_options[name] = max(1, crawler_options[name] // worker_count)
+    for name in ('nicolive_rate_limit', 'nx_rate_limit'):
+        worker_options[name] = crawler_options[name] / worker_count
+    worker_options['cookies_json'] = None
+    worker_options['nicolive_cookies'] = nicolive_cookies
+    return worker_options
+
+
+async def crawlShard(crawler_options: dict[str, Any], jikkyo_channel_ids: list[str], target_date: date, metrics: CrawlMetrics | None = None) -> ShardResult:
+    """
+    1つのシャードに振り分けられた実況チャンネルの過去ログを収集する
+
+    Args:
+        crawler_options (dict[str, Any]): CommentCrawler のコンストラクタに渡す引数 (metrics を除く)
+        jikkyo_channel_ids (list[str]): 過去ログを収集する実況チャンネル ID のリスト
+        target_date (date): 過去ログを収集する日付
+        metrics (CrawlMetrics | None, default=None): 計測器 (None の場合はこのシャード用に作成し、記録したイベントを結果として返す)
+
+    Returns:
+        ShardResult: 収集結果
+    """
+
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    crawler = CommentCrawler(**crawler_options, metrics=metrics)
+    try:
+        comment_counts = await crawler.crawlChannels(jikkyo_channel_ids, target_date)
+    finally:
+        await crawler.close()
+    return ShardResult(comment_counts, crawler.created_files, metrics.events)
+
+
+async def backfillShard(crawler_options: dict[str, Any], jobs: dict[str, list[date]], metrics: CrawlMetrics | None = None) -> ShardResult:
+    """
+    1つのシャードに振り分けられたバックフィルのジョブを実行する
+    実況チャンネルごとに日付昇順に実行し、完了したジョブを JKCommentCrawler.db に記録する
+
+    Args:
+        crawler_options (dict[str, Any]): CommentCrawler のコンストラクタに渡す引数 (metrics を除く)
+        jobs (dict[str, list[date]]): 実況チャンネル ID をキーとした、まだ完了していないジョブの日付のリスト (日付昇順)
+        metrics (CrawlMetrics | None, default=None): 計測器 (None の場合はこのシャード用に作成し、記録したイベントを結果として返す)
+
+    Returns:
+        ShardResult: 収集結果 (comment_counts にはこのシャードで収集したコメント数の実況チャンネルごとの合計が入る)
+    """
+
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    crawler = CommentCrawler(**crawler_options, metrics=metrics)
+    job_store = BackfillJobStore()
+    comment_counts: dict[str, int] = defaultdict(int)
+
+    async def backfillChannel(jikkyo_channel_id: str, dates: list[date]) -> None:
+        """
+        1つの実況チャンネルのジョブを日付昇順に実行する
+        日付をまたぐニコニコ生放送番組・NX-Jikkyo スレッドは1回だけダウンロードし、両方の日付の .nicojk ファイルに振り分ける
+        NX-Jikkyo スレッドの一覧は ThreadIndex に保存されるため、期間全体で API から取得するのは基本的に1回だけで済む
+        """
+
+        # 日付をまたぐ取得元のコメントを次の日付でも使い回すためのキャッシュ
+        source_cache: dict[str, list[Comment]] = {}
+        for target_date in dates:
+            count = await crawler.crawlChannel(jikkyo_channel_id, target_date, source_cache)
+            if count is not None:
+                job_store.markDone(jikkyo_channel_id, target_date, count)
+                comment_counts[jikkyo_channel_id] += count
+            else:
+                job_store.markFailed(jikkyo_channel_id, target_date)
+
+            # 中断された場合に備えて、ジョブを1つ終えるごとに計測結果を書き出す
+            metrics.flush()
+
+    # 実況チャンネルごとに並列にバックフィルを実行
+    ## 同時に収集する実況チャンネルの数は CommentCrawler の channel_semaphore で制限される
+    try:
+        await asyncio.gather(*[backfillChannel(jikkyo_channel_id, dates) for jikkyo_channel_id, dates in jobs.items()])
+    finally:
+        await crawler.close()
+        job_store.close()
+    return ShardResult(dict(comment_counts), crawler.created_files, metrics.events)
+
+
+def runShard(function: Callable[..., Coroutine[Any, Any, ShardResult]], *args: Any) -> ShardResult:
+    """
+    ワーカープロセスでシャードを実行する (ワーカープロセスのエントリーポイント)
+
+    Args:
+        function (Callable[..., Coroutine[Any, Any, ShardResult]]): シャードを実行する関数 (crawlShard / backfillShard)
+        *args (Any): function に渡す引数
+
+    Returns:
+        ShardResult: 収集結果
+    """
+
+    return asyncio.run(function(*args))
+
+
+async def runShards(function: Callable[..., Coroutine[Any, Any, ShardResult]], shard_args: list[tuple[Any, ...]], metrics: CrawlMetrics) -> list[ShardResult]:
+    """
+    シャードごとにワーカープロセスを起動して並列に実行し、すべての収集結果を返す
+    シャードが1つだけの場合は、ワーカープロセスを起動せずにこのプロセスで実行する (シャードがない場合は何もしない)
+    ワーカープロセスで記録した計測結果のイベントは、ワーカーの番号を付けて metrics に取り込む
+
+    Args:
+        function (Callable[..., Coroutine[Any, Any, ShardResult]]): シャードを実行する関数 (crawlShard / backfillShard)
+        shard_args (list[tuple[Any, ...]]): シャードごとの function に渡す引数 (metrics を除く)
+        metrics (CrawlMetrics): このプロセスの計測器
+
+    Returns:
+        list[ShardResult]: シャードごとの収集結果 (shard_args の順序)
+    """
+
+    if len(shard_args) == 0:
+        return []
+    if len(shard_args) == 1:
+        return [await function(*shard_args[0], metrics)]
+
+    # XML の解析やコメントの並び替えなどの CPU 負荷の高い処理を複数のコアで分担するため、シャードごとに別プロセスで実行する
+    ## イベントループの実行中に fork すると子プロセスでイベントループを作り直せないため、spawn でワーカープロセスを起動する
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=len(shard_args), mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = await asyncio.gather(*[loop.run_in_executor(executor, runShard, function, *args) for args in shard_args])
+    for worker_index, result in enumerate(results):
+        metrics.merge(result.events, worker=worker_index)
+    return results
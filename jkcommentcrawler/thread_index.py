@@ -0,0 +1,209 @@
+import asyncio
+import time
+from datetime import date
+from functools import partial
+from pathlib import Path
+
+from jkcommentcrawler.database import DATABASE_PATH, connectDatabase
+from jkcommentcrawler.nx_client import NXClient, ThreadInfo
+from jkcommentcrawler.rate_limit import RateLimiter
+
+
+class ThreadIndex:
+    """
+    NX-Jikkyo スレッドの情報を実況チャンネルごとにローカルの SQLite データベースに保存しておくインデックス
+    スレッド情報取得 API は実況チャンネルの過去全スレッドの情報を返すため重く、毎回取得するのは無駄が多い
+    このインデックスでは、指定された日付のスレッドがすべてインデックスに揃っている場合は API にアクセスせずに結果を返す
+    放送終了済み (PAST) のスレッドの情報は一度保存したら二度と更新しない
+    """
+
+    # 放送中 (ACTIVE) / 放送予定 (UPCOMING) のスレッドを含む日付について、インデックスを再取得せずに使い回す時間 (秒)
+    REFRESH_INTERVAL = 30 * 60
+
+
+    def __init__(self, database_path: Path = DATABASE_PATH, rate_limiter: RateLimiter | None = None) -> None:
+        """
+        ThreadIndex のコンストラクタ
+
+        Args:
+            database_path (Path, default=DATABASE_PATH): インデックスを保存する SQLite データベースのパス
+            rate_limiter (RateLimiter | None, default=None): スレッド情報取得 API へのリクエストの送信レートを制限し、失敗時にリトライするリクエスト層
+        """
+
+        self.rate_limiter = rate_limiter
+
+        self.connection = connectDatabase(database_path)
+        with self.connection:
+            # start_date / end_date は API が返す日時のタイムゾーンでの日付 (YYYY-MM-DD)
+            ## NXClient.getThreadIDsOnDate() と同じ基準で日付を比較するために保存している
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS nx_threads (
+                    id INTEGER PRIMARY KEY,
+                    channel_id TEXT NOT NULL,
+                    start_at REAL NOT NULL,
+                    end_at REAL NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    status TEXT NOT NULL
+                )
+            ''')
+            self.connection.execute('''
+                CREATE INDEX IF NOT EXISTS nx_threads_channel_date ON nx_threads (channel_id, start_date, end_date)
+            ''')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS nx_thread_index_updates (
+                    channel_id TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+
+        # 同じ実況チャンネルのインデックスが並列に更新されないようにするためのロック
+        self.locks: dict[str, asyncio.Lock] = {}
+
+
+    async def getThreadIDsOnDate(self, jikkyo_channel_id: str, target_date: date) -> list[int]:
+        """
+        指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID を取得する
+        NXClient.getThreadIDsOnDate() と同じ結果を返すが、インデックスで足りる場合は API にアクセスしない
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            target_date (date): NX-Jikkyo のスレッド (通常毎日 04:00 ~ 翌日 04:00) を取得する日付
+
+        Returns:
+            list[int]: 指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID のリスト (放送開始日時昇順)
+
+        Raises:
+            ValueError: ニコニコ実況互換のチャンネル ID が指定されていない場合
+            httpx.HTTPStatusError: NX-Jikkyo API へのリクエストに失敗した場合
+        """
+
+        async with self.locks.setdefault(jikkyo_channel_id, asyncio.Lock()):
+            if self.isUpToDate(jikkyo_channel_id, target_date) is False:
+                if self.rate_limiter is not None:
+                    threads = await self.rate_limiter.request(NXClient.API_HOST, partial(NXClient.getThreads, jikkyo_channel_id))
+                else:
+                    threads = await NXClient.getThreads(jikkyo_channel_id)
+                self.update(jikkyo_channel_id, threads)
+
+        return [thread_id for thread_id, _ in self.query(jikkyo_channel_id, target_date)]
+
+
+    def query(self, jikkyo_channel_id: str, target_date: date) -> list[tuple[int, str]]:
+        """
+        インデックスから、指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドを区間検索する
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            target_date (date): スレッドを検索する日付
+
+        Returns:
+            list[tuple[int, str]]: スレッド ID とステータスのタプルのリスト (放送開始日時昇順)
+        """
+
+        return self.connection.execute(
+            'SELECT id, status FROM nx_threads WHERE channel_id = ? AND start_date <= ? AND end_date >= ? ORDER BY start_at',
+            (jikkyo_channel_id, target_date.isoformat(), target_date.isoformat()),
+        ).fetchall()
+
+
+    def isUpToDate(self, jikkyo_channel_id: str, target_date: date) -> bool:
+        """
+        指定した日付のスレッドがすべてインデックスに揃っているかどうかを判定する
+        放送中/放送予定のスレッドを含む日付は、インデックス内に現在放送中のスレッドがない場合と、前回の更新から REFRESH_INTERVAL 秒以上経った場合に揃っていないとみなす
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            target_date (date): 判定する日付
+
+        Returns:
+            bool: インデックスに揃っている場合は True
+        """
+
+        # 指定した日付より後に終了するスレッドがインデックスにない場合は、指定した日付のスレッドが揃っていない可能性がある
+        ## スレッドは通常 04:00 ~ 翌日 04:00 で途切れなく作成されるため、これがあれば指定した日付のスレッドはすべて作成済み
+        row = self.connection.execute(
+            'SELECT 1 FROM nx_threads WHERE channel_id = ? AND end_date > ? LIMIT 1',
+            (jikkyo_channel_id, target_date.isoformat()),
+        ).fetchone()
+        if row is None:
+            return False
+
+        # 指定した日付のスレッドがすべて放送終了済みなら、今後スレッドの情報が変わることはない
+        threads = self.query(jikkyo_channel_id, target_date)
+        if all(status == 'PAST' for _, status in threads):
+            return True
+
+        # 放送中/放送予定のスレッドを含む場合に、インデックス内に現在放送中のスレッドがなければすぐに更新する
+        ## インデックス内で最新のスレッドが放送終了していれば、その後に新しいスレッドが作成されている可能性が高い
+        ## REFRESH_INTERVAL だけで判定すると、新しいスレッドのコメントが最大 REFRESH_INTERVAL 秒間収集されなくなる
+        now = time.time()
+        row = self.connection.execute(
+            'SELECT 1 FROM nx_threads WHERE channel_id = ? AND start_at <= ? AND end_at > ? LIMIT 1',
+            (jikkyo_channel_id, now, now),
+        ).fetchone()
+        if row is None:
+            return False
+
+        # 現在放送中のスレッドがある場合は、前回の更新から REFRESH_INTERVAL 秒以上経っていれば更新する
+        row = self.connection.execute(
+            'SELECT updated_at FROM nx_thread_index_updates WHERE channel_id = ?',
+            (jikkyo_channel_id,),
+        ).fetchone()
+        return row is not None and now - row[0] < self.REFRESH_INTERVAL
+
+
+    def update(self, jikkyo_channel_id: str, threads: list[ThreadInfo]) -> None:
+        """
+        API から取得したスレッドの情報でインデックスを更新する
+        新しいスレッドと、放送終了済み (PAST) でないスレッドの情報だけが書き込まれる
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            threads (list[ThreadInfo]): スレッドの情報のリスト
+        """
+
+        with self.connection:
+            self.connection.executemany(
+                '''
+                INSERT INTO nx_threads (id, channel_id, start_at, end_at, start_date, end_date, title, description, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    start_at = excluded.start_at,
+                    end_at = excluded.end_at,
+                    start_date = excluded.start_date,
+                    end_date = excluded.end_date,
+                    title = excluded.title,
+                    description = excluded.description,
+                    status = excluded.status
+                WHERE nx_threads.status != 'PAST'
+                ''',
+                [
+                    (
+                        thread.id,
+                        jikkyo_channel_id,
+                        thread.start_at.timestamp(),
+                        thread.end_at.timestamp(),
+                        thread.start_at.date().isoformat(),
+                        thread.end_at.date().isoformat(),
+                        thread.title,
+                        thread.description,
+                        thread.status,
+                    )
+                    for thread in threads
+                ],
+            )
+            self.connection.execute(
+                'INSERT OR REPLACE INTO nx_thread_index_updates (channel_id, updated_at) VALUES (?, ?)',
+                (jikkyo_channel_id, time.time()),
+            )
+
+
+    def close(self) -> None:
+        """
+        SQLite データベースへの接続を閉じる
+        """
+
+        self.connection.close()
@@ -0,0 +1,154 @@
+import asyncio
+import signal
+import typer
+from datetime import date, datetime
+from ndgr_client.utils import AsyncTyper
+from pathlib import Path
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+
+from jkcommentcrawler import NXClient, __version__
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.config import loadConfig
+from jkcommentcrawler.crawler import CommentCrawler
+from jkcommentcrawler.dataset_structure import DatasetStructure
+from jkcommentcrawler.metrics import CrawlMetrics
+
+
+app = AsyncTyper()
+
+def version(value: bool):
+    if value is True:
+        typer.echo(f'JKCommentCrawler version {__version__}')
+        raise typer.Exit()
+
+@app.command(help='JKCommentCrawler: Nico Nico Jikkyo Comment Crawler (Watch Mode)')
+async def watch(
+    channel_id: str = typer.Argument(help='コメントを収集する実況チャンネル。(ex: jk211) all を指定すると全チャンネルのコメントを収集する。'),
+    interval: float = typer.Option(300, '--interval', min=1, help='今日のコメントを収集し、ログに追記する間隔 (秒)。デフォルトは cron と同じ5分。放送中の NX-Jikkyo スレッドとニコニコ生放送番組は、収集のたびにコメント全体をダウンロードし直すため、短くするほど各サーバーへの負荷が増える。'),
+    save_dataset_structure_json: bool = typer.Option(False, '--save-dataset-structure-json', help='過去ログデータのフォルダ/ファイル構造を示す JSON ファイルを出力する。'),
+    archive: bool = typer.Option(False, '--archive', help='時刻で範囲を指定して読み込める圧縮アーカイブ (.nicojkz) もログと同じフォルダに保存する。'),
+    channel_concurrency: int = typer.Option(8, '--channel-concurrency', min=1, help='同時に収集する実況チャンネルの最大数。'),
+    nicolive_concurrency: int = typer.Option(2, '--nicolive-concurrency', min=1, help='ニコニコ生放送番組のコメントを同時にダウンロードする最大数。'),
+    nx_concurrency: int = typer.Option(4, '--nx-concurrency', min=1, help='NX-Jikkyo スレッドのコメントを同時にダウンロードする最大数。'),
+    nicolive_rate_limit: float = typer.Option(2.0, '--nicolive-rate-limit', min=0.01, help='ニコニコ生放送への1秒あたりの最大リクエスト数。スロットリングを受けた場合は自動的に下げる。'),
+    nx_rate_limit: float = typer.Option(5.0, '--nx-rate-limit', min=0.01, help='NX-Jikkyo への1秒あたりの最大リクエスト数。スロットリングを受けた場合は自動的に下げる。'),
+    metrics_jsonl: Path | None = typer.Option(None, '--metrics-jsonl', help='実況チャンネル・処理段階ごとの所要時間などの計測結果を JSON Lines 形式で追記するファイル。'),
+    metrics_prometheus: Path | None = typer.Option(None, '--metrics-prometheus', help='計測結果を Prometheus の textfile collector 向けの形式で書き出すファイル。'),
+    verbose: bool = typer.Option(False, '-v', '--verbose', help='詳細なログを表示する。'),
+    version: bool = typer.Option(None, '--version', callback=version, is_eager=True, help='バージョン情報を表示する。'),
+):
+    """
+    常駐して今日のコメントを一定間隔で収集し続ける
+    cron から5分おきにプロセスを起動し直す代わりに、1つのプロセスでログインセッション・HTTP 接続・スレッドのインデックスを使い回す
+    毎回前回保存したコメントより新しいコメントだけを追記する (--incremental 相当)
+    収集の間隔はデフォルトでは cron と同じ5分で、--interval で変更できる
+    日付が変わったときは、前日のコメントを最後にもう一度収集してから今日のコメントの収集に移る
+
+    ただし、ニコニコ生放送・NX-Jikkyo の API には指定した時刻以降のコメントだけを取得する手段がないため、
+    放送中の NX-Jikkyo スレッドとニコニコ生放送番組は、収集のたびにコメント全体をダウンロードし直す
+    (放送終了済みの NX-Jikkyo スレッドは、一度ダウンロードしたコメントを使い回す)
+    また、JKCommentCrawler.sh のように収集したログを KakologArchives に commit & push することはしないため、cron の置き換えとしてそのまま使うことはできない
+    """
+
+    print(Rule(characters='=', style=Style(color='#E33157')))
+
+    # 設定読み込み
+    config = loadConfig()
+
+    # jikkyo_id に 'all' が指定された場合は全てのチャンネルを収集
+    if channel_id == 'all':
+        jikkyo_channel_ids = NXClient.JIKKYO_CHANNEL_ID_LIST.copy()
+    else:
+        jikkyo_channel_ids = [channel_id]
+
+    # 常駐中は同じ CommentCrawler を使い回し、ログインセッションや HTTP 接続、スレッドのインデックスを保持し続ける
+    crawler = CommentCrawler(
+        kakolog_dir = config.kakolog_dir,
+        niconico_mail = config.niconico_mail,
+        niconico_password = config.niconico_password,
+        incremental = True,
+        archive = archive,
+        verbose = verbose,
+        channel_concurrency = channel_concurrency,
+        nicolive_concurrency = nicolive_concurrency,
+        nx_concurrency = nx_concurrency,
+        nicolive_rate_limit = nicolive_rate_limit,
+        nx_rate_limit = nx_rate_limit,
+    )
+
+    # SIGINT / SIGTERM を受け取ったら、実行中の収集が終わってから終了する
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop_event.set)
+
+    # 実況チャンネルごとの、放送終了済みの NX-Jikkyo スレッドのダウンロード済みのコメント
+    ## 放送終了済みのスレッドのコメントはこれ以上増えないため、次回以降の収集ではダウンロードし直さずに使い回す
+    source_caches: dict[str, dict[str, list[Comment]]] = {}
+
+    last_date: date | None = None
+    try:
+        while stop_event.is_set() is False:
+            started_at = loop.time()
+            target_date = datetime.now().date()
+
+            # 収集を始める前の時点で放送終了済みの取得元を調べておく
+            ## 収集中に放送が終了したスレッドは、ダウンロードしたコメントが放送終了前のものである可能性があるためキャッシュに残さない
+            finished_source_keys = {
+                jikkyo_channel_id: crawler.getFinishedSourceKeys(jikkyo_channel_id, target_date)
+                for jikkyo_channel_id in jikkyo_channel_ids
+            }
+
+            # 収集のたびに計測器を作り直し、Prometheus 向けのファイルには直近の収集の値だけを書き出す
+            metrics = CrawlMetrics(
+                jsonl_path = metrics_jsonl if metrics_jsonl is not None else config.metrics_jsonl_path,
+                prometheus_path = metrics_prometheus if metrics_prometheus is not None else config.metrics_prometheus_path,
+            )
+            crawler.metrics = metrics
+
+            # 日付が変わった直後は、前日の終わり際に投稿されたコメントを取りこぼさないよう前日分をもう一度収集する
+            if last_date is not None and last_date < target_date:
+                print(f'Date changed. Retrieving the remaining comments on {last_date.strftime("%Y/%m/%d")} ...')
+                await crawler.crawlChannels(jikkyo_channel_ids, last_date, source_caches)
+
+            comment_counts = await crawler.crawlChannels(jikkyo_channel_ids, target_date, source_caches)
+            metrics.flush()
+            last_date = target_date
+
+            # 放送中のスレッドやニコニコ生放送番組のコメントは、次回の収集で新しいコメントを含めてダウンロードし直すためキャッシュから取り除く
+            for jikkyo_channel_id, source_cache in source_caches.items():
+                for source_key in list(source_cache.keys()):
+                    if source_key not in finished_source_keys.get(jikkyo_channel_id, set()):
+                        del source_cache[source_key]
+
+            # --save-dataset-structure-json が指定されているときは、新たに作成したファイルをデータセットの構造に追加
+            ## ほかのプロセスが dataset_structure.json のロックを取得している間もイベントループを止めないよう、別スレッドで更新する
+            if save_dataset_structure_json is True:
+                if await asyncio.to_thread(DatasetStructure(config.kakolog_dir).update, crawler.created_files) is True:
+                    print('Dataset structure updated.')
+            crawler.created_files.clear()
+
+            failed_channel_ids = [jikkyo_channel_id for jikkyo_channel_id in jikkyo_channel_ids if jikkyo_channel_id not in comment_counts]
+            elapsed = loop.time() - started_at
+            print(f'Crawled {len(comment_counts)} channels in {elapsed:.1f} seconds.' +
+                  (f' (failed: {", ".join(failed_channel_ids)})' if len(failed_channel_ids) > 0 else ''))
+            print(Rule(characters='=', style=Style(color='#E33157')))
+
+            # 収集にかかった時間を差し引いて、次の収集まで待機する
+            ## 収集に interval 秒以上かかった場合は待機せずに次の収集を始める
+            if interval - elapsed > 0:
+                try:
+                    await asyncio.wait_for(stop_event.wait(), timeout=interval - elapsed)
+                except asyncio.TimeoutError:
+                    pass
+    finally:
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signal_number)
+        await crawler.close()
+        print('Watch mode stopped.')
+
+
+if __name__ == '__main__':
+    app()
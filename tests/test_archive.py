@@ -0,0 +1,130 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from jkcommentcrawler.archive import (
+    BlockEncoder,
+    NicojkArchiveReader,
+    appendArchive,
+    buildArchive,
+    getArchivePath,
+    getIndexPath,
+    isArchiveUpToDate,
+    readIndex,
+)
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.merge import sliceComments
+from jkcommentcrawler.nicojk import NicojkWriter, appendComments, hashFile, iterComments
+from tests.utils import DAY_START, createComment
+
+
+def createComments(count: int, first_no: int = 1) -> list[Comment]:
+    """
+    複数のブロックにまたがる程度の長さのコメントを、1秒おきに count 件作成する
+    """
+
+    return [createComment('1', no, no, content=f'{no} ' + 'ｗ' * 100) for no in range(first_no, first_no + count)]
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.nicojk_path = Path(self.temp_dir.name) / '20240805.nicojk'
+        self.archive_path = getArchivePath(self.nicojk_path)
+
+    def writeNicojk(self, comments: list[Comment]) -> None:
+        with NicojkWriter(self.nicojk_path) as writer:
+            for comment in comments:
+                writer.write(comment)
+            writer.commit()
+
+    def readAll(self) -> list[Comment]:
+        with NicojkArchiveReader(self.archive_path, self.nicojk_path) as reader:
+            return [comment for block in reader.blocks for comment in reader.readBlock(block)]
+
+    def test_build_and_read(self) -> None:
+        comments = createComments(3000)
+        self.writeNicojk(comments)
+        buildArchive(self.nicojk_path)
+
+        index = readIndex(getIndexPath(self.archive_path))
+        self.assertGreater(len(index.blocks), 1)
+        self.assertEqual(sum(block.count for block in index.blocks), len(comments))
+        self.assertEqual(index.source_sha256, hashFile(self.nicojk_path))
+        self.assertEqual(index.source_size, self.nicojk_path.stat().st_size)
+        self.assertTrue(isArchiveUpToDate(self.nicojk_path))
+        self.assertEqual(self.readAll(), comments)
+
+    def test_read_date_range(self) -> None:
+        comments = createComments(3000)
+        self.writeNicojk(comments)
+        buildArchive(self.nicojk_path)
+
+        with NicojkArchiveReader(self.archive_path) as reader:
+            for start, end in [(0, 1), (1000, 1000.5), (1499.5, 2500), (2999, 3001), (5000, 6000)]:
+                self.assertEqual(
+                    list(reader.readDateRange(DAY_START + start, DAY_START + end)),
+                    list(sliceComments(comments, DAY_START + start, DAY_START + end)),
+                )
+
+    def test_read_vpos_range(self) -> None:
+        comments = createComments(3000)
+        self.writeNicojk(comments)
+        buildArchive(self.nicojk_path)
+
+        with NicojkArchiveReader(self.archive_path) as reader:
+            self.assertEqual(
+                list(reader.readVposRange(100000, 150000)),
+                [comment for comment in comments if 100000 <= comment.vpos < 150000],
+            )
+
+    def test_stale_archive_is_rejected(self) -> None:
+        comments = createComments(100)
+        self.writeNicojk(comments)
+        buildArchive(self.nicojk_path)
+
+        # --archive なしの実行で .nicojk ファイルだけが更新された場合
+        appendComments(self.nicojk_path, createComments(1, first_no=101))
+        self.assertFalse(isArchiveUpToDate(self.nicojk_path))
+        with self.assertRaises(ValueError):
+            NicojkArchiveReader(self.archive_path, self.nicojk_path)
+
+        # サイズが同じでも内容が異なる場合
+        self.writeNicojk([createComment('1', 1, 1, content='a')])
+        buildArchive(self.nicojk_path)
+        self.writeNicojk([createComment('1', 1, 1, content='b')])
+        self.assertFalse(isArchiveUpToDate(self.nicojk_path))
+
+    def test_missing_index_is_not_up_to_date(self) -> None:
+        self.writeNicojk(createComments(10))
+        self.assertFalse(isArchiveUpToDate(self.nicojk_path))
+        buildArchive(self.nicojk_path)
+        getIndexPath(self.archive_path).unlink()
+        self.assertFalse(isArchiveUpToDate(self.nicojk_path))
+
+    def test_append(self) -> None:
+        comments = createComments(3000)
+        self.writeNicojk(comments)
+        buildArchive(self.nicojk_path)
+        blocks_before = readIndex(getIndexPath(self.archive_path)).blocks
+
+        # 小さな追記を繰り返しても、最後のブロック以外は書き直されず、小さなブロックばかりにならない
+        for first_no in range(3001, 3101, 10):
+            new_comments = createComments(10, first_no=first_no)
+            appendComments(self.nicojk_path, new_comments)
+            appendArchive(self.archive_path, new_comments, hashFile(self.nicojk_path), self.nicojk_path.stat().st_size)
+            comments += new_comments
+
+        blocks_after = readIndex(getIndexPath(self.archive_path)).blocks
+        self.assertEqual(blocks_after[:len(blocks_before) - 1], blocks_before[:-1])
+        self.assertTrue(all(block.raw_size >= BlockEncoder.BLOCK_SIZE for block in blocks_after[:-1]))
+        self.assertTrue(isArchiveUpToDate(self.nicojk_path))
+        self.assertEqual(self.readAll(), comments)
+        self.assertEqual(self.readAll(), list(iterComments(self.nicojk_path)))
+        self.assertEqual(list(self.archive_path.parent.glob('*.tmp')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from datetime import datetime, timedelta
+
+from jkcommentcrawler.clip import Episode, filterRanges, getReadRanges
+from tests.utils import DAY_START, createComment
+
+
+class EpisodeRebaseTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # 00:30 ~ 01:00 のエピソード
+        start = datetime.fromtimestamp(DAY_START) + timedelta(minutes=30)
+        self.episode = Episode('jk1', start, start + timedelta(minutes=30))
+
+    def test_rebases_to_episode_start(self) -> None:
+        # 前日 04:00 に始まったスレッドの vpos は、00:30 の時点で 20.5 時間分進んでいる
+        thread_vpos = 20 * 360000 + 30 * 6000
+        comment = createComment('1', 1, 30 * 60 + 10, vpos=thread_vpos + 1000)
+        self.assertEqual(self.episode.rebase(comment).vpos, 1000)
+        self.assertEqual(comment.vpos, thread_vpos + 1000)
+
+    def test_keeps_vpos_deltas_within_each_thread(self) -> None:
+        # 投稿日時と vpos がずれていても (vpos は投稿時刻ではなく再生位置のため)、同じスレッドの vpos の間隔はそのまま保たれる
+        comments = [
+            createComment('nicolive', 1, 30 * 60 + 10, vpos=500000 + 1000),
+            createComment('nicolive', 2, 30 * 60 + 11, vpos=500000 + 950),
+            createComment('nicolive', 3, 30 * 60 + 20, vpos=500000 + 2000),
+            createComment('nx', 1, 30 * 60 + 15, vpos=7000000 + 1500),
+        ]
+        self.assertEqual([self.episode.rebase(comment).vpos for comment in comments], [1000, 950, 2000, 1500])
+        self.assertEqual(self.episode.vpos_offsets, {'nicolive': 500000, 'nx': 7000000})
+
+
+class FilterRangesTest(unittest.TestCase):
+
+    def test_merges_overlapping_episodes(self) -> None:
+        start = datetime.fromtimestamp(DAY_START)
+        episodes = [
+            Episode('jk1', start + timedelta(minutes=0), start + timedelta(minutes=30)),
+            Episode('jk1', start + timedelta(minutes=20), start + timedelta(minutes=50)),
+            Episode('jk1', start + timedelta(minutes=60), start + timedelta(minutes=90)),
+        ]
+        ranges = getReadRanges(episodes)
+        self.assertEqual(ranges, [(DAY_START, DAY_START + 50 * 60), (DAY_START + 60 * 60, DAY_START + 90 * 60)])
+
+        comments = [createComment('1', no, minutes * 60) for no, minutes in enumerate([-1, 0, 49, 50, 55, 60, 89, 90, 100], start=1)]
+        self.assertEqual([comment.no for comment in filterRanges(comments, ranges)], [2, 3, 6, 7])
+
+
+if __name__ == '__main__':
+    unittest.main()
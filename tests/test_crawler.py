@@ -0,0 +1,195 @@
+import asyncio
+import contextlib
+import io
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from unittest import mock
+
+from jkcommentcrawler.archive import NicojkArchiveReader, getArchivePath, isArchiveUpToDate
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.crawler import CommentCrawler
+from jkcommentcrawler.nicojk import hashFile, iterComments
+from jkcommentcrawler.session import LoginError
+from tests.utils import TARGET_DATE, createComment
+
+
+class CrawlChannelsTest(unittest.TestCase):
+    """
+    複数の実況チャンネルを並列に収集し、実況チャンネルごとにリトライする処理のテスト
+    """
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        work_dir = Path(self.temp_dir.name)
+        self.crawler = CommentCrawler(
+            kakolog_dir = work_dir / 'kakolog',
+            niconico_mail = '',
+            niconico_password = '',
+            database_path = work_dir / 'crawler.db',
+        )
+        self.addCleanup(lambda: asyncio.run(self.crawler.close()))
+
+        # リトライ前に待機しない
+        patcher = mock.patch.object(CommentCrawler, 'RETRY_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def crawlChannels(self, jikkyo_channel_ids: list[str], results: dict[str, list[int | Exception]]) -> dict[str, int]:
+        """
+        crawlChannelOnce() を、実況チャンネルごとに results の結果を順に返す (例外の場合は送出する) ものに置き換えて crawlChannels() を実行する
+        """
+
+        async def crawlChannelOnce(jikkyo_channel_id: str, target_date: date, source_cache: dict[str, list[Comment]] | None = None) -> int:
+            # 後に指定した実況チャンネルほど先に完了するようにして、完了順と結果の順序が異なる状況を作る
+            await asyncio.sleep(0.01 * (len(jikkyo_channel_ids) - jikkyo_channel_ids.index(jikkyo_channel_id)))
+            result = results[jikkyo_channel_id].pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        # 動作ログはテストの出力に含めない
+        with mock.patch.object(self.crawler, 'crawlChannelOnce', side_effect=crawlChannelOnce) as mock_crawl_channel_once, \
+             contextlib.redirect_stdout(io.StringIO()):
+            self.mock_crawl_channel_once = mock_crawl_channel_once
+            return asyncio.run(self.crawler.crawlChannels(jikkyo_channel_ids, TARGET_DATE))
+
+    def getCallCount(self, jikkyo_channel_id: str) -> int:
+        return sum(1 for call in self.mock_crawl_channel_once.call_args_list if call.args[0] == jikkyo_channel_id)
+
+    def test_summary_keeps_channel_order_when_some_channels_fail(self) -> None:
+        comment_counts = self.crawlChannels(['jk1', 'jk2', 'jk4', 'jk5'], {
+            'jk1': [10],
+            'jk2': [RuntimeError('error'), 20],
+            'jk4': [RuntimeError('error')] * CommentCrawler.MAX_RETRY_COUNT,
+            'jk5': [50],
+        })
+
+        # リトライで成功した実況チャンネルも含めて指定した順序で返り、リトライに失敗した実況チャンネルだけが含まれない
+        self.assertEqual(list(comment_counts.items()), [('jk1', 10), ('jk2', 20), ('jk5', 50)])
+        self.assertEqual(self.getCallCount('jk2'), 2)
+        self.assertEqual(self.getCallCount('jk4'), CommentCrawler.MAX_RETRY_COUNT)
+
+    def test_login_error_is_not_retried(self) -> None:
+        comment_counts = self.crawlChannels(['jk1', 'jk2'], {
+            'jk1': [LoginError('Failed to login to niconico.'), 10],
+            'jk2': [20],
+        })
+
+        # ログインの失敗はリトライせずに、その実況チャンネルだけをスキップする
+        self.assertEqual(comment_counts, {'jk2': 20})
+        self.assertEqual(self.getCallCount('jk1'), 1)
+
+    def test_login_nicolive(self) -> None:
+        async def prepare(ndgr_client: object) -> None:
+            self.crawler.nicolive_session.cookies = {'user_session': 'session'}
+
+        with mock.patch.object(self.crawler.nicolive_session, 'prepare', side_effect=prepare) as mock_prepare:
+            # ニコニコ生放送に存在する実況チャンネルがない場合はログインしない
+            self.assertIsNone(asyncio.run(self.crawler.loginNicolive(['jk141'])))
+            mock_prepare.assert_not_called()
+
+            self.assertEqual(asyncio.run(self.crawler.loginNicolive(['jk141', 'jk1'])), {'user_session': 'session'})
+            mock_prepare.assert_awaited_once()
+
+    def test_login_nicolive_failure(self) -> None:
+        # ログインに失敗した場合は例外を送出せず、Cookie を渡さない
+        with mock.patch.object(self.crawler.nicolive_session, 'prepare', side_effect=LoginError('Failed to login to niconico.')), \
+             contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(asyncio.run(self.crawler.loginNicolive(['jk1'])))
+
+
+class AppendNewCommentsTest(unittest.TestCase):
+    """
+    差分収集モード (--incremental) で、前回保存したコメントより新しいコメントだけを追記する処理のテスト
+    """
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        work_dir = Path(self.temp_dir.name)
+        self.crawler = CommentCrawler(
+            kakolog_dir = work_dir / 'kakolog',
+            niconico_mail = '',
+            niconico_password = '',
+            incremental = True,
+            archive = True,
+            database_path = work_dir / 'crawler.db',
+        )
+        self.addCleanup(lambda: asyncio.run(self.crawler.close()))
+        self.output_file = self.crawler.getOutputFile('jk1', TARGET_DATE)
+
+    def save(self, sources: list[list[Comment]]) -> int:
+        # 動作ログはテストの出力に含めない
+        with contextlib.redirect_stdout(io.StringIO()):
+            return self.crawler.appendNewComments('jk1', TARGET_DATE, sources)
+
+    def assertSaved(self, comments: list[Comment]) -> None:
+        self.assertEqual(list(iterComments(self.output_file)), comments)
+        self.assertTrue(isArchiveUpToDate(self.output_file))
+        with NicojkArchiveReader(getArchivePath(self.output_file), self.output_file) as reader:
+            self.assertEqual([comment for block in reader.blocks for comment in reader.readBlock(block)], comments)
+        file_state = self.crawler.manifest.getFileState('jk1', TARGET_DATE)
+        assert file_state is not None
+        self.assertEqual(file_state.sha256, hashFile(self.output_file))
+        self.assertEqual(file_state.size, self.output_file.stat().st_size)
+        self.assertEqual(file_state.comment_count, len(comments))
+
+    def test_first_save_writes_whole_log(self) -> None:
+        nicolive = [createComment('nicolive', 1, -5), createComment('nicolive', 2, 10)]
+        nx = [createComment('nx', 1, 5), createComment('nx', 2, 20)]
+
+        self.assertEqual(self.save([nicolive, nx]), 3)
+        self.assertSaved([nx[0], nicolive[1], nx[1]])
+
+        # 圧縮アーカイブと索引ファイルは dataset_structure.json に載せないため、作成したファイルには含めない
+        self.assertEqual(self.crawler.created_files, [self.output_file])
+
+    def test_appends_only_new_comments(self) -> None:
+        nicolive = [createComment('nicolive', 1, 10)]
+        nx = [createComment('nx', 1, 5), createComment('nx', 2, 20)]
+        self.save([nicolive, nx])
+
+        # 取得元のコメントは毎回すべてダウンロードされるため、保存済みのコメントも含まれている
+        nicolive += [createComment('nicolive', 2, 25)]
+        nx += [createComment('nx', 3, 30)]
+        self.assertEqual(self.save([nicolive, nx]), 5)
+        self.assertSaved([nx[0], nicolive[0], nx[1], nicolive[1], nx[2]])
+
+        # 新しいコメントがない場合はファイルを書き換えない
+        mtime = self.output_file.stat().st_mtime_ns
+        self.save([nicolive, nx])
+        self.assertEqual(self.output_file.stat().st_mtime_ns, mtime)
+        self.assertSaved([nx[0], nicolive[0], nx[1], nicolive[1], nx[2]])
+
+    def test_older_new_comments_rewrite_whole_log(self) -> None:
+        nicolive = [createComment('nicolive', 1, 10)]
+        nx = [createComment('nx', 1, 20)]
+        self.save([nicolive, nx])
+
+        # 片方の取得元のコメントだけが遅れて反映され、保存済みの最新のコメントより古いコメントが増えた場合
+        nicolive += [createComment('nicolive', 2, 15)]
+        self.save([nicolive, nx])
+        self.assertSaved([nicolive[0], nicolive[1], nx[0]])
+
+    def test_stale_archive_is_rebuilt(self) -> None:
+        nx = [createComment('nx', 1, 5)]
+        self.save([nx])
+
+        # --archive なしの実行で .nicojk ファイルだけが更新された場合
+        self.crawler.archive = False
+        nx += [createComment('nx', 2, 10)]
+        self.save([nx])
+        self.assertFalse(isArchiveUpToDate(self.output_file))
+
+        self.crawler.archive = True
+        nx += [createComment('nx', 3, 15)]
+        self.save([nx])
+        self.assertSaved(nx)
+        self.assertEqual(self.crawler.created_files, [self.output_file])
+
+
+if __name__ == '__main__':
+    unittest.main()
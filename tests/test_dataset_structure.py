@@ -0,0 +1,66 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from jkcommentcrawler.dataset_structure import DatasetStructure
+
+
+class DatasetStructureTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.kakolog_dir = Path(self.temp_dir.name)
+        self.dataset_structure = DatasetStructure(self.kakolog_dir)
+
+        # 実況チャンネル以外のフォルダ/ファイルと、.nicojk 以外のファイルは dataset_structure.json に含まれない
+        self.createFiles([
+            'jk1/2024/20240805.nicojk', 'jk1/2024/20240805.nicojkz', 'jk1/2024/20240805.nicojkz.idx', 'jk1/2024/20240807.nicojk',
+            'jk211/2023/20231231.nicojk', '.git/HEAD', 'Readme.md',
+        ])
+
+    def createFiles(self, names: list[str]) -> list[Path]:
+        paths = [self.kakolog_dir / name for name in names]
+        for path in paths:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+        return paths
+
+    def assertMatchesRebuild(self) -> None:
+        # 過去ログフォルダ全体を走査し直した場合と、バイト単位で同じ内容になっている
+        updated = self.dataset_structure.path.read_bytes()
+        self.dataset_structure.rebuild()
+        self.assertEqual(updated, self.dataset_structure.path.read_bytes())
+
+    def test_update_matches_rebuild(self) -> None:
+        self.dataset_structure.rebuild()
+
+        # 既存のフォルダの途中に入るファイル・新しい年・新しい実況チャンネルを追加しても、全体を走査し直した場合と同じ内容になる
+        created_files = self.createFiles(['jk1/2024/20240806.nicojk', 'jk1/2025/20250101.nicojk', 'jk10/2024/20240805.nicojk'])
+        self.assertTrue(self.dataset_structure.update(created_files))
+        self.assertMatchesRebuild()
+
+    def test_update_ignores_archives(self) -> None:
+        self.dataset_structure.rebuild()
+
+        # 圧縮アーカイブと索引ファイルは、作成したファイルとして渡されても追加しない
+        created_files = self.createFiles(['jk1/2024/20240806.nicojk', 'jk1/2024/20240806.nicojkz', 'jk1/2024/20240806.nicojkz.idx'])
+        self.assertTrue(self.dataset_structure.update(created_files))
+        self.assertMatchesRebuild()
+        self.assertEqual(self.dataset_structure.scan()['jk1']['2024'], {'20240805.nicojk': None, '20240806.nicojk': None, '20240807.nicojk': None})
+
+    def test_update_without_new_files(self) -> None:
+        self.dataset_structure.rebuild()
+        mtime = self.dataset_structure.path.stat().st_mtime_ns
+
+        # 既に含まれているファイルや、過去ログフォルダ直下のファイルだけなら書き換えない
+        self.assertFalse(self.dataset_structure.update([self.kakolog_dir / 'jk1/2024/20240805.nicojk', self.kakolog_dir / 'Readme.md']))
+        self.assertEqual(self.dataset_structure.path.stat().st_mtime_ns, mtime)
+
+    def test_update_without_existing_file_rebuilds(self) -> None:
+        self.assertTrue(self.dataset_structure.update([]))
+        self.assertMatchesRebuild()
+
+
+if __name__ == '__main__':
+    unittest.main()
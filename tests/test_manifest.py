@@ -0,0 +1,50 @@
+import tempfile
+import unittest
+from datetime import timedelta
+from pathlib import Path
+
+from jkcommentcrawler.manifest import FileState, Manifest, ThreadState
+from tests.utils import TARGET_DATE, createComment
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.manifest = Manifest(Path(self.temp_dir.name) / 'crawler.db')
+        self.addCleanup(self.manifest.close)
+
+    def test_compute_thread_states(self) -> None:
+        comments = [createComment('1', 1, 10), createComment('2', 5, 20), createComment('1', 3, 30)]
+        thread_states = Manifest.computeThreadStates(comments)
+        self.assertEqual(thread_states, {
+            '1': ThreadState(3, comments[2].date_with_usec, 2),
+            '2': ThreadState(5, comments[1].date_with_usec, 1),
+        })
+
+        # 既存の情報は書き換えずに、更新したものを返す
+        updated = Manifest.computeThreadStates([createComment('1', 4, 40)], thread_states)
+        self.assertEqual(updated['1'].last_no, 4)
+        self.assertEqual(updated['1'].comment_count, 3)
+        self.assertEqual(thread_states['1'].last_no, 3)
+
+    def test_save_and_get(self) -> None:
+        self.assertEqual(self.manifest.getThreadStates('jk1', TARGET_DATE), {})
+        self.assertIsNone(self.manifest.getFileState('jk1', TARGET_DATE))
+
+        thread_states = {'1': ThreadState(3, 1722783600.5, 2), '2': ThreadState(5, 1722783610.25, None)}
+        self.manifest.saveThreadStates('jk1', TARGET_DATE, thread_states)
+        self.manifest.saveFileState('jk1', TARGET_DATE, FileState('0' * 64, 100, 3))
+        self.assertEqual(self.manifest.getThreadStates('jk1', TARGET_DATE), thread_states)
+        self.assertEqual(self.manifest.getFileState('jk1', TARGET_DATE), FileState('0' * 64, 100, 3))
+
+        # 既存の記録はすべて置き換えられ、ほかの実況チャンネル・日付の記録には影響しない
+        self.manifest.saveThreadStates('jk1', TARGET_DATE, {'1': ThreadState(4, 1722783620.0, 3)})
+        self.assertEqual(self.manifest.getThreadStates('jk1', TARGET_DATE), {'1': ThreadState(4, 1722783620.0, 3)})
+        self.assertEqual(self.manifest.getThreadStates('jk2', TARGET_DATE), {})
+        self.assertEqual(self.manifest.getThreadStates('jk1', TARGET_DATE + timedelta(days=1)), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime
+
+from jkcommentcrawler.merge import getDateRange, getDateWithUsec, mergeComments, sliceComments, uniqueComments
+from tests.utils import DAY_END, DAY_START, TARGET_DATE, createComment
+
+
+class GetDateRangeTest(unittest.TestCase):
+
+    def test_range_matches_local_date(self) -> None:
+        start, end = getDateRange(TARGET_DATE)
+        self.assertEqual(datetime.fromtimestamp(start).date(), TARGET_DATE)
+        self.assertEqual(datetime.fromtimestamp(end - 0.000001).date(), TARGET_DATE)
+        self.assertNotEqual(datetime.fromtimestamp(end).date(), TARGET_DATE)
+
+
+class SliceCommentsTest(unittest.TestCase):
+
+    def test_start_is_inclusive_and_end_is_exclusive(self) -> None:
+        comments = [createComment('1', no, seconds) for no, seconds in enumerate([-1, 0, 1, 86399.999999, 86400, 86401], start=1)]
+        sliced = list(sliceComments(comments, DAY_START, DAY_END))
+        self.assertEqual([comment.no for comment in sliced], [2, 3, 4])
+
+    def test_empty(self) -> None:
+        self.assertEqual(list(sliceComments([], DAY_START, DAY_END)), [])
+
+
+class MergeCommentsTest(unittest.TestCase):
+
+    def test_merges_sources_in_date_order(self) -> None:
+        nicolive = [createComment('nicolive', no, seconds) for no, seconds in enumerate([-10, 5, 20, 86500], start=1)]
+        nx = [createComment('nx', no, seconds) for no, seconds in enumerate([1, 10, 15.5, 30, 90000], start=1)]
+        merged = list(mergeComments([nicolive, nx], DAY_START, DAY_END))
+
+        self.assertEqual([(comment.thread, comment.no) for comment in merged], [
+            ('nx', 1), ('nicolive', 2), ('nx', 2), ('nx', 3), ('nicolive', 3), ('nx', 4),
+        ])
+        self.assertEqual(merged, sorted(nicolive + nx, key=getDateWithUsec)[1:-2])
+
+    def test_no_sources(self) -> None:
+        self.assertEqual(list(mergeComments([], DAY_START, DAY_END)), [])
+        self.assertEqual(list(mergeComments([[], []], DAY_START, DAY_END)), [])
+
+
+class UniqueCommentsTest(unittest.TestCase):
+
+    def test_keeps_first_comment_of_each_thread_and_number(self) -> None:
+        downloaded = [createComment('1', 1, 10, content='new'), createComment('1', 2, 20)]
+        existing = [createComment('1', 1, 10, content='old'), createComment('2', 1, 10), createComment('1', 3, 30)]
+        unique = list(uniqueComments(downloaded + existing))
+
+        self.assertEqual([(comment.thread, comment.no) for comment in unique], [('1', 1), ('1', 2), ('2', 1), ('1', 3)])
+        self.assertEqual(unique[0].content, 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()
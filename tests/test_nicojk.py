@@ -0,0 +1,104 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.nicojk import NicojkWriter, appendComments, formatChat, hashFile, isAppendable, iterComments
+from tests.utils import createComment
+
+
+class FormatChatTest(unittest.TestCase):
+
+    def test_escape(self) -> None:
+        comment = createComment('1', 2, 11, content='<script>&"エスケープ"</script>')
+        self.assertEqual(formatChat(comment), (
+            f'<chat thread="1" no="2" vpos="1100" date="{comment.date}" date_usec="0" user_id="user-2" mail="184" premium="1" anonymity="1">'
+            '&lt;script&gt;&amp;"エスケープ"&lt;/script&gt;</chat>\n'
+        ))
+
+    def test_empty_content(self) -> None:
+        self.assertTrue(formatChat(createComment('1', 1, 10, content='')).endswith(' />\n'))
+
+
+class NicojkTestCase(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.path = Path(self.temp_dir.name) / 'jk1' / '2024' / '20240805.nicojk'
+
+    def writeComments(self, comments: list[Comment]) -> NicojkWriter:
+        with NicojkWriter(self.path) as writer:
+            for comment in comments:
+                writer.write(comment)
+            writer.commit()
+        return writer
+
+
+class NicojkWriterTest(NicojkTestCase):
+
+    def test_round_trip(self) -> None:
+        comments = [
+            createComment('1', 1, 10.5),
+            createComment('1', 2, 11, content='<script>&"エスケープ"</script>'),
+            createComment('1', 3, 12, content='改行を\n含むコメント'),
+            createComment('1', 4, 13, content=''),
+        ]
+        writer = self.writeComments(comments)
+
+        self.assertEqual(list(iterComments(self.path)), comments)
+        self.assertEqual(writer.count, len(comments))
+        self.assertEqual(writer.size, self.path.stat().st_size)
+        self.assertEqual(writer.sha256, hashFile(self.path))
+        self.assertEqual(self.path.read_text(encoding='utf-8'), ''.join(formatChat(comment) for comment in comments))
+
+    def test_uncommitted_writes_are_discarded(self) -> None:
+        self.writeComments([createComment('1', 1, 10)])
+        original = self.path.read_bytes()
+
+        with NicojkWriter(self.path) as writer:
+            writer.write(createComment('1', 2, 20))
+
+        self.assertEqual(self.path.read_bytes(), original)
+        self.assertEqual(list(self.path.parent.glob('*.tmp')), [])
+
+
+class AppendCommentsTest(NicojkTestCase):
+
+    def test_is_appendable(self) -> None:
+        self.assertFalse(isAppendable(self.path))
+        self.writeComments([createComment('1', 1, 10)])
+        self.assertTrue(isAppendable(self.path))
+        self.writeComments([createComment('1', 1, 10, content='')])
+        self.assertTrue(isAppendable(self.path))
+
+        # 書き込み途中で中断されたファイルや、ルート要素で囲まれたファイルには追記できない
+        self.path.write_text('<chat thread="1" no="1">途中', encoding='utf-8')
+        self.assertFalse(isAppendable(self.path))
+        self.path.write_text('<packet>\n<chat thread="1" no="1">コメント</chat>\n</packet>\n', encoding='utf-8')
+        self.assertFalse(isAppendable(self.path))
+        self.path.write_bytes(b'')
+        self.assertFalse(isAppendable(self.path))
+
+    def test_append(self) -> None:
+        existing = [createComment('1', 1, 10), createComment('1', 2, 20)]
+        new = [createComment('1', 3, 30), createComment('2', 1, 31)]
+        self.writeComments(existing)
+        appendComments(self.path, new)
+
+        self.assertEqual(list(iterComments(self.path)), existing + new)
+        self.assertTrue(isAppendable(self.path))
+
+    def test_append_to_file_without_trailing_newline(self) -> None:
+        existing = [createComment('1', 1, 10)]
+        new = [createComment('1', 2, 20)]
+        self.path.parent.mkdir(parents=True)
+        self.path.write_text(formatChat(existing[0]).rstrip('\n'), encoding='utf-8')
+        appendComments(self.path, new)
+
+        self.assertEqual(list(iterComments(self.path)), existing + new)
+        self.assertEqual(self.path.read_text(encoding='utf-8').count('\n'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
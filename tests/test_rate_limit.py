@@ -0,0 +1,205 @@
+import asyncio
+import httpx
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+from typing import Awaitable, Callable
+from unittest import mock
+
+from jkcommentcrawler.rate_limit import RateLimiter, TokenBucket, getRetryAfter, isRetryable
+from jkcommentcrawler.session import LoginError
+
+
+def createStatusError(status_code: int, headers: dict[str, str] | None = None) -> httpx.HTTPStatusError:
+    """
+    テスト用の HTTP のエラーレスポンスによる例外を作成する
+    """
+
+    request = httpx.Request('GET', 'https://example.com/')
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError(f'HTTP {status_code}', request=request, response=response)
+
+
+class FakeClockTestCase(unittest.TestCase):
+    """
+    time.monotonic() と asyncio.sleep() を偽の時計に置き換え、実際には待機せずに待機時間を記録するテストケース
+    """
+
+    def setUp(self) -> None:
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+
+        async def sleep(delay: float) -> None:
+            self.sleeps.append(delay)
+            self.now += delay
+
+        patchers = [
+            mock.patch('jkcommentcrawler.rate_limit.time', SimpleNamespace(monotonic=lambda: self.now)),
+            mock.patch('asyncio.sleep', sleep),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TokenBucketTest(FakeClockTestCase):
+
+    def test_acquire_waits_for_tokens(self) -> None:
+        async def acquire(bucket: TokenBucket, count: int) -> None:
+            for _ in range(count):
+                await bucket.acquire()
+
+        # 最初は capacity 件まで待たずに送信でき、その後は 1 / rate 秒ごとに1件ずつ送信できる
+        bucket = TokenBucket(2.0)
+        asyncio.run(acquire(bucket, 4))
+        self.assertEqual(self.sleeps, [0.5, 0.5])
+
+    def test_throttle_halves_rate_and_success_restores_it(self) -> None:
+        bucket = TokenBucket(4.0)
+        bucket.throttle(None)
+        self.assertEqual(bucket.rate, 2.0)
+        self.assertLessEqual(bucket.tokens, 0)
+
+        # 送信レートは元の 1/16 より下がらない
+        for _ in range(10):
+            bucket.throttle(None)
+        self.assertEqual(bucket.rate, 0.25)
+
+        # 成功するたびに元の送信レートの 1/10 ずつ戻り、元の送信レートは超えない
+        bucket.succeed()
+        self.assertAlmostEqual(bucket.rate, 0.65)
+        for _ in range(20):
+            bucket.succeed()
+        self.assertEqual(bucket.rate, 4.0)
+
+    def test_throttle_blocks_until_retry_after(self) -> None:
+        bucket = TokenBucket(4.0)
+        bucket.throttle(30.0)
+        asyncio.run(bucket.acquire())
+        self.assertEqual(self.sleeps[0], 30.0)
+
+
+class GetRetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self) -> None:
+        self.assertEqual(getRetryAfter(createStatusError(429, {'Retry-After': '120'})), 120.0)
+
+    def test_http_date(self) -> None:
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+        retry_after = getRetryAfter(createStatusError(503, {'Retry-After': format_datetime(retry_at, usegmt=True)}))
+        assert retry_after is not None
+        self.assertAlmostEqual(retry_after, 60.0, delta=2.0)
+
+        # 過去の日時は 0 秒として扱う
+        retry_at = datetime.now(timezone.utc) - timedelta(seconds=60)
+        self.assertEqual(getRetryAfter(createStatusError(503, {'Retry-After': format_datetime(retry_at, usegmt=True)})), 0.0)
+
+    def test_missing_or_invalid(self) -> None:
+        self.assertIsNone(getRetryAfter(createStatusError(429)))
+        self.assertIsNone(getRetryAfter(createStatusError(429, {'Retry-After': 'soon'})))
+        self.assertIsNone(getRetryAfter(httpx.ConnectError('Connection refused')))
+
+
+class IsRetryableTest(unittest.TestCase):
+
+    def test_status_codes(self) -> None:
+        for status_code in [408, 425, 429, 500, 502, 503, 504]:
+            self.assertTrue(isRetryable(createStatusError(status_code)))
+        for status_code in [400, 401, 403, 404, 410]:
+            self.assertFalse(isRetryable(createStatusError(status_code)))
+
+    def test_transport_error(self) -> None:
+        self.assertTrue(isRetryable(httpx.ConnectError('Connection refused')))
+        self.assertTrue(isRetryable(httpx.ReadTimeout('Timed out')))
+
+    def test_other_errors(self) -> None:
+        # ログインの失敗やレスポンスの内容が不正な場合など、通信エラー以外の例外はリトライしない
+        self.assertFalse(isRetryable(LoginError('Failed to login to niconico.')))
+        self.assertFalse(isRetryable(ValueError('Invalid JSON')))
+        self.assertFalse(isRetryable(RuntimeError('Unexpected error')))
+
+
+class RateLimiterTest(FakeClockTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.rate_limiter = RateLimiter({'example.com': 100.0})
+        self.retries: list[tuple[int, float]] = []
+
+    def createRequest(self, errors: list[Exception]) -> Callable[[], Awaitable[str]]:
+        """
+        errors の例外を順に送出した後に成功するリクエストを作成する
+        """
+
+        self.attempts = 0
+
+        async def send() -> str:
+            self.attempts += 1
+            if len(errors) > 0:
+                raise errors.pop(0)
+            return 'OK'
+
+        return send
+
+    def sendRequest(self, send: Callable[[], Awaitable[str]]) -> str:
+        return asyncio.run(self.rate_limiter.request('example.com', send, lambda host, attempt, error, delay: self.retries.append((attempt, delay))))
+
+    def test_backoff_full_jitter(self) -> None:
+        # 待機時間は 0 から BASE_DELAY * 2 ** (attempt - 1) (上限 MAX_DELAY) までの一様分布から選ばれる
+        ## random.uniform() が常に上限 (max) / 下限 (min) を返すようにして、範囲を確認する
+        with mock.patch('random.uniform', side_effect=max) as uniform:
+            self.assertEqual([self.rate_limiter.getBackoff(attempt, None) for attempt in [1, 2, 3, 7, 10]], [1.0, 2.0, 4.0, 60.0, 60.0])
+            self.assertTrue(all(call.args[0] == 0 for call in uniform.call_args_list))
+
+        # Retry-After が指定されている場合は、少なくともその時間は待機する
+        with mock.patch('random.uniform', side_effect=min):
+            self.assertEqual(self.rate_limiter.getBackoff(1, 30.0), 30.0)
+
+    def test_retries_transient_errors(self) -> None:
+        send = self.createRequest([httpx.ConnectError('Connection refused'), createStatusError(503, {'Retry-After': '5'})])
+        self.assertEqual(self.sendRequest(send), 'OK')
+        self.assertEqual(self.attempts, 3)
+        self.assertEqual([attempt for attempt, _ in self.retries], [1, 2])
+        self.assertGreaterEqual(self.retries[1][1], 5.0)
+
+        # 503 を受けたホストの送信レートは下がり、成功したことで少し戻る
+        self.assertEqual(self.rate_limiter.getBucket('example.com').rate, 60.0)
+
+    def test_gives_up_after_max_attempts(self) -> None:
+        errors: list[Exception] = [createStatusError(500) for _ in range(RateLimiter.MAX_ATTEMPTS)]
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.sendRequest(self.createRequest(errors))
+        self.assertEqual(self.attempts, RateLimiter.MAX_ATTEMPTS)
+        self.assertEqual(len(self.retries), RateLimiter.MAX_ATTEMPTS - 1)
+
+    def test_does_not_retry_client_errors(self) -> None:
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.sendRequest(self.createRequest([createStatusError(404), createStatusError(404)]))
+        self.assertEqual(self.attempts, 1)
+        self.assertEqual(self.retries, [])
+
+    def test_does_not_retry_login_errors(self) -> None:
+        with self.assertRaises(LoginError):
+            self.sendRequest(self.createRequest([LoginError('Failed to login to niconico.')]))
+        self.assertEqual(self.attempts, 1)
+        self.assertEqual(self.retries, [])
+
+    def test_retry_after_blocks_host(self) -> None:
+        self.assertEqual(self.sendRequest(self.createRequest([createStatusError(429, {'Retry-After': '30'})])), 'OK')
+        self.assertEqual(self.attempts, 2)
+        self.assertGreaterEqual(self.retries[0][1], 30.0)
+        self.assertEqual(self.rate_limiter.getBucket('example.com').blocked_until, 1030.0)
+
+    def test_gives_up_when_retry_after_is_too_long(self) -> None:
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.sendRequest(self.createRequest([createStatusError(429, {'Retry-After': '3600'})]))
+        self.assertEqual(self.attempts, 1)
+        self.assertEqual(self.retries, [])
+
+        # 諦めたリクエストの Retry-After で、そのホストへのほかのリクエストまで長時間止めない
+        self.assertEqual(self.rate_limiter.getBucket('example.com').blocked_until, 1000.0 + RateLimiter.MAX_RETRY_AFTER)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import asyncio
+import httpx
+import json
+import tempfile
+import unittest
+from ndgr_client import NDGRClient
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, cast
+from unittest import mock
+
+from jkcommentcrawler.session import LoginError, NicoliveSession
+
+
+class FakeNDGRClient:
+    """
+    ログインの呼び出しを記録する NDGRClient の代わり
+    """
+
+    def __init__(self, cookies: dict[str, Any] | None, shareable: bool = True) -> None:
+        # NDGRClient と同じく、インスタンスごとに httpx.AsyncClient を作成する
+        self.httpx_client: Any = httpx.AsyncClient(headers={'User-Agent': 'NDGRClient'}) if shareable is True else None
+        self.cookies = cookies
+        self.login_calls: list[str] = []
+
+    async def login(self, mail: str | None = None, password: str | None = None, cookies: dict[str, Any] | None = None) -> dict[str, Any] | None:
+        self.login_calls.append('cookies' if cookies is not None else 'password')
+        return self.cookies
+
+
+class NicoliveSessionTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.cookies_json = Path(self.temp_dir.name) / 'cookies.json'
+        self.session = NicoliveSession('mail@example.com', 'password', self.cookies_json)
+
+        # ログインセッションの有効期間を、実際には待機せずに経過させる
+        self.now = 1000.0
+        patcher = mock.patch('jkcommentcrawler.session.time', SimpleNamespace(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def prepare(self, client: FakeNDGRClient) -> None:
+        await self.session.prepare(cast(NDGRClient, client))
+
+    def test_shares_client_and_logs_in_once(self) -> None:
+        clients = [FakeNDGRClient({'user_session': 'session'}) for _ in range(3)]
+        original_clients = [client.httpx_client for client in clients]
+
+        async def main() -> None:
+            for client in clients:
+                await self.prepare(client)
+
+            # 共有クライアントに差し替えられ、NDGRClient が作成した httpx.AsyncClient は閉じられる
+            self.assertTrue(all(client.httpx_client is self.session.httpx_client for client in clients))
+            self.assertTrue(all(original_client.is_closed for original_client in original_clients))
+            assert self.session.httpx_client is not None
+            self.assertEqual(self.session.httpx_client.headers['User-Agent'], 'NDGRClient')
+            await self.session.close()
+        asyncio.run(main())
+
+        # cookies.json がないため、最初の1回だけメールアドレスとパスワードでログインする
+        self.assertEqual([client.login_calls for client in clients], [['password'], [], []])
+        self.assertEqual(json.loads(self.cookies_json.read_text(encoding='utf-8')), {'user_session': 'session'})
+
+    def test_relogs_in_after_session_lifetime(self) -> None:
+        self.cookies_json.write_text(json.dumps({'user_session': 'session'}), encoding='utf-8')
+        clients = [FakeNDGRClient({'user_session': 'session'}) for _ in range(3)]
+
+        async def main() -> None:
+            await self.prepare(clients[0])
+            self.now += NicoliveSession.SESSION_LIFETIME - 1
+            await self.prepare(clients[1])
+            self.now += 1
+            await self.prepare(clients[2])
+            await self.session.close()
+        asyncio.run(main())
+
+        # 有効期間を過ぎたら、cookies.json の Cookie でログインし直す
+        self.assertEqual([client.login_calls for client in clients], [['cookies'], [], ['cookies']])
+
+    def test_relogs_in_after_invalidate(self) -> None:
+        clients = [FakeNDGRClient({'user_session': 'session'}) for _ in range(2)]
+
+        async def main() -> None:
+            await self.prepare(clients[0])
+            self.session.invalidate()
+            await self.prepare(clients[1])
+            await self.session.close()
+        asyncio.run(main())
+
+        # コメントのダウンロードに失敗した後は、有効期間内でもログインし直す
+        self.assertEqual([client.login_calls for client in clients], [['password'], ['cookies']])
+
+    def test_login_failure_is_not_retried(self) -> None:
+        clients = [FakeNDGRClient(None) for _ in range(2)]
+
+        async def main() -> None:
+            for client in clients:
+                with self.assertRaises(LoginError):
+                    await self.prepare(client)
+            await self.session.close()
+        asyncio.run(main())
+
+        # 一度ログインに失敗したら、以降の NDGRClient ではログインを試みずに同じ例外を送出する
+        self.assertEqual([client.login_calls for client in clients], [['password'], []])
+        self.assertFalse(self.cookies_json.exists())
+
+    def test_worker_logs_in_with_parent_cookies(self) -> None:
+        # ワーカープロセスでは、親プロセスから渡された Cookie だけでログインし、cookies.json を読み書きしない
+        self.cookies_json.write_text(json.dumps({'user_session': 'stale'}), encoding='utf-8')
+        self.session = NicoliveSession('mail@example.com', 'password', None, {'user_session': 'parent'})
+        client = FakeNDGRClient({'user_session': 'parent'})
+
+        async def main() -> None:
+            await self.prepare(client)
+            await self.session.close()
+        asyncio.run(main())
+
+        self.assertEqual(client.login_calls, ['cookies'])
+        self.assertEqual(json.loads(self.cookies_json.read_text(encoding='utf-8')), {'user_session': 'stale'})
+
+    def test_worker_never_logs_in_with_password(self) -> None:
+        # 親プロセスのログインに失敗した場合や Cookie が無効な場合も、ワーカープロセスでは新規ログインしない
+        for cookies, login_calls in [(None, []), ({'user_session': 'expired'}, ['cookies'])]:
+            with self.subTest(cookies=cookies):
+                self.session = NicoliveSession('mail@example.com', 'password', None, cookies)
+                client = FakeNDGRClient(None)
+
+                async def main() -> None:
+                    with self.assertRaises(LoginError):
+                        await self.prepare(client)
+                    await self.session.close()
+                asyncio.run(main())
+
+                self.assertEqual(client.login_calls, login_calls)
+                self.assertFalse(self.cookies_json.exists())
+
+    def test_unshareable_client_logs_in_every_time(self) -> None:
+        # NDGRClient.httpx_client がない (型が異なる) 場合は差し替えず、NDGRClient ごとにログインする
+        clients = [FakeNDGRClient({'user_session': 'session'}, shareable=False) for _ in range(2)]
+
+        async def main() -> None:
+            for client in clients:
+                await self.prepare(client)
+            self.assertIsNone(self.session.httpx_client)
+        asyncio.run(main())
+
+        self.assertEqual([client.login_calls for client in clients], [['password'], ['cookies']])
+        self.assertTrue(all(client.httpx_client is None for client in clients))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import tempfile
+import unittest
+from datetime import date
+from pathlib import Path
+from typing import Any
+from unittest import mock
+
+from jkcommentcrawler.crawler import CommentCrawler
+from jkcommentcrawler.sharding import createWorkerOptions, getShardIndex, getShardKey, parseShard
+
+
+class ParseShardTest(unittest.TestCase):
+
+    def test_valid(self) -> None:
+        self.assertEqual(parseShard('0/1'), (0, 1))
+        self.assertEqual(parseShard('0/3'), (0, 3))
+        self.assertEqual(parseShard('2/3'), (2, 3))
+
+    def test_invalid(self) -> None:
+        for shard in ['', '1', '3/3', '-1/3', '0/0', '1/0', 'a/3', '0/3/1', '0.5/3']:
+            with self.subTest(shard=shard):
+                with self.assertRaises(ValueError):
+                    parseShard(shard)
+
+
+class GetShardIndexTest(unittest.TestCase):
+
+    def test_shard_key(self) -> None:
+        self.assertEqual(getShardKey('jk1'), 'jk1')
+        self.assertEqual(getShardKey('jk1', date(2024, 8, 5)), 'jk1/20240805')
+
+    def test_is_stable_across_processes(self) -> None:
+        # CRC32 で求めるため、PYTHONHASHSEED に関係なくどのプロセス・ホストでも同じ値になる
+        self.assertEqual(getShardIndex('jk1', 3), 1)
+        self.assertEqual(getShardIndex('jk1/20240805', 3), 1)
+        self.assertEqual(getShardIndex('jk211', 4), 1)
+
+    def test_every_job_is_assigned_to_exactly_one_shard(self) -> None:
+        shard_count = 3
+        keys = [getShardKey(f'jk{number}', date(2024, 8, day)) for number in range(1, 12) for day in range(1, 32)]
+        assigned = [[key for key in keys if getShardIndex(key, shard_count) == shard_index] for shard_index in range(shard_count)]
+
+        self.assertEqual(sorted(key for shard in assigned for key in shard), sorted(keys))
+        self.assertTrue(all(len(shard) > 0 for shard in assigned))
+
+    def test_single_shard(self) -> None:
+        self.assertEqual(getShardIndex('jk1', 1), 0)
+
+
+
+class CreateWorkerOptionsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        work_dir = Path(self.temp_dir.name)
+        self.crawler_options: dict[str, Any] = dict(
+            kakolog_dir = work_dir / 'kakolog',
+            niconico_mail = '',
+            niconico_password = '',
+            channel_concurrency = 8,
+            nicolive_concurrency = 2,
+            nx_concurrency = 4,
+            nicolive_rate_limit = 2.0,
+            nx_rate_limit = 5.0,
+            database_path = work_dir / 'crawler.db',
+        )
+
+    def test_single_worker(self) -> None:
+        # ワーカープロセスが1つ以下の場合は、このプロセスで収集するためそのまま使う
+        with mock.patch.object(CommentCrawler, 'loginNicolive') as login:
+            self.assertIs(asyncio.run(createWorkerOptions(self.crawler_options, 1, ['jk1'])), self.crawler_options)
+        login.assert_not_called()
+
+    def test_budgets_are_divided_and_login_is_shared(self) -> None:
+        with mock.patch.object(CommentCrawler, 'loginNicolive', return_value={'user_session': 'session'}) as login:
+            worker_options = asyncio.run(createWorkerOptions(self.crawler_options, 4, ['jk1', 'jk2']))
+
+        # ニコニコ生放送へのログインはこのプロセスで1回だけ行い、Cookie をワーカープロセスに渡す
+        login.assert_awaited_once_with(['jk1', 'jk2'])
+        self.assertIsNone(worker_options['cookies_json'])
+        self.assertEqual(worker_options['nicolive_cookies'], {'user_session': 'session'})
+
+        # 同時実行数と送信レートの制限はワーカープロセスの数で等分する (同時実行数は最低 1)
+        self.assertEqual(worker_options['channel_concurrency'], 2)
+        self.assertEqual(worker_options['nicolive_concurrency'], 1)
+        self.assertEqual(worker_options['nx_concurrency'], 1)
+        self.assertEqual(worker_options['nicolive_rate_limit'], 0.5)
+        self.assertEqual(worker_options['nx_rate_limit'], 1.25)
+
+        # 元の引数は変更しない
+        self.assertEqual(self.crawler_options['channel_concurrency'], 8)
+        self.assertNotIn('nicolive_cookies', self.crawler_options)
+
+
+if __name__ == '__main__':
+    unittest.main()
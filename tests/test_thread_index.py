@@ -0,0 +1,75 @@
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+from jkcommentcrawler.nx_client import ThreadInfo
+from jkcommentcrawler.thread_index import ThreadIndex
+from tests.utils import TARGET_DATE
+
+
+class ThreadIndexTest(unittest.TestCase):
+
+    JST = timezone(timedelta(hours=9))
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.thread_index = ThreadIndex(Path(self.temp_dir.name) / 'crawler.db')
+        self.addCleanup(self.thread_index.close)
+
+    def createThread(self, thread_id: int, start_date: date, status: str) -> ThreadInfo:
+        start_at = datetime(start_date.year, start_date.month, start_date.day, 4, 0, tzinfo=self.JST)
+        return ThreadInfo(id=thread_id, start_at=start_at, end_at=start_at + timedelta(days=1), title='', description='', status=status)
+
+    def test_query(self) -> None:
+        self.thread_index.update('jk1', [
+            self.createThread(1, TARGET_DATE - timedelta(days=1), 'PAST'),
+            self.createThread(2, TARGET_DATE, 'PAST'),
+            self.createThread(3, TARGET_DATE + timedelta(days=1), 'ACTIVE'),
+        ])
+        self.assertEqual(self.thread_index.query('jk1', TARGET_DATE), [(1, 'PAST'), (2, 'PAST')])
+        self.assertEqual(self.thread_index.query('jk2', TARGET_DATE), [])
+
+    def test_is_up_to_date(self) -> None:
+        # 指定した日付より後に終了するスレッドがない場合は、スレッドが揃っていない可能性がある
+        self.thread_index.update('jk1', [self.createThread(1, TARGET_DATE - timedelta(days=1), 'PAST')])
+        self.assertFalse(self.thread_index.isUpToDate('jk1', TARGET_DATE))
+
+        # 放送終了済みのスレッドだけなら、更新から時間が経っていても最新とみなす
+        self.thread_index.update('jk1', [self.createThread(2, TARGET_DATE, 'PAST')])
+        self.thread_index.connection.execute('UPDATE nx_thread_index_updates SET updated_at = 0')
+        self.assertTrue(self.thread_index.isUpToDate('jk1', TARGET_DATE))
+
+        # 放送中のスレッドを含む場合は、REFRESH_INTERVAL 秒以内に更新していれば最新とみなす
+        thread = self.createThread(3, TARGET_DATE + timedelta(days=1), 'ACTIVE')
+        with mock.patch('time.time', return_value=thread.start_at.timestamp() + 60 * 60):
+            self.thread_index.update('jk1', [thread])
+            self.assertTrue(self.thread_index.isUpToDate('jk1', TARGET_DATE + timedelta(days=1)))
+            self.thread_index.connection.execute('UPDATE nx_thread_index_updates SET updated_at = 0')
+            self.assertFalse(self.thread_index.isUpToDate('jk1', TARGET_DATE + timedelta(days=1)))
+
+    def test_is_not_up_to_date_after_newest_thread_ended(self) -> None:
+        # インデックス内で最新のスレッドが放送終了していれば、REFRESH_INTERVAL 秒以内に更新していても新しいスレッドがある可能性がある
+        thread = self.createThread(1, TARGET_DATE, 'ACTIVE')
+        with mock.patch('time.time', return_value=thread.start_at.timestamp() + 60 * 60):
+            self.thread_index.update('jk1', [thread])
+            self.assertTrue(self.thread_index.isUpToDate('jk1', TARGET_DATE))
+        with mock.patch('time.time', return_value=thread.end_at.timestamp() + 60):
+            self.assertFalse(self.thread_index.isUpToDate('jk1', TARGET_DATE))
+
+        # 新しいスレッドをインデックスに追加すれば、再び最新とみなす
+        with mock.patch('time.time', return_value=thread.end_at.timestamp() + 60):
+            self.thread_index.update('jk1', [self.createThread(2, TARGET_DATE + timedelta(days=1), 'ACTIVE')])
+            self.assertTrue(self.thread_index.isUpToDate('jk1', TARGET_DATE))
+
+    def test_past_threads_are_never_updated(self) -> None:
+        self.thread_index.update('jk1', [self.createThread(1, TARGET_DATE, 'ACTIVE')])
+        self.thread_index.update('jk1', [self.createThread(1, TARGET_DATE, 'PAST')])
+        self.thread_index.update('jk1', [self.createThread(1, TARGET_DATE, 'ACTIVE')])
+        self.assertEqual(self.thread_index.query('jk1', TARGET_DATE), [(1, 'PAST')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+from datetime import date
+
+from jkcommentcrawler.comment import Comment
+from jkcommentcrawler.merge import getDateRange
+
+
+# テストで使う日付と、その日付の 00:00:00 の UNIX タイムスタンプ
+TARGET_DATE = date(2024, 8, 5)
+DAY_START, DAY_END = getDateRange(TARGET_DATE)
+
+
+def createComment(thread: str, no: int, seconds: float, vpos: int | None = None, content: str = 'コメント') -> Comment:
+    """
+    テスト用のコメントを作成する
+
+    Args:
+        thread (str): スレッド ID
+        no (int): コメント番号
+        seconds (float): TARGET_DATE の 00:00:00 からの経過時間 (秒) で表した投稿日時 (マイクロ秒単位まで)
+        vpos (int | None, default=None): vpos (None の場合は seconds から求める)
+        content (str, default='コメント'): コメント本文
+
+    Returns:
+        Comment: 作成したコメント
+    """
+
+    timestamp = int(DAY_START) + seconds
+    return Comment.create(
+        thread = thread,
+        no = no,
+        vpos = vpos if vpos is not None else round(seconds * 100),
+        date = int(timestamp),
+        date_usec = round((timestamp % 1) * 1000000),
+        user_id = f'user-{no}',
+        mail = '184',
+        premium = 1 if no % 2 == 0 else None,
+        anonymity = 1,
+        content = content,
+    )